@@ -86,28 +86,7 @@ def handle(_name, cfg, cloud, log, _args):
         genkeys = util.get_cfg_option_list(cfg,
                                            'ssh_genkeytypes',
                                            GENERATE_KEY_NAMES)
-        lang_c = os.environ.copy()
-        lang_c['LANG'] = 'C'
-        for keytype in genkeys:
-            keyfile = KEY_FILE_TPL % (keytype)
-            if os.path.exists(keyfile):
-                continue
-            util.ensure_dir(os.path.dirname(keyfile))
-            cmd = ['ssh-keygen', '-t', keytype, '-N', '', '-f', keyfile]
-
-            # TODO(harlowja): Is this guard needed?
-            with util.SeLinuxGuard("/etc/ssh", recursive=True):
-                try:
-                    out, err = util.subp(cmd, capture=True, env=lang_c)
-                    sys.stdout.write(util.decode_binary(out))
-                except util.ProcessExecutionError as e:
-                    err = util.decode_binary(e.stderr).lower()
-                    if (e.exit_code == 1 and
-                            err.lower().startswith("unknown key")):
-                        log.debug("ssh-keygen: unknown key type '%s'", keytype)
-                    else:
-                        util.logexc(log, "Failed generating key type %s to "
-                                    "file %s", keytype, keyfile)
+        generate_host_keys(genkeys, log)
 
     try:
         (users, _groups) = ds.normalize_users_groups(cfg, cloud.distro)
@@ -126,11 +105,49 @@ def handle(_name, cfg, cloud, log, _args):
         util.logexc(log, "Applying ssh credentials failed!")
 
 
+def generate_host_keys(keytypes, log):
+    """Generate the host keys of keytypes that don't exist yet.
+
+    The ssh-keygen runs are independent of each other and mostly wait on
+    entropy, so they are run concurrently.
+    """
+    lang_c = os.environ.copy()
+    lang_c['LANG'] = 'C'
+    missing = []
+    for keytype in keytypes:
+        keyfile = KEY_FILE_TPL % (keytype)
+        if os.path.exists(keyfile):
+            continue
+        util.ensure_dir(os.path.dirname(keyfile))
+        missing.append((keytype, keyfile))
+    if not missing:
+        return
+
+    cmds = [['ssh-keygen', '-t', keytype, '-N', '', '-f', keyfile]
+            for (keytype, keyfile) in missing]
+    # TODO(harlowja): Is this guard needed?
+    with util.SeLinuxGuard("/etc/ssh", recursive=True):
+        results = util.subp_batch(cmds, max_workers=len(cmds),
+                                  capture=True, env=lang_c)
+
+    for ((keytype, keyfile), result) in zip(missing, results):
+        if isinstance(result, util.ProcessExecutionError):
+            err = util.decode_binary(result.stderr).lower()
+            if result.exit_code == 1 and err.startswith("unknown key"):
+                log.debug("ssh-keygen: unknown key type '%s'", keytype)
+            else:
+                log.warn("Failed generating key type %s to file %s: %s",
+                         keytype, keyfile, result)
+        else:
+            sys.stdout.write(util.decode_binary(result[0]))
+
+
 def apply_credentials(keys, user, disable_root, disable_root_opts):
 
     keys = set(keys)
+    users_keys = []
     if user:
-        ssh_util.setup_user_keys(keys, user)
+        users_keys.append((keys, user, None))
 
     if disable_root:
         if not user:
@@ -139,4 +156,5 @@ def apply_credentials(keys, user, disable_root, disable_root_opts):
     else:
         key_prefix = ''
 
-    ssh_util.setup_user_keys(keys, 'root', options=key_prefix)
+    users_keys.append((keys, 'root', key_prefix))
+    ssh_util.setup_users_keys(users_keys)
@@ -28,7 +28,4 @@ frequency = PER_INSTANCE
 
 def handle(name, cfg, cloud, _log, _args):
     (users, groups) = ds.normalize_users_groups(cfg, cloud.distro)
-    for (name, members) in groups.items():
-        cloud.distro.create_group(name, members)
-    for (user, config) in users.items():
-        cloud.distro.create_user(user, **config)
+    cloud.distro.create_users(users, groups)
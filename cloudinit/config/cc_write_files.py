@@ -36,7 +36,9 @@ def handle(name, cfg, _cloud, log, _args):
         log.debug(("Skipping module named %s,"
                    " no/empty 'write_files' key in configuration"), name)
         return
-    write_files(name, files, log)
+    max_size = util.get_cfg_option_int(cfg, 'decompress_max_size',
+                                       util.DECOMP_MAX_SIZE)
+    write_files(name, files, log, max_size=max_size)
 
 
 def canonicalize_extraction(encoding_type, log):
@@ -47,6 +49,15 @@ def canonicalize_extraction(encoding_type, log):
         return ['application/x-gzip']
     if encoding_type in ['gz+base64', 'gzip+base64', 'gz+b64', 'gzip+b64']:
         return ['application/base64', 'application/x-gzip']
+    if encoding_type in ['bz2', 'bzip2']:
+        return ['application/x-bzip2']
+    if encoding_type in ['bz2+base64', 'bzip2+base64', 'bz2+b64',
+                         'bzip2+b64']:
+        return ['application/base64', 'application/x-bzip2']
+    if encoding_type in ['xz']:
+        return ['application/x-xz']
+    if encoding_type in ['xz+base64', 'xz+b64']:
+        return ['application/base64', 'application/x-xz']
     # Yaml already encodes binary data as base64 if it is given to the
     # yaml file as binary, so those will be automatically decoded for you.
     # But the above b64 is just for people that are more 'comfortable'
@@ -59,7 +70,7 @@ def canonicalize_extraction(encoding_type, log):
     return [UNKNOWN_ENC]
 
 
-def write_files(name, files, log):
+def write_files(name, files, log, max_size=None):
     if not files:
         return
 
@@ -71,7 +82,8 @@ def write_files(name, files, log):
             continue
         path = os.path.abspath(path)
         extractions = canonicalize_extraction(f_info.get('encoding'), log)
-        contents = extract_contents(f_info.get('content', ''), extractions)
+        contents = extract_contents(f_info.get('content', ''), extractions,
+                                    max_size=max_size)
         (u, g) = util.extract_usergroup(f_info.get('owner', DEFAULT_OWNER))
         perms = decode_perms(f_info.get('permissions'), DEFAULT_PERMS, log)
         util.write_file(path, contents, mode=perms)
@@ -91,11 +103,20 @@ def decode_perms(perm, default, log):
         return default
 
 
-def extract_contents(contents, extraction_types):
+DECOMP_TYPES = {
+    'application/x-bzip2': 'bzip2',
+    'application/x-gzip': 'gzip',
+    'application/x-xz': 'xz',
+}
+
+
+def extract_contents(contents, extraction_types, max_size=None):
     result = contents
     for t in extraction_types:
-        if t == 'application/x-gzip':
-            result = util.decomp_gzip(result, quiet=False, decode=False)
+        if t in DECOMP_TYPES:
+            result = util.decompress(result, quiet=False, decode=False,
+                                     max_size=max_size,
+                                     types=(DECOMP_TYPES[t],))
         elif t == 'application/base64':
             result = base64.b64decode(result)
         elif t == UNKNOWN_ENC:
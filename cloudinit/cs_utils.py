@@ -34,6 +34,7 @@ import json
 import platform
 
 import serial
+import six
 
 # these high timeouts are necessary as read may read a lot of data.
 READ_TIMEOUT = 60
@@ -48,13 +49,30 @@ class Cepko(object):
     """
     One instance of that object could be use for one or more
     queries to the serial port.
+
+    With bulk=True the whole server context is read once (on the first
+    query) and all queries are answered from it.  Keys it lacks are
+    still asked over the serial port.  context may be given (the json
+    of a context read earlier) to avoid the serial port altogether.
     """
     request_pattern = "<\n{}\n>"
 
+    def __init__(self, bulk=False, context=None):
+        self.bulk = bulk
+        self._context = None
+        if context is not None:
+            self._context = CepkoResult(self.request_pattern.format(""),
+                                        raw_result=context)
+
     def get(self, key="", request_pattern=None):
         if request_pattern is None:
             request_pattern = self.request_pattern
-        return CepkoResult(request_pattern.format(key))
+        request = request_pattern.format(key)
+        if not self.bulk:
+            return CepkoResult(request)
+        if self._context is None:
+            self._context = CepkoResult(self.request_pattern.format(""))
+        return self._context.lookup(request)
 
     def all(self):
         return self.get()
@@ -71,20 +89,25 @@ class Cepko(object):
 class CepkoResult(object):
     """
     CepkoResult executes the request to the virtual serial port as soon
-    as the instance is initialized and stores the result in both raw and
-    marshalled format.
+    as the instance is initialized (unless given its raw_result) and stores
+    the result in both raw and marshalled format.
     """
-    def __init__(self, request):
+    def __init__(self, request, raw_result=None):
         self.request = request
-        self.raw_result = self._execute()
+        if raw_result is None:
+            raw_result = self._execute()
+        self.raw_result = raw_result
         self.result = self._marshal(self.raw_result)
 
     def _execute(self):
         connection = serial.Serial(port=SERIAL_PORT,
                                    timeout=READ_TIMEOUT,
                                    writeTimeout=WRITE_TIMEOUT)
-        connection.write(self.request.encode('ascii'))
-        return connection.readline().strip(b'\x04\n').decode('ascii')
+        try:
+            connection.write(self.request.encode('ascii'))
+            return connection.readline().strip(b'\x04\n').decode('ascii')
+        finally:
+            connection.close()
 
     def _marshal(self, raw_result):
         try:
@@ -92,6 +115,29 @@ class CepkoResult(object):
         except ValueError:
             return raw_result
 
+    def lookup(self, request):
+        """
+        Answer request from this (whole context) result, the way the serial
+        port would; when the path it names isn't there ask the serial port.
+        """
+        path = request[len("<\n"):-len("\n>")]
+        value = self.result
+        try:
+            for part in [p for p in path.split('/') if p]:
+                if isinstance(value, list):
+                    value = value[int(part)]
+                else:
+                    value = value[part]
+        except (KeyError, IndexError, ValueError, TypeError):
+            return CepkoResult(request)
+        if value is self.result:
+            return self
+        if isinstance(value, six.string_types):
+            raw_result = value
+        else:
+            raw_result = json.dumps(value)
+        return CepkoResult(request, raw_result=raw_result)
+
     def __len__(self):
         return self.result.__len__()
 
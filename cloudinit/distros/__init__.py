@@ -23,6 +23,7 @@
 
 import six
 from six import StringIO
+from six.moves import shlex_quote
 
 import abc
 import os
@@ -49,6 +50,14 @@ OSFAMILIES = {
 
 LOG = logging.getLogger(__name__)
 
+# Marks (on stderr) the commands of a batch that failed
+BATCH_FAILED = "cloud-init-batch-failed"
+
+# What create_users does itself (in batches) for distros that don't replace
+# any of these
+USER_METHODS = ('add_user', 'create_user', 'create_group', 'lock_passwd',
+                'set_passwd', 'write_sudo_rules')
+
 
 class Distro(object):
     __metaclass__ = abc.ABCMeta
@@ -128,19 +137,25 @@ class Distro(object):
                                         mirror_info=arch_info)
 
     def apply_network(self, settings, bring_up=True):
-        # Write it out
+        # Write it out (only the devices whose config changed come back)
         dev_names = self._write_network(settings)
         # Now try to bring them up
-        if bring_up:
+        if bring_up and dev_names:
             return self._bring_up_interfaces(dev_names)
+        elif bring_up:
+            LOG.debug("Network configuration unchanged, not bringing up "
+                      "interfaces")
         return False
 
     def apply_network_config(self, netconfig, bring_up=False):
-        # Write it out
+        # Write it out (only the devices whose config changed come back)
         dev_names = self._write_network_config(netconfig)
         # Now try to bring them up
-        if bring_up:
+        if bring_up and dev_names:
             return self._bring_up_interfaces(dev_names)
+        elif bring_up:
+            LOG.debug("Network configuration unchanged, not bringing up "
+                      "interfaces")
         return False
 
     @abc.abstractmethod
@@ -322,19 +337,12 @@ class Distro(object):
     def get_default_user(self):
         return self.get_option('default_user')
 
-    def add_user(self, name, **kwargs):
+    def _useradd_cmd(self, name, kwargs):
         """
-        Add a user to the system using standard GNU tools
+        Return the useradd command adding user name (as add_user would for
+        kwargs), the form of it to log and the groups the user is to be in.
         """
-        if util.is_user(name):
-            LOG.info("User %s already exists, skipping." % name)
-            return
-
-        if 'create_groups' in kwargs:
-            create_groups = kwargs.pop('create_groups')
-        else:
-            create_groups = True
-
+        kwargs = dict(kwargs)
         adduser_cmd = ['useradd', name]
         log_adduser_cmd = ['useradd', name]
 
@@ -369,6 +377,7 @@ class Distro(object):
                 # kwargs.items loop below wants a comma delimeted string
                 # that can go right through to the command.
                 kwargs['groups'] = ",".join(groups)
+                groups = list(groups)
             else:
                 groups = groups.split(",")
 
@@ -376,12 +385,6 @@ class Distro(object):
             if primary_group:
                 groups.append(primary_group)
 
-        if create_groups and groups:
-            for group in groups:
-                if not util.is_group(group):
-                    self.create_group(group)
-                    LOG.debug("created group %s for user %s", name, group)
-
         # Check the values and create the command
         for key, val in kwargs.items():
 
@@ -407,6 +410,30 @@ class Distro(object):
             adduser_cmd.append('-m')
             log_adduser_cmd.append('-m')
 
+        return (adduser_cmd, log_adduser_cmd, groups or [])
+
+    def add_user(self, name, **kwargs):
+        """
+        Add a user to the system using standard GNU tools
+        """
+        if util.is_user(name):
+            LOG.info("User %s already exists, skipping." % name)
+            return
+
+        if 'create_groups' in kwargs:
+            create_groups = kwargs.pop('create_groups')
+        else:
+            create_groups = True
+
+        (adduser_cmd, log_adduser_cmd, groups) = self._useradd_cmd(name,
+                                                                   kwargs)
+
+        if create_groups and groups:
+            for group in groups:
+                if not util.is_group(group):
+                    self.create_group(group)
+                    LOG.debug("created group %s for user %s", name, group)
+
         # Run the command
         LOG.debug("Adding user %s", name)
         try:
@@ -443,6 +470,17 @@ class Distro(object):
             self.write_sudo_rules(name, kwargs['sudo'])
 
         # Import SSH keys
+        self._setup_user_keys(name, kwargs)
+
+        return True
+
+    def _setup_user_keys(self, name, kwargs):
+        keys = self._user_keys(kwargs)
+        if keys is not None:
+            ssh_util.setup_user_keys(keys, name, options=None)
+
+    def _user_keys(self, kwargs):
+        # The keys to import for a user, or None when there are none
         if 'ssh_authorized_keys' in kwargs:
             # Try to handle this in a smart manner.
             keys = kwargs['ssh_authorized_keys']
@@ -456,10 +494,8 @@ class Distro(object):
                              " 'ssh_authorized_keys', expected list,"
                              " string, dict, or set.", type(keys))
                 else:
-                    keys = set(keys) or []
-                    ssh_util.setup_user_keys(keys, name, options=None)
-
-        return True
+                    return set(keys) or []
+        return None
 
     def lock_passwd(self, name):
         """
@@ -533,10 +569,7 @@ class Distro(object):
                 raise e
         util.ensure_dir(path, 0o750)
 
-    def write_sudo_rules(self, user, rules, sudo_file=None):
-        if not sudo_file:
-            sudo_file = self.ci_sudoers_fn
-
+    def _sudo_rules(self, user, rules):
         lines = [
             '',
             "# User rules for %s" % user,
@@ -551,6 +584,14 @@ class Distro(object):
             raise TypeError(msg % (type_utils.obj_name(rules)))
         content = "\n".join(lines)
         content += "\n"  # trailing newline
+        return content
+
+    def write_sudo_rules(self, user, rules, sudo_file=None):
+        self._write_sudo_content(self._sudo_rules(user, rules), sudo_file)
+
+    def _write_sudo_content(self, content, sudo_file=None):
+        if not sudo_file:
+            sudo_file = self.ci_sudoers_fn
 
         self.ensure_sudo_dir(os.path.dirname(sudo_file))
         if not os.path.exists(sudo_file):
@@ -596,6 +637,165 @@ class Distro(object):
                 util.subp(['usermod', '-a', '-G', name, member])
                 LOG.info("Added user '%s' to group '%s'" % (member, name))
 
+    def _batch_users_supported(self):
+        # distros doing any of the per user steps their own way (ie. with
+        # pw on freebsd) have them done one user at a time
+        for method in USER_METHODS:
+            if (six.get_unbound_function(getattr(type(self), method)) is not
+                    six.get_unbound_function(getattr(Distro, method))):
+                return False
+        return True
+
+    def _run_batch(self, commands, what):
+        """
+        Run commands, a list of (args, args to log), in one shell.
+
+        Returns the indexes of the commands that failed (with their exit
+        codes) in a dict.
+        """
+        if not commands:
+            return {}
+        lines = []
+        for (index, (args, _log_args)) in enumerate(commands):
+            lines.append("%s || echo %s %s $? >&2" % (
+                " ".join(shlex_quote(arg) for arg in args), BATCH_FAILED,
+                index))
+        LOG.debug("Running %s %s commands: %s", len(commands), what,
+                  "; ".join(" ".join(log_args)
+                            for (_args, log_args) in commands))
+        (_out, err) = util.subp(
+            ['sh'], data="\n".join(lines) + "\n",
+            logstring="%s %s commands" % (len(commands), what))
+        failed = {}
+        for line in err.splitlines():
+            words = line.split()
+            if len(words) == 3 and words[0] == BATCH_FAILED:
+                failed[int(words[1])] = int(words[2])
+            elif line.strip():
+                LOG.debug("%s: %s", what, line)
+        return failed
+
+    def _batch_chpasswd(self, passwords, hashed=False):
+        """Set passwords (a list of (user, password)) with one chpasswd."""
+        if not passwords:
+            return
+        cmd = ['chpasswd']
+        if hashed:
+            cmd.append('-e')
+        data = "".join("%s:%s\n" % (user, passwd)
+                       for (user, passwd) in passwords)
+        try:
+            util.subp(cmd, data, logstring="chpasswd for %s users" %
+                      len(passwords))
+        except util.ProcessExecutionError:
+            LOG.warn("Failed setting passwords of %s users at once, "
+                     "setting them one at a time", len(passwords))
+            for (user, passwd) in passwords:
+                self.set_passwd(user, passwd, hashed=hashed)
+
+    def create_users(self, users, groups=None):
+        """
+        Create groups (name -> members) and then users (name -> keyword
+        arguments of create_user) as create_group and create_user would.
+
+        Existing users and groups are looked up once, and the groupadd,
+        usermod and useradd commands of all of them run in one shell.
+        Passwords are set with one chpasswd (for plain text and one for
+        hashed passwords), locked in one shell and sudo rules written at
+        once.  Users that could not be added that way are created again
+        with create_user, which raises the error as usual.
+        """
+        if not groups:
+            groups = {}
+        if not self._batch_users_supported():
+            for (name, members) in groups.items():
+                self.create_group(name, members)
+            for (user, config) in users.items():
+                self.create_user(user, **config)
+            return
+
+        existing_users = util.get_user_names()
+        existing_groups = util.get_group_names()
+        commands = []
+
+        def add_group(name):
+            commands.append((['groupadd', name], ['groupadd', name]))
+            existing_groups.add(name)
+
+        for (name, members) in groups.items():
+            if name in existing_groups:
+                LOG.warn("Skipping creation of existing group '%s'" % name)
+            else:
+                add_group(name)
+            for member in (members or []):
+                if member not in existing_users:
+                    LOG.warn("Unable to add group member '%s' to group '%s'"
+                             "; user does not exist.", member, name)
+                    continue
+                cmd = ['usermod', '-a', '-G', name, member]
+                commands.append((cmd, cmd))
+
+        added = {}
+        for (user, config) in users.items():
+            if user in existing_users:
+                LOG.info("User %s already exists, skipping." % user)
+                continue
+            config = dict(config)
+            create_groups = config.pop('create_groups', True)
+            (cmd, log_cmd, user_groups) = self._useradd_cmd(user, config)
+            if create_groups:
+                for group in user_groups:
+                    if group not in existing_groups:
+                        add_group(group)
+            added[len(commands)] = user
+            commands.append((cmd, log_cmd))
+
+        failed_users = []
+        failed = self._run_batch(commands, "user and group")
+        for (index, rc) in sorted(failed.items()):
+            if index in added:
+                LOG.warn("Adding user %s failed (exit code %s), trying "
+                         "again on its own", added[index], rc)
+                failed_users.append(added[index])
+            else:
+                LOG.warn("Command '%s' failed with exit code %s",
+                         " ".join(commands[index][1]), rc)
+
+        created = [(user, config) for (user, config) in users.items()
+                   if user not in failed_users]
+        self._batch_chpasswd(
+            [(user, config['plain_text_passwd'])
+             for (user, config) in created
+             if config.get('plain_text_passwd')])
+        self._batch_chpasswd(
+            [(user, config['hashed_passwd'])
+             for (user, config) in created
+             if config.get('hashed_passwd')], hashed=True)
+
+        locks = [(user, ['passwd', '-l', user]) for (user, config) in created
+                 if config.get('lock_passwd', True)]
+        failed = self._run_batch([(cmd, cmd) for (_user, cmd) in locks],
+                                 "passwd lock")
+        for index in sorted(failed):
+            self.lock_passwd(locks[index][0])
+
+        sudo_content = "".join(self._sudo_rules(user, config['sudo'])
+                               for (user, config) in created
+                               if 'sudo' in config)
+        if sudo_content:
+            self._write_sudo_content(sudo_content)
+
+        users_keys = []
+        for (user, config) in created:
+            keys = self._user_keys(config)
+            if keys is not None:
+                users_keys.append((keys, user, None))
+        if users_keys:
+            ssh_util.setup_users_keys(users_keys)
+
+        for user in failed_users:
+            self.create_user(user, **users[user])
+
 
 def _get_package_mirror_info(mirror_info, data_source=None,
                              mirror_filter=util.search_for_mirror):
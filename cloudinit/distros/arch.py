@@ -64,7 +64,7 @@ class Distro(distros.Distro):
         entries = net_util.translate_network(settings)
         LOG.debug("Translated ubuntu style network settings %s into %s",
                   settings, entries)
-        dev_names = entries.keys()
+        changed_devs = []
         # Format for netctl
         for (dev, info) in entries.items():
             nameservers = []
@@ -78,7 +78,8 @@ class Distro(distros.Distro):
                 'Gateway': info.get('gateway'),
                 'DNS': str(tuple(info.get('dns-nameservers'))).replace(',', '')
             }
-            util.write_file(net_fn, convert_netctl(net_cfg))
+            if util.write_file_if_changed(net_fn, convert_netctl(net_cfg)):
+                changed_devs.append(dev)
             if info.get('auto'):
                 self._enable_interface(dev)
             if 'dns-nameservers' in info:
@@ -88,7 +89,7 @@ class Distro(distros.Distro):
             util.write_file(self.resolve_conf_fn,
                             convert_resolv_conf(nameservers))
 
-        return dev_names
+        return changed_devs
 
     def _enable_interface(self, device_name):
         cmd = ['netctl', 'reenable', device_name]
@@ -75,16 +75,21 @@ class Distro(distros.Distro):
         self.package_command('install', pkgs=pkglist)
 
     def _write_network(self, settings):
-        util.write_file(self.network_conf_fn, settings)
-        return ['all']
+        if util.write_file_if_changed(self.network_conf_fn, settings):
+            return ['all']
+        return []
 
     def _write_network_config(self, netconfig):
         ns = net.parse_net_config_data(netconfig)
-        net.render_network_state(target="/", network_state=ns,
-                                 eni=self.network_conf_fn,
-                                 links_prefix=self.links_prefix,
-                                 netrules=None)
-        util.del_file("/etc/network/interfaces.d/eth0.cfg")
+        changed = net.render_network_state(target="/", network_state=ns,
+                                           eni=self.network_conf_fn,
+                                           links_prefix=self.links_prefix,
+                                           netrules=None)
+        if os.path.exists("/etc/network/interfaces.d/eth0.cfg"):
+            util.del_file("/etc/network/interfaces.d/eth0.cfg")
+            changed = True
+        if changed:
+            return ['all']
         return []
 
     def _bring_up_interfaces(self, device_names):
@@ -60,8 +60,9 @@ class Distro(distros.Distro):
         self.package_command('', pkgs=pkglist)
 
     def _write_network(self, settings):
-        util.write_file(self.network_conf_fn, settings)
-        return ['all']
+        if util.write_file_if_changed(self.network_conf_fn, settings):
+            return ['all']
+        return []
 
     def _bring_up_interface(self, device_name):
         cmd = ['/etc/init.d/net.%s' % device_name, 'restart']
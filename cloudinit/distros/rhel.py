@@ -72,6 +72,7 @@ class Distro(distros.Distro):
         nameservers = []
         searchservers = []
         dev_names = entries.keys()
+        changed_devs = []
         use_ipv6 = False
         for (dev, info) in entries.items():
             net_fn = self.network_script_tpl % (dev)
@@ -92,7 +93,8 @@ class Distro(distros.Distro):
                     'IPV6ADDR': info.get('ipv6').get('address'),
                     'IPV6_DEFAULTGW': info.get('ipv6').get('gateway'),
                 })
-            rhel_util.update_sysconfig_file(net_fn, net_cfg)
+            if rhel_util.update_sysconfig_file(net_fn, net_cfg):
+                changed_devs.append(dev)
             if 'dns-nameservers' in info:
                 nameservers.extend(info['dns-nameservers'])
             if 'dns-search' in info:
@@ -108,8 +110,11 @@ class Distro(distros.Distro):
             if use_ipv6:
                 net_cfg['NETWORKING_IPV6'] = _make_sysconfig_bool(True)
                 net_cfg['IPV6_AUTOCONF'] = _make_sysconfig_bool(False)
-            rhel_util.update_sysconfig_file(self.network_conf_fn, net_cfg)
-        return dev_names
+            if rhel_util.update_sysconfig_file(self.network_conf_fn,
+                                               net_cfg):
+                # Networking as a whole changed, redo every device
+                changed_devs = list(dev_names)
+        return changed_devs
 
     def apply_locale(self, locale, out_fn=None):
         if self.uses_systemd():
@@ -30,10 +30,11 @@ from cloudinit import util
 LOG = logging.getLogger(__name__)
 
 
-# Helper function to update a RHEL/SUSE /etc/sysconfig/* file
+# Helper function to update a RHEL/SUSE /etc/sysconfig/* file, returns
+# whether the file changed
 def update_sysconfig_file(fn, adjustments, allow_empty=False):
     if not adjustments:
-        return
+        return False
     (exists, contents) = read_sysconfig_file(fn)
     updated_am = 0
     for (k, v) in adjustments.items():
@@ -50,7 +51,9 @@ def update_sysconfig_file(fn, adjustments, allow_empty=False):
         ]
         if not exists:
             lines.insert(0, util.make_header())
-        util.write_file(fn, "\n".join(lines) + "\n", 0o644)
+        return util.write_file_if_changed(fn, "\n".join(lines) + "\n",
+                                          0o644)
+    return False
 
 
 # Helper function to read a RHEL/SUSE /etc/sysconfig/* file
@@ -86,4 +89,4 @@ def update_resolve_conf_file(fn, dns_servers, search_servers):
                 r_conf.add_search_domain(s)
             except ValueError:
                 util.logexc(LOG, "Failed at adding search domain %s", s)
-    util.write_file(fn, str(r_conf), 0o644)
+    return util.write_file_if_changed(fn, str(r_conf), 0o644)
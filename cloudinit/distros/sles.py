@@ -61,7 +61,7 @@ class Distro(distros.Distro):
         # Make the intermediate format as the suse format...
         nameservers = []
         searchservers = []
-        dev_names = entries.keys()
+        changed_devs = []
         for (dev, info) in entries.items():
             net_fn = self.network_script_tpl % (dev)
             mode = info.get('auto')
@@ -84,7 +84,8 @@ class Distro(distros.Distro):
                 net_cfg['ETHTOOL_OPTIONS'] = ''
             else:
                 net_cfg['FIREWALL'] = 'no'
-            rhel_util.update_sysconfig_file(net_fn, net_cfg, True)
+            if rhel_util.update_sysconfig_file(net_fn, net_cfg, True):
+                changed_devs.append(dev)
             if 'dns-nameservers' in info:
                 nameservers.extend(info['dns-nameservers'])
             if 'dns-search' in info:
@@ -92,7 +93,7 @@ class Distro(distros.Distro):
         if nameservers or searchservers:
             rhel_util.update_resolve_conf_file(self.resolve_conf_fn,
                                                nameservers, searchservers)
-        return dev_names
+        return changed_devs
 
     def apply_locale(self, locale, out_fn=None):
         if not out_fn:
@@ -347,6 +347,7 @@ class Paths(object):
             "cloud_config": "cloud-config.txt",
             "vendor_cloud_config": "vendor-cloud-config.txt",
             "data": "data",
+            "profiles": "profiles",
             "vendordata_raw": "vendor-data.txt",
             "vendordata": "vendor-data.txt.i",
         }
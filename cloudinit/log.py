@@ -27,9 +27,11 @@ import logging.handlers
 import collections
 import os
 import sys
+import threading
 
 import six
 from six import StringIO
+from six.moves import queue
 
 # Logging levels for easy access
 CRITICAL = logging.CRITICAL
@@ -44,6 +46,129 @@ NOTSET = logging.NOTSET
 # Default basic format
 DEF_CON_FORMAT = '%(asctime)s - %(filename)s[%(levelname)s]: %(message)s'
 
+# Records a QueueHandler holds before it drops new ones, and how long
+# flushing it waits for them to be written, see setupLogging().
+LOG_QUEUE_SIZE = 10000
+LOG_QUEUE_FLUSH_TIMEOUT = 60
+
+
+class QueueHandler(logging.Handler):
+    """Hands records to a thread that emits them to the real handlers.
+
+    So that a slow handler (ie syslog over /dev/log in early boot) does
+    not block whatever is logging.  At most maxsize records are held,
+    more are dropped and counted in dropped (which is logged once the
+    handlers catch up).  flush() waits for all queued records to be
+    written; logging.shutdown() flushes and closes it at exit.
+    """
+
+    def __init__(self, handlers, maxsize=LOG_QUEUE_SIZE):
+        logging.Handler.__init__(self)
+        self.handlers = list(handlers)
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run,
+                                        name="cloud-init-logging")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _prepare(self, record):
+        # Format now, args may be changed (and tracebacks gone) by the
+        # time the record is emitted.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self._queue.put_nowait(self._prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _handle(self, record):
+        for h in self.handlers:
+            if record.levelno >= h.level:
+                h.handle(record)
+
+    def _report_dropped(self):
+        dropped = self.dropped
+        if dropped > self._reported_dropped:
+            record = logging.LogRecord(
+                __name__, WARNING, __file__, 0,
+                "%s log messages were dropped, the log queue was full",
+                (dropped - self._reported_dropped,), None)
+            self._reported_dropped = dropped
+            self._handle(record)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if isinstance(item, logging.LogRecord):
+                    self._handle(item)
+                    # Drops happened after whatever was queued
+                    if self._queue.empty():
+                        self._report_dropped()
+                    continue
+                self._report_dropped()
+                if item is None:
+                    return
+                # flush() waiting on everything before it
+                item.set()
+            except Exception:
+                pass
+
+    def flush(self, timeout=LOG_QUEUE_FLUSH_TIMEOUT):
+        if self._thread.is_alive():
+            # Don't wait forever on a stuck sink, and leave its handlers
+            # alone while the logging thread is still busy with them.
+            flushed = threading.Event()
+            try:
+                self._queue.put(flushed, timeout=timeout)
+            except queue.Full:
+                return
+            flushed.wait(timeout)
+            if not flushed.is_set():
+                return
+        for h in self.handlers:
+            try:
+                h.flush()
+            except IOError:
+                pass
+
+    def close(self):
+        if self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=LOG_QUEUE_FLUSH_TIMEOUT)
+            except queue.Full:
+                pass
+            else:
+                self._thread.join(LOG_QUEUE_FLUSH_TIMEOUT)
+        if not self._thread.is_alive():
+            for h in self.handlers:
+                h.close()
+        logging.Handler.close(self)
+
+
+def queueHandlers(log, maxsize=LOG_QUEUE_SIZE):
+    """Move the handlers of log behind a QueueHandler."""
+    handlers = [h for h in log.handlers if not isinstance(h, QueueHandler)]
+    if not handlers:
+        return None
+    for h in handlers:
+        log.removeHandler(h)
+    qh = QueueHandler(handlers, maxsize=maxsize)
+    log.addHandler(qh)
+    return qh
+
 
 def setupBasicLogging(level=DEBUG):
     root = logging.getLogger()
@@ -58,7 +183,7 @@ def flushLoggers(root):
     if not root:
         return
     for h in root.handlers:
-        if isinstance(h, (logging.StreamHandler)):
+        if isinstance(h, (logging.StreamHandler, QueueHandler)):
             try:
                 h.flush()
             except IOError:
@@ -102,14 +227,19 @@ def setupLogging(cfg=None):
                 log_cfg = StringIO(log_cfg)
             # Attempt to load its config
             logging.config.fileConfig(log_cfg)
-            # The first one to work wins!
-            return
         except Exception:
             # We do not write any logs of this here, because the default
             # configuration includes an attempt at using /dev/log, followed
             # up by writing to a file.  /dev/log will not exist in very early
             # boot, so an exception on that is expected.
-            pass
+            continue
+        # The first one to work wins!  Its handlers may be slow (syslog
+        # in early boot) so optionally write to them from a thread.
+        if cfg.get('log_queue', False):
+            queueHandlers(logging.getLogger(),
+                          maxsize=int(cfg.get('log_queue_size',
+                                              LOG_QUEUE_SIZE)))
+        return
 
     # If it didn't work, at least setup a basic logger (if desired)
     basic_enabled = cfg.get('log_basic', True)
@@ -31,14 +31,32 @@ DEF_MERGE_TYPE = "list()+dict()+str()"
 MERGER_PREFIX = 'm_'
 MERGER_ATTR = 'Merger'
 
+# Constructed merger chains, keyed by their parsed merge_how spec
+_CONSTRUCTED = {}
+_DEFAULT_MERGERS = None
+
 
 class UnknownMerger(object):
+    def __init__(self):
+        # Type of the source object -> what merges it, filled in as
+        # types are first seen so later merges skip the method lookups.
+        self._dispatch = {}
+
     # Named differently so auto-method finding
     # doesn't pick this up if there is ever a type
     # named "unknown"
     def _handle_unknown(self, _meth_wanted, value, _merge_with):
         return value
 
+    def _resolve(self, method_name):
+        if hasattr(self, method_name):
+            return getattr(self, method_name)
+
+        def handle_unknown(value, merge_with):
+            return self._handle_unknown(method_name, value, merge_with)
+
+        return handle_unknown
+
     # This merging will attempt to look for a '_on_X' method
     # in our own object for a given object Y with type X,
     # if found it will be called to perform the merge of a source
@@ -47,17 +65,15 @@ class UnknownMerger(object):
     # If not found the merge will be given to a '_handle_unknown'
     # function which can decide what to do wit the 2 values.
     def merge(self, source, merge_with):
-        type_name = type_utils.obj_name(source)
-        type_name = type_name.lower()
-        method_name = "_on_%s" % (type_name)
-        meth = None
-        args = [source, merge_with]
-        if hasattr(self, method_name):
-            meth = getattr(self, method_name)
-        if not meth:
-            meth = self._handle_unknown
-            args.insert(0, method_name)
-        return meth(*args)
+        source_type = type(source)
+        try:
+            meth = self._dispatch[source_type]
+        except KeyError:
+            type_name = type_utils.obj_name(source)
+            type_name = type_name.lower()
+            meth = self._resolve("_on_%s" % (type_name))
+            self._dispatch[source_type] = meth
+        return meth(source, merge_with)
 
 
 class LookupMerger(UnknownMerger):
@@ -77,18 +93,27 @@ class LookupMerger(UnknownMerger):
     # any of the contained objects have the needed method, they
     # will be called to perform the merge.
     def _handle_unknown(self, meth_wanted, value, merge_with):
-        meth = None
-        for merger in self._lookups:
-            if hasattr(merger, meth_wanted):
-                # First one that has that method/attr gets to be
-                # the one that will be called
-                meth = getattr(merger, meth_wanted)
-                break
+        meth = self._find_lookup(meth_wanted)
         if not meth:
             return UnknownMerger._handle_unknown(self, meth_wanted,
                                                  value, merge_with)
         return meth(value, merge_with)
 
+    def _find_lookup(self, meth_wanted):
+        for merger in self._lookups:
+            if hasattr(merger, meth_wanted):
+                # First one that has that method/attr gets to be
+                # the one that will be called
+                return getattr(merger, meth_wanted)
+        return None
+
+    def _resolve(self, method_name):
+        if not hasattr(self, method_name):
+            meth = self._find_lookup(method_name)
+            if meth:
+                return meth
+        return UnknownMerger._resolve(self, method_name)
+
 
 def dict_extract_mergers(config):
     parsed_mergers = []
@@ -137,10 +162,44 @@ def string_extract_mergers(merge_how):
 
 
 def default_mergers():
-    return tuple(string_extract_mergers(DEF_MERGE_TYPE))
+    global _DEFAULT_MERGERS
+    if _DEFAULT_MERGERS is None:
+        _DEFAULT_MERGERS = tuple(string_extract_mergers(DEF_MERGE_TYPE))
+    return _DEFAULT_MERGERS
+
+
+def _construct_key(parsed_mergers):
+    key = []
+    for (m_name, m_ops) in parsed_mergers:
+        # Options are tested with 'in', so only lists of them (not strings
+        # or dicts given as 'settings') reliably reduce to a tuple key.
+        if not isinstance(m_ops, (list, tuple)):
+            return None
+        key.append((m_name, tuple(m_ops)))
+    key = tuple(key)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
 
 
 def construct(parsed_mergers):
+    """Return the merger chain for the given parsed mergers.
+
+    Mergers hold no state besides their options, so chains are built once
+    per distinct spec and then shared.
+    """
+    key = _construct_key(parsed_mergers)
+    if key is not None and key in _CONSTRUCTED:
+        return _CONSTRUCTED[key]
+    root = _construct(parsed_mergers)
+    if key is not None:
+        _CONSTRUCTED[key] = root
+    return root
+
+
+def _construct(parsed_mergers):
     mergers_to_be = []
     for (m_name, m_ops) in parsed_mergers:
         if not m_name.startswith(MERGER_PREFIX):
@@ -54,15 +54,103 @@ NET_CONFIG_BRIDGE_OPTIONS = [
 DEFAULT_PRIMARY_INTERFACE = 'eth0'
 
 
+# The attributes of each device in SYS_CLASS_NET that NetDevSnapshot reads
+SYS_NET_ATTRS = ('address', 'carrier', 'dormant', 'iflink', 'operstate')
+
+_NETDEV_SNAPSHOT = None
+
+
+class NetDevSnapshot(object):
+    """All devices in SYS_CLASS_NET and their SYS_NET_ATTRS, read at once.
+
+    Devices are found with a single listing and each read with one listing
+    (which also tells what entries, ie 'wireless', it has) and an open per
+    attribute, rather than with one or more opens every time a helper asks
+    about them.  The snapshot is not updated by itself, see refresh().
+    """
+
+    def __init__(self):
+        self.devices = {}
+        self.refresh()
+
+    def refresh(self):
+        devices = {}
+        try:
+            names = os.listdir(SYS_CLASS_NET)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            names = []
+        for name in names:
+            try:
+                entries = set(os.listdir(sys_dev_path(name)))
+            except OSError:
+                # went away (or is not a device at all)
+                continue
+            attrs = {}
+            for attr in SYS_NET_ATTRS:
+                if attr not in entries:
+                    continue
+                try:
+                    with open(sys_dev_path(name, attr), "r") as fp:
+                        attrs[attr] = fp.read()
+                except (IOError, OSError) as e:
+                    # ie reading carrier of a down device gives EINVAL
+                    attrs[attr] = e.errno
+            devices[name] = {'attrs': attrs, 'entries': entries}
+        self.devices = devices
+
+    def has(self, devname, path=""):
+        """Whether devname (and the entry path in it, if given) was seen."""
+        if devname not in self.devices:
+            return False
+        return not path or path in self.devices[devname]['entries']
+
+    def covers(self, devname, path):
+        """Whether devname's path can be answered from the snapshot."""
+        return devname in self.devices and path in SYS_NET_ATTRS
+
+    def read(self, devname, path):
+        """Contents of devname's path, raising IOError as open() would."""
+        fname = sys_dev_path(devname, path)
+        value = self.devices[devname]['attrs'].get(path, errno.ENOENT)
+        if isinstance(value, int):
+            raise IOError(value, os.strerror(value), fname)
+        return value
+
+
+def get_netdev_snapshot():
+    global _NETDEV_SNAPSHOT
+    if _NETDEV_SNAPSHOT is None:
+        _NETDEV_SNAPSHOT = NetDevSnapshot()
+    return _NETDEV_SNAPSHOT
+
+
+def refresh_netdev_snapshot():
+    """Re-read SYS_CLASS_NET, ie after devices were added or changed."""
+    global _NETDEV_SNAPSHOT
+    if _NETDEV_SNAPSHOT is None:
+        _NETDEV_SNAPSHOT = NetDevSnapshot()
+    else:
+        _NETDEV_SNAPSHOT.refresh()
+    return _NETDEV_SNAPSHOT
+
+
 def sys_dev_path(devname, path=""):
     return SYS_CLASS_NET + devname + "/" + path
 
 
+def _read_sys_net_file(devname, path):
+    snapshot = get_netdev_snapshot()
+    if snapshot.covers(devname, path):
+        return snapshot.read(devname, path)
+    with open(sys_dev_path(devname, path), "r") as fp:
+        return fp.read()
+
+
 def read_sys_net(devname, path, translate=None, enoent=None, keyerror=None):
     try:
-        contents = ""
-        with open(sys_dev_path(devname, path), "r") as fp:
-            contents = fp.read().strip()
+        contents = _read_sys_net_file(devname, path).strip()
         if translate is None:
             return contents
 
@@ -89,8 +177,15 @@ def is_up(devname):
                         translate=translate)
 
 
+def _sys_dev_exists(devname, path=""):
+    snapshot = get_netdev_snapshot()
+    if "/" not in path and snapshot.has(devname):
+        return snapshot.has(devname, path)
+    return os.path.exists(sys_dev_path(devname, path))
+
+
 def is_wireless(devname):
-    return os.path.exists(sys_dev_path(devname, "wireless"))
+    return _sys_dev_exists(devname, "wireless")
 
 
 def is_connected(devname):
@@ -115,15 +210,15 @@ def is_connected(devname):
 
 
 def is_physical(devname):
-    return os.path.exists(sys_dev_path(devname, "device"))
+    return _sys_dev_exists(devname, "device")
 
 
 def is_present(devname):
-    return os.path.exists(sys_dev_path(devname))
+    return _sys_dev_exists(devname)
 
 
 def get_devicelist():
-    return os.listdir(SYS_CLASS_NET)
+    return list(get_netdev_snapshot().devices.keys())
 
 
 class ParserError(Exception):
@@ -573,42 +668,61 @@ def render_interfaces(network_state):
 def render_network_state(target, network_state, eni="etc/network/interfaces",
                          links_prefix=LINKS_FNAME_PREFIX,
                          netrules='etc/udev/rules.d/70-persistent-net.rules'):
+    """Render network_state into target, leaving unchanged files alone.
+
+    Returns True if any file was written (or removed), ie. if what is
+    configured on disk changed and interfaces may need bringing up."""
 
     fpeni = os.path.sep.join((target, eni,))
-    util.ensure_dir(os.path.dirname(fpeni))
-    with open(fpeni, 'w+') as f:
-        f.write(render_interfaces(network_state))
+    changed = util.write_file_if_changed(
+        fpeni, render_interfaces(network_state))
 
     if netrules:
         netrules = os.path.sep.join((target, netrules,))
-        util.ensure_dir(os.path.dirname(netrules))
-        with open(netrules, 'w+') as f:
-            f.write(render_persistent_net(network_state))
+        if util.write_file_if_changed(
+                netrules, render_persistent_net(network_state)):
+            changed = True
 
     if links_prefix:
-        render_systemd_links(target, network_state, links_prefix)
+        if render_systemd_links(target, network_state, links_prefix):
+            changed = True
+
+    return changed
 
 
 def render_systemd_links(target, network_state,
                          links_prefix=LINKS_FNAME_PREFIX):
-    fp_prefix = os.path.sep.join((target, links_prefix))
-    for f in glob.glob(fp_prefix + "*"):
-        os.unlink(f)
+    """Write a .link file per named physical interface with a mac.
 
+    Only links that differ are rewritten and only stale ones removed;
+    returns True if anything changed."""
+    fp_prefix = os.path.sep.join((target, links_prefix))
+    links = {}
     interfaces = network_state.get('interfaces')
     for iface in interfaces.values():
         if (iface['type'] == 'physical' and 'name' in iface and
                 iface.get('mac_address')):
             fname = fp_prefix + iface['name'] + ".link"
-            with open(fname, "w") as fp:
-                fp.write("\n".join([
-                    "[Match]",
-                    "MACAddress=" + iface['mac_address'],
-                    "",
-                    "[Link]",
-                    "Name=" + iface['name'],
-                    ""
-                ]))
+            links[fname] = "\n".join([
+                "[Match]",
+                "MACAddress=" + iface['mac_address'],
+                "",
+                "[Link]",
+                "Name=" + iface['name'],
+                ""
+            ])
+
+    changed = False
+    for f in glob.glob(fp_prefix + "*"):
+        if f not in links:
+            LOG.debug("Removing stale link file %s", f)
+            os.unlink(f)
+            changed = True
+
+    for (fname, content) in sorted(links.items()):
+        if util.write_file_if_changed(fname, content):
+            changed = True
+    return changed
 
 
 def is_disabled_cfg(cfg):
@@ -618,14 +732,22 @@ def is_disabled_cfg(cfg):
 
 
 def sys_netdev_info(name, field):
-    if not os.path.exists(os.path.join(SYS_CLASS_NET, name)):
+    if not _sys_dev_exists(name):
         raise OSError("%s: interface does not exist in %s" %
                       (name, SYS_CLASS_NET))
 
     fname = os.path.join(SYS_CLASS_NET, name, field)
-    if not os.path.exists(fname):
-        raise OSError("%s: could not find sysfs entry: %s" % (name, fname))
-    data = util.load_file(fname)
+    snapshot = get_netdev_snapshot()
+    if snapshot.covers(name, field):
+        if not snapshot.has(name, field):
+            raise OSError("%s: could not find sysfs entry: %s" %
+                          (name, fname))
+        data = snapshot.read(name, field)
+    else:
+        if not os.path.exists(fname):
+            raise OSError("%s: could not find sysfs entry: %s" %
+                          (name, fname))
+        data = util.load_file(fname)
     if data[-1] == '\n':
         data = data[:-1]
     return data
@@ -637,6 +759,9 @@ def generate_fallback_config():
     # by default use eth0 as primary interface
     nconf = {'config': [], 'version': 1}
 
+    # look at the devices as they are now, in one pass
+    refresh_netdev_snapshot()
+
     # get list of interfaces that could have connections
     invalid_interfaces = set(['lo'])
     potential_interfaces = set(get_devicelist())
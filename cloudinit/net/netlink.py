@@ -0,0 +1,235 @@
+# Copyright 2016 Canonical Ltd.
+# This file is part of cloud-init.  See LICENCE file for license information.
+#
+# vi: ts=4 expandtab
+"""A minimal rtnetlink reader: dumps of links, addresses and routes.
+
+dump() asks the kernel (over an AF_NETLINK, NETLINK_ROUTE socket) for
+every link, address or route and returns the raw reply, which the
+parse_* functions turn into lists of dicts.  Keeping the two apart lets
+recorded replies be parsed anywhere.
+"""
+
+import socket
+import struct
+
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_DUMP = 0x300
+
+RTM_NEWLINK = 16
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_GETROUTE = 26
+
+IFLA_ADDRESS = 1
+IFLA_IFNAME = 3
+IFLA_MTU = 4
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+IFA_BROADCAST = 4
+
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_TABLE = 15
+
+IFF_UP = 0x1
+RT_TABLE_MAIN = 254
+RTN_UNICAST = 1
+
+# struct nlmsghdr, ifinfomsg, ifaddrmsg, rtmsg and rtattr
+NLMSGHDR = struct.Struct("=LHHLL")
+IFINFOMSG = struct.Struct("=BxHiII")
+IFADDRMSG = struct.Struct("=BBBBi")
+RTMSG = struct.Struct("=BBBBBBBBI")
+RTATTR = struct.Struct("=HH")
+
+RECV_SIZE = 65536
+
+
+class NetlinkError(Exception):
+    pass
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _request(msg_type, family, seq):
+    if msg_type == RTM_GETLINK:
+        body = IFINFOMSG.pack(family, 0, 0, 0, 0)
+    elif msg_type == RTM_GETADDR:
+        body = IFADDRMSG.pack(family, 0, 0, 0, 0)
+    else:
+        body = RTMSG.pack(family, 0, 0, 0, 0, 0, 0, 0, 0)
+    return NLMSGHDR.pack(NLMSGHDR.size + len(body), msg_type,
+                         NLM_F_REQUEST | NLM_F_DUMP, seq, 0) + body
+
+
+def dump(msg_type, family=socket.AF_UNSPEC):
+    """Dump (RTM_GETLINK, RTM_GETADDR or RTM_GETROUTE) from the kernel.
+
+    Returns the raw messages received, up to and including NLMSG_DONE.
+    NetlinkError is raised when the kernel answers with an error, and
+    socket.error (or AttributeError where there is no AF_NETLINK) when
+    netlink can't be used at all.
+    """
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    try:
+        sock.bind((0, 0))
+        sock.send(_request(msg_type, family, 1))
+        received = []
+        while True:
+            data = sock.recv(RECV_SIZE)
+            if not data:
+                raise NetlinkError("Netlink socket closed mid dump")
+            received.append(data)
+            done = False
+            for (nl_type, _payload) in parse_messages(data):
+                if nl_type == NLMSG_DONE:
+                    done = True
+            if done:
+                return b''.join(received)
+    finally:
+        sock.close()
+
+
+def parse_messages(data):
+    """Split data into (type, payload) of each netlink message in it.
+
+    NetlinkError is raised for NLMSG_ERROR messages carrying an error.
+    """
+    messages = []
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        (length, nl_type, _flags, _seq, _pid) = NLMSGHDR.unpack_from(
+            data, offset)
+        if length < NLMSGHDR.size or offset + length > len(data):
+            raise NetlinkError("Truncated netlink message at %s" % offset)
+        payload = data[offset + NLMSGHDR.size:offset + length]
+        if nl_type == NLMSG_ERROR:
+            (error,) = struct.unpack_from("=i", payload)
+            if error:
+                raise NetlinkError("Netlink error %s" % -error)
+        messages.append((nl_type, payload))
+        offset += _align(length)
+    if offset < len(data):
+        raise NetlinkError("Truncated netlink message at %s" % offset)
+    return messages
+
+
+def parse_attrs(data, offset=0):
+    """Return the rtattrs in data (from offset on) as {type: value}."""
+    attrs = {}
+    while offset + RTATTR.size <= len(data):
+        (length, rta_type) = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        attrs[rta_type] = data[offset + RTATTR.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def _cstr(value):
+    return value.split(b'\0', 1)[0].decode('utf-8', 'replace')
+
+
+def _ip(family, value):
+    if value is None:
+        return None
+    return socket.inet_ntop(family, value)
+
+
+def parse_links(data):
+    """Return the links in a RTM_GETLINK dump (in kernel order)."""
+    links = []
+    for (nl_type, payload) in parse_messages(data):
+        if nl_type != RTM_NEWLINK:
+            continue
+        (_family, dev_type, index, flags, _change) = IFINFOMSG.unpack_from(
+            payload)
+        attrs = parse_attrs(payload, IFINFOMSG.size)
+        address = attrs.get(IFLA_ADDRESS)
+        if address is not None:
+            address = ":".join("%02x" % b for b in bytearray(address))
+        mtu = attrs.get(IFLA_MTU)
+        if mtu is not None:
+            mtu = struct.unpack("=I", mtu)[0]
+        links.append({
+            'index': index,
+            'name': _cstr(attrs.get(IFLA_IFNAME, b'')),
+            'type': dev_type,
+            'flags': flags,
+            'up': bool(flags & IFF_UP),
+            'address': address,
+            'mtu': mtu,
+        })
+    return links
+
+
+def parse_addrs(data):
+    """Return the addresses in a RTM_GETADDR dump (in kernel order)."""
+    addrs = []
+    for (nl_type, payload) in parse_messages(data):
+        if nl_type != RTM_NEWADDR:
+            continue
+        (family, prefixlen, flags, scope, index) = IFADDRMSG.unpack_from(
+            payload)
+        if family not in (socket.AF_INET, socket.AF_INET6):
+            continue
+        attrs = parse_attrs(payload, IFADDRMSG.size)
+        # On point to point links IFA_ADDRESS is the peer, IFA_LOCAL ours
+        local = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+        label = attrs.get(IFA_LABEL)
+        addrs.append({
+            'family': family,
+            'index': index,
+            'prefixlen': prefixlen,
+            'flags': flags,
+            'scope': scope,
+            'address': _ip(family, local),
+            'broadcast': _ip(family, attrs.get(IFA_BROADCAST)),
+            'label': _cstr(label) if label is not None else None,
+        })
+    return addrs
+
+
+def parse_routes(data):
+    """Return the routes in a RTM_GETROUTE dump (in kernel order)."""
+    routes = []
+    for (nl_type, payload) in parse_messages(data):
+        if nl_type != RTM_NEWROUTE:
+            continue
+        (family, dst_len, _src_len, _tos, table, protocol, scope, rt_type,
+         flags) = RTMSG.unpack_from(payload)
+        if family not in (socket.AF_INET, socket.AF_INET6):
+            continue
+        attrs = parse_attrs(payload, RTMSG.size)
+        if RTA_TABLE in attrs:
+            table = struct.unpack("=I", attrs[RTA_TABLE])[0]
+        oif = attrs.get(RTA_OIF)
+        priority = attrs.get(RTA_PRIORITY)
+        routes.append({
+            'family': family,
+            'dst': _ip(family, attrs.get(RTA_DST)),
+            'dst_len': dst_len,
+            'gateway': _ip(family, attrs.get(RTA_GATEWAY)),
+            'oif': struct.unpack("=i", oif)[0] if oif else None,
+            'priority': struct.unpack("=I", priority)[0] if priority else 0,
+            'table': table,
+            'protocol': protocol,
+            'scope': scope,
+            'type': rt_type,
+            'flags': flags,
+        })
+    return routes
@@ -22,14 +22,185 @@
 
 import cloudinit.util as util
 from cloudinit.log import logging
+from cloudinit.net import netlink
+import errno
+import fcntl
+import os
 import re
+import socket
+import struct
 
 from prettytable import PrettyTable
 
 LOG = logging.getLogger()
 
+# How ifconfig names rtnetlink's address scopes, and rtnetlink's scopes
+# for those in /proc/net/if_inet6
+SCOPES = {0: 'global', 200: 'site', 253: 'link', 254: 'host'}
+PROC_INET6_SCOPES = {0x00: 0, 0x40: 200, 0x20: 253, 0x10: 254}
+
+PROC_NET = "/proc/net"
+SYS_CLASS_NET = "/sys/class/net"
+
+# ioctls (and the offset of the address in the ifreq they fill in) used
+# to find ipv4 addresses when netlink can not be
+SIOCGIFADDR = 0x8915
+SIOCGIFBRDADDR = 0x8919
+SIOCGIFNETMASK = 0x891b
+IFREQ_ADDR_OFFSET = 20
+
+# Route flags, as in /proc/net/route and /proc/net/ipv6_route
+RTF_UP = 0x0001
+RTF_GATEWAY = 0x0002
+RTF_HOST = 0x0004
+RTF_REJECT = 0x0200
+RTF_LOCAL = 0x80000000
+
+# Why netlink (and /proc/net) may be unusable: no AF_NETLINK outside of
+# linux, or the socket/files being unavailable.
+_UNAVAILABLE = (AttributeError, EnvironmentError, socket.error,
+                netlink.NetlinkError)
+
+
+def _prefix_to_netmask(prefixlen):
+    return socket.inet_ntoa(struct.pack(
+        "!I", (0xffffffff << (32 - prefixlen)) & 0xffffffff))
+
+
+def _route_flags(gateway, host):
+    flags = "U"
+    if gateway:
+        flags += "G"
+    if host:
+        flags += "H"
+    return flags
+
+
+def _netdev_dicts(links, addrs):
+    # links and addrs as given by netlink.parse_links/parse_addrs
+    devs = {}
+    names = {}
+    scopes6 = {}
+    for link in links:
+        hwaddr = link['address'] or ""
+        if not hwaddr.replace("0", "").replace(":", ""):
+            hwaddr = ""
+        devs[link['name']] = {"up": link['up'], "hwaddr": hwaddr,
+                              "addr": "", "bcast": "", "mask": ""}
+        names[link['index']] = link['name']
+    for addr in addrs:
+        dev = devs.get(names.get(addr['index']))
+        if dev is None:
+            continue
+        # Like ifconfig, show one address of each family: the first ipv4
+        # one and the ipv6 one with the widest scope.
+        if addr['family'] == socket.AF_INET:
+            if dev['addr']:
+                continue
+            dev['addr'] = addr['address']
+            dev['mask'] = _prefix_to_netmask(addr['prefixlen'])
+            dev['bcast'] = addr['broadcast'] or ""
+        elif addr['scope'] < scopes6.get(addr['index'], 256):
+            scopes6[addr['index']] = addr['scope']
+            dev['addr6'] = "%s/%s" % (addr['address'], addr['prefixlen'])
+            dev['scope6'] = SCOPES.get(addr['scope'], str(addr['scope']))
+    return devs
+
+
+def _netdev_info_netlink():
+    links = netlink.parse_links(netlink.dump(netlink.RTM_GETLINK))
+    addrs = netlink.parse_addrs(netlink.dump(netlink.RTM_GETADDR))
+    return _netdev_dicts(links, addrs)
+
+
+def _ipv4_ioctl(name, request):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        ifreq = struct.pack("256s", util.encode_text(name[:15]))
+        result = fcntl.ioctl(sock.fileno(), request, ifreq)
+    except IOError as e:
+        if e.errno in (errno.EADDRNOTAVAIL, errno.ENODEV):
+            return None
+        raise
+    finally:
+        sock.close()
+    return socket.inet_ntoa(
+        result[IFREQ_ADDR_OFFSET:IFREQ_ADDR_OFFSET + 4])
+
+
+def _netdev_info_proc():
+    links = []
+    addrs = []
+    lines = util.load_file(os.path.join(PROC_NET, "dev")).splitlines()
+    for (index, line) in enumerate(lines[2:]):
+        name = line.split(":", 1)[0].strip()
+        sys_dev = os.path.join(SYS_CLASS_NET, name)
+        flags = int(util.load_file(os.path.join(sys_dev, "flags")), 16)
+        links.append({
+            'index': index, 'name': name,
+            'up': bool(flags & netlink.IFF_UP),
+            'address': util.load_file(os.path.join(sys_dev,
+                                                   "address")).strip(),
+        })
+        address = _ipv4_ioctl(name, SIOCGIFADDR)
+        if address:
+            netmask = _ipv4_ioctl(name, SIOCGIFNETMASK) or "0.0.0.0"
+            prefixlen = bin(struct.unpack(
+                "!I", socket.inet_aton(netmask))[0]).count("1")
+            broadcast = _ipv4_ioctl(name, SIOCGIFBRDADDR)
+            addrs.append({
+                'family': socket.AF_INET, 'index': index,
+                'address': address, 'prefixlen': prefixlen,
+                'broadcast': None if broadcast == "0.0.0.0" else broadcast,
+            })
+    indexes = dict((link['name'], link['index']) for link in links)
+    inet6_fn = os.path.join(PROC_NET, "if_inet6")
+    if os.path.exists(inet6_fn):
+        for line in util.load_file(inet6_fn).splitlines():
+            toks = line.split()
+            if len(toks) < 6 or toks[5] not in indexes:
+                continue
+            scope = int(toks[3], 16)
+            addrs.append({
+                'family': socket.AF_INET6, 'index': indexes[toks[5]],
+                'address': _proc_inet6(toks[0]),
+                'prefixlen': int(toks[2], 16),
+                'scope': PROC_INET6_SCOPES.get(scope, scope),
+            })
+    return _netdev_dicts(links, addrs)
+
+
+def _proc_inet4(hexaddr):
+    # /proc/net/route has addresses as host endian hex
+    return socket.inet_ntoa(struct.pack("=I", int(hexaddr, 16)))
+
+
+def _proc_inet6(hexaddr):
+    return socket.inet_ntop(socket.AF_INET6, bytes(bytearray.fromhex(
+        hexaddr)))
+
 
 def netdev_info(empty=""):
+    devs = None
+    try:
+        devs = _netdev_info_netlink()
+    except _UNAVAILABLE as e:
+        LOG.debug("Net device info from netlink failed: %s", e)
+        if os.path.exists(os.path.join(PROC_NET, "dev")):
+            devs = _netdev_info_proc()
+    if devs is None:
+        devs = _netdev_info_ifconfig()
+
+    if empty != "":
+        for (_devname, dev) in devs.items():
+            for field in dev:
+                if dev[field] == "":
+                    dev[field] = empty
+
+    return devs
+
+
+def _netdev_info_ifconfig():
     fields = ("hwaddr", "addr", "bcast", "mask")
     (ifcfg_out, _err) = util.subp(["ifconfig", "-a"])
     devs = {}
@@ -86,16 +257,105 @@ def netdev_info(empty=""):
                 elif toks[i].startswith("%s" % origfield):
                     devs[curdev][target] = toks[i][len(field) + 1:]
 
-    if empty != "":
-        for (_devname, dev) in devs.items():
-            for field in dev:
-                if dev[field] == "":
-                    dev[field] = empty
-
     return devs
 
 
+def _route_dicts(links, routes):
+    # links and routes as given by netlink.parse_links/parse_routes
+    names = dict((link['index'], link['name']) for link in links)
+    info = {'ipv4': [], 'ipv6': []}
+    for route in routes:
+        # Those netstat -rn shows, not the local ones (or multicast)
+        if (route['table'] != netlink.RT_TABLE_MAIN or
+                route['type'] != netlink.RTN_UNICAST):
+            continue
+        host_len = 32 if route['family'] == socket.AF_INET else 128
+        entry = {
+            'flags': _route_flags(route['gateway'],
+                                  route['dst_len'] == host_len),
+            'metric': str(route['priority']),
+            'ref': '0',
+            'use': '0',
+            'iface': names.get(route['oif'], ""),
+        }
+        if route['family'] == socket.AF_INET:
+            entry['destination'] = route['dst'] or "0.0.0.0"
+            entry['gateway'] = route['gateway'] or "0.0.0.0"
+            entry['genmask'] = _prefix_to_netmask(route['dst_len'])
+            info['ipv4'].append(entry)
+        else:
+            entry['destination'] = "%s/%s" % (route['dst'] or "::",
+                                              route['dst_len'])
+            entry['gateway'] = route['gateway'] or "::"
+            info['ipv6'].append(entry)
+    return info
+
+
+def _route_info_netlink():
+    links = netlink.parse_links(netlink.dump(netlink.RTM_GETLINK))
+    routes = netlink.parse_routes(netlink.dump(netlink.RTM_GETROUTE,
+                                               socket.AF_INET))
+    routes.extend(netlink.parse_routes(netlink.dump(netlink.RTM_GETROUTE,
+                                                    socket.AF_INET6)))
+    return _route_dicts(links, routes)
+
+
+def _route_info_proc():
+    info = {'ipv4': [], 'ipv6': []}
+    lines = util.load_file(os.path.join(PROC_NET, "route")).splitlines()
+    for line in lines[1:]:
+        toks = line.split()
+        if len(toks) < 8:
+            continue
+        flags = int(toks[3], 16)
+        if not flags & RTF_UP:
+            continue
+        info['ipv4'].append({
+            'destination': _proc_inet4(toks[1]),
+            'gateway': _proc_inet4(toks[2]),
+            'genmask': _proc_inet4(toks[7]),
+            'flags': _route_flags(flags & RTF_GATEWAY, flags & RTF_HOST),
+            'metric': str(int(toks[6])),
+            'ref': '0',
+            'use': '0',
+            'iface': toks[0],
+        })
+    ipv6_fn = os.path.join(PROC_NET, "ipv6_route")
+    if not os.path.exists(ipv6_fn):
+        return info
+    for line in util.load_file(ipv6_fn).splitlines():
+        toks = line.split()
+        if len(toks) < 10:
+            continue
+        flags = int(toks[8], 16)
+        if (not flags & RTF_UP or flags & (RTF_REJECT | RTF_LOCAL) or
+                toks[0].startswith("ff")):
+            continue
+        gateway = _proc_inet6(toks[4])
+        dst_len = int(toks[1], 16)
+        info['ipv6'].append({
+            'destination': "%s/%s" % (_proc_inet6(toks[0]), dst_len),
+            'gateway': gateway,
+            'flags': _route_flags(gateway != "::", dst_len == 128),
+            'metric': str(int(toks[5], 16)),
+            'ref': '0',
+            'use': '0',
+            'iface': toks[9],
+        })
+    return info
+
+
 def route_info():
+    try:
+        return _route_info_netlink()
+    except _UNAVAILABLE as e:
+        LOG.debug("Route info from netlink failed: %s", e)
+        if os.path.exists(os.path.join(PROC_NET, "route")):
+            return _route_info_proc()
+    return _route_info_netstat()
+
+
+def _route_info_netstat():
     (route_out, _err) = util.subp(["netstat", "-rn"])
 
     routes = {}
@@ -214,7 +474,16 @@ def route_pformat():
             max_len = len(max(route_s.splitlines(), key=len))
             header = util.center("Route IPv4 info", "+", max_len)
             lines.extend([header, route_s])
-        if routes.get('ipv6'):
+        if routes.get('ipv6') and 'destination' in routes['ipv6'][0]:
+            fields_v6 = ['Route', 'Destination', 'Gateway', 'Interface',
+                         'Flags']
+            tbl_v6 = PrettyTable(fields_v6)
+            for (n, r) in enumerate(routes.get('ipv6')):
+                route_id = str(n)
+                tbl_v6.add_row([route_id, r['destination'],
+                                r['gateway'], r['iface'], r['flags']])
+        elif routes.get('ipv6'):
+            # what netstat shows for inet6 (outside of linux)
             fields_v6 = ['Route', 'Proto', 'Recv-Q', 'Send-Q',
                          'Local Address', 'Foreign Address', 'State']
             tbl_v6 = PrettyTable(fields_v6)
@@ -224,6 +493,7 @@ def route_pformat():
                                 r['recv-q'], r['send-q'],
                                 r['local address'], r['foreign address'],
                                 r['state']])
+        if routes.get('ipv6'):
             route_s = tbl_v6.get_string()
             max_len = len(max(route_s.splitlines(), key=len))
             header = util.center("Route IPv6 info", "+", max_len)
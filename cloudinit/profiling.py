@@ -0,0 +1,182 @@
+# Copyright 2016 Canonical Ltd.
+# This file is part of cloud-init.  See LICENCE file for license information.
+#
+# vi: ts=4 expandtab
+"""Profiling of config modules.
+
+Modules named in the 'profile_modules' config key (or all of them when
+it is 'all' or true) have their handle run under cProfile, and when
+'profile_memory' is true (and python has tracemalloc) with allocations
+traced too.  Profiles are written to the 'profiles' directory of the
+instance as <module>-<stage>-<timestamp>-<pid>.pstats (and .tracemalloc).
+"""
+
+import cProfile
+import glob
+import marshal
+import os
+import pstats
+import time
+
+import six
+from six.moves import cPickle as pickle
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from cloudinit import log as logging
+from cloudinit.reporting import events
+from cloudinit import util
+
+LOG = logging.getLogger(__name__)
+
+PROFILE_ALL = 'all'
+PSTATS_EXT = '.pstats'
+TRACEMALLOC_EXT = '.tracemalloc'
+
+# How many functions (and allocation sites) a summary names
+SUMMARY_TOP = 5
+
+
+def canonical_name(name):
+    name = name.strip().lower().replace('-', '_')
+    if name.startswith('cc_'):
+        name = name[len('cc_'):]
+    return name
+
+
+def should_profile(cfg, name):
+    """Whether the config module name is to be profiled given cfg."""
+    wanted = cfg.get('profile_modules')
+    if not wanted:
+        return False
+    if wanted is True:
+        return True
+    wanted = util.get_cfg_option_list(cfg, 'profile_modules', [])
+    wanted = [canonical_name(str(w)) for w in wanted]
+    return PROFILE_ALL in wanted or canonical_name(name) in wanted
+
+
+def _describe(func_key):
+    (filename, lineno, funcname) = func_key
+    if filename == '~':
+        # builtins and the like
+        return funcname
+    return "%s (%s:%s)" % (funcname, os.path.basename(filename), lineno)
+
+
+class ModuleProfiler(object):
+    """Runs a function under cProfile (and maybe tracemalloc).
+
+    After each call made through wrap() the profile is written out and
+    summary describes it (ie for reporting).
+    """
+
+    def __init__(self, name, profile_dir, memory=False, stage=None):
+        self.name = name
+        self.profile_dir = profile_dir
+        self.stage = stage
+        self.memory = memory and tracemalloc is not None
+        self.files = []
+        self.summary = None
+
+    def wrap(self, functor):
+        def profiled(*args, **kwargs):
+            return self.call(functor, *args, **kwargs)
+        return profiled
+
+    def call(self, functor, *args, **kwargs):
+        profile = cProfile.Profile()
+        tracing = self.memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        start = time.time()
+        try:
+            return profile.runcall(functor, *args, **kwargs)
+        finally:
+            took = time.time() - start
+            snapshot = None
+            peak = None
+            if self.memory:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+            if tracing:
+                tracemalloc.stop()
+            try:
+                self._finish(profile, took, snapshot, peak)
+            except Exception:
+                util.logexc(LOG, "Failed saving profile of %s", self.name)
+
+    def _base_filename(self):
+        parts = [canonical_name(self.name)]
+        if self.stage:
+            parts.append(self.stage)
+        parts.extend([time.strftime("%Y%m%d%H%M%S"), str(os.getpid())])
+        base = os.path.join(self.profile_dir, "-".join(parts))
+        # Profiled again by this process within the same second
+        candidate = base
+        count = 0
+        while os.path.exists(candidate + PSTATS_EXT):
+            count += 1
+            candidate = "%s.%s" % (base, count)
+        return candidate
+
+    def _finish(self, profile, took, snapshot, peak):
+        base = self._base_filename()
+        # What profile.dump_stats() and snapshot.dump() would write
+        profile.create_stats()
+        util.ensure_dir(self.profile_dir, mode=0o700)
+        self.files = [base + PSTATS_EXT]
+        util.write_file(self.files[0], marshal.dumps(profile.stats),
+                        mode=0o600)
+        stats = pstats.Stats(profile)
+        slowest = sorted(stats.stats.items(), key=lambda item: item[1][3],
+                         reverse=True)
+        parts = ["%s took %.3f seconds over %s calls" %
+                 (self.name, took, stats.total_calls)]
+        parts.append("slowest: %s" % ", ".join(
+            "%s %.3fs" % (_describe(func_key), info[3])
+            for (func_key, info) in slowest[0:SUMMARY_TOP]))
+        if snapshot is not None:
+            self.files.append(base + TRACEMALLOC_EXT)
+            util.write_file(self.files[1], pickle.dumps(snapshot),
+                            mode=0o600)
+            parts.append("peak memory %s KiB" % (peak // 1024))
+            parts.append("top allocations: %s" % ", ".join(
+                "%s:%s %s KiB" % (
+                    os.path.basename(stat.traceback[0].filename),
+                    stat.traceback[0].lineno, stat.size // 1024)
+                for stat in snapshot.statistics('lineno')[0:SUMMARY_TOP]))
+        self.summary = "; ".join(parts)
+        LOG.debug("Profiled %s into %s: %s", self.name, self.files,
+                  self.summary)
+
+    def report(self, parent):
+        if not self.summary:
+            return
+        with events.ReportEventStack(
+                "profile-%s" % self.name, self.summary, parent=parent):
+            pass
+
+
+def find_profiles(cloud_dir, module=None):
+    """Find the profiles of all instances (and boots) under cloud_dir."""
+    pattern = "*"
+    if module:
+        pattern = "%s-*" % canonical_name(module)
+    return sorted(glob.glob(os.path.join(cloud_dir, "instances", "*",
+                                         "profiles", pattern + PSTATS_EXT)))
+
+
+def aggregate_profiles(files, sort='cumulative', limit=20):
+    """Combine pstats files into one report of the top limit functions."""
+    if not files:
+        return ""
+    stream = six.StringIO()
+    stats = pstats.Stats(files[0], stream=stream)
+    for fn in files[1:]:
+        stats.add(fn)
+    stats.sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
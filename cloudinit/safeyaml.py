@@ -28,5 +28,23 @@ _CustomSafeLoader.add_constructor(
     _CustomSafeLoader.construct_python_unicode)
 
 
-def load(blob):
-    return(yaml.load(blob, Loader=_CustomSafeLoader))
+# The libyaml based loader is several times faster, use it when pyyaml was
+# built with it (with the same custom constructors as the pure one).
+if hasattr(yaml, 'CSafeLoader'):
+    class _CustomCSafeLoader(yaml.CSafeLoader):
+        def construct_python_unicode(self, node):
+            return self.construct_scalar(node)
+
+    _CustomCSafeLoader.add_constructor(
+        u'tag:yaml.org,2002:python/unicode',
+        _CustomCSafeLoader.construct_python_unicode)
+
+    Loader = _CustomCSafeLoader
+else:
+    Loader = _CustomSafeLoader
+
+
+def load(blob, loader=None):
+    if loader is None:
+        loader = Loader
+    return(yaml.load(blob, Loader=loader))
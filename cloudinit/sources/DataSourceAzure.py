@@ -22,7 +22,6 @@ import crypt
 import fnmatch
 import os
 import os.path
-import time
 import xml.etree.ElementTree as ET
 
 from xml.dom import minidom
@@ -398,14 +397,9 @@ def pubkeys_from_crt_files(flist):
 
 
 def wait_for_files(flist, maxwait=60, naplen=.5):
-    need = set(flist)
-    waited = 0
-    while waited < maxwait:
-        need -= set([f for f in need if os.path.exists(f)])
-        if len(need) == 0:
-            return []
-        time.sleep(naplen)
-        waited += naplen
+    need = util.wait_for_paths(flist, maxwait=maxwait, naplen=naplen)
+    if len(need) == 0:
+        return []
     return need
 
 
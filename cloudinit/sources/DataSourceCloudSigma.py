@@ -16,6 +16,7 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from base64 import b64decode
+import json
 import os
 import re
 
@@ -28,6 +29,34 @@ LOG = logging.getLogger(__name__)
 
 VALID_DSMODES = ("local", "net", "disabled")
 
+# The server context as read over the serial port, kept so the later
+# (ie. net) stages of this boot don't read it again
+CONTEXT_CACHE_FILE = "/run/cloud-init/cloudsigma-context.json"
+
+
+def load_cached_context():
+    try:
+        context = util.load_file(CONTEXT_CACHE_FILE)
+        if isinstance(json.loads(context), dict):
+            return context
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def cache_context(context):
+    # Only persist when running as cloud-init (which makes /run/cloud-init)
+    if not os.path.isdir(os.path.dirname(CONTEXT_CACHE_FILE)):
+        return
+    try:
+        # The context holds user-data, ssh keys and passwords, keep it
+        # out of the (often world readable) log
+        util.write_file_if_changed(CONTEXT_CACHE_FILE, json.dumps(context),
+                                   mode=0o600, log_diff=False)
+    except (IOError, OSError):
+        util.logexc(LOG, "Failed caching server context in %s",
+                    CONTEXT_CACHE_FILE)
+
 
 class DataSourceCloudSigma(sources.DataSource):
     """
@@ -38,7 +67,7 @@ class DataSourceCloudSigma(sources.DataSource):
     """
     def __init__(self, sys_cfg, distro, paths):
         self.dsmode = 'local'
-        self.cepko = Cepko()
+        self.cepko = Cepko(bulk=True, context=load_cached_context())
         self.ssh_public_key = ''
         sources.DataSource.__init__(self, sys_cfg, distro, paths)
 
@@ -82,6 +111,7 @@ class DataSourceCloudSigma(sources.DataSource):
             # but since no explicit config is available now, just debug.
             LOG.debug("CloudSigma: Unable to read from serial port")
             return False
+        cache_context(server_context)
 
         dsmode = server_meta.get('cloudinit-dsmode', self.dsmode)
         if dsmode not in VALID_DSMODES:
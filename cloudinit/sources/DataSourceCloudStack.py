@@ -49,20 +49,22 @@ class CloudStackPasswordServerClient(object):
        blob/master/cloud-set-guest-password-debian
     """
 
+    port = 8080
+
     def __init__(self, virtual_router_address):
         self.virtual_router_address = virtual_router_address
+        self.session = None
 
     def _do_request(self, domu_request):
-        # The password server was in the past, a broken HTTP server, but is now
-        # fixed.  wget handles this seamlessly, so it's easier to shell out to
-        # that rather than write our own handling code.
-        output, _ = util.subp([
-            'wget', '--quiet', '--tries', '3', '--timeout', '20',
-            '--output-document', '-', '--header',
-            'DomU_Request: {0}'.format(domu_request),
-            '{0}:8080'.format(self.virtual_router_address)
-        ])
-        return output.strip()
+        # Both requests (the password and its acknowledgement) go over one
+        # session, so to the router they are a single connection.
+        if self.session is None:
+            self.session = uhelp.new_session()
+        resp = uhelp.readurl(
+            'http://{0}:{1}/'.format(self.virtual_router_address, self.port),
+            headers={'DomU_Request': domu_request}, timeout=20, retries=2,
+            session=self.session)
+        return util.decode_binary(resp.contents).strip()
 
     def get_password(self):
         password = self._do_request('send_my_password')
@@ -197,42 +199,80 @@ def get_dhclient_d():
     return None
 
 
+def parse_server_identifier(content):
+    """Return the dhcp-server-identifier of the last lease in content."""
+    server = None
+    for line in content.splitlines():
+        if "dhcp-server-identifier" in line:
+            words = line.strip(" ;\r\n").split(" ")
+            if len(words) > 2:
+                server = words[2]
+    return server
+
+
+class LeaseIndex(object):
+    """The newest dhclient lease file of a directory and its server.
+
+    Lease files are found with a single listing (and a stat each), and the
+    newest one is only read again when its mtime or size changes.
+    """
+
+    def __init__(self):
+        # path -> ((mtime, size), dhcp-server-identifier)
+        self._parsed = {}
+
+    def latest(self, lease_d):
+        """Return (path, dhcp-server-identifier) of the newest lease file.
+
+        Either is None if there are no lease files (or no identifier).
+        """
+        latest = None
+        for file_name in os.listdir(lease_d):
+            if not (file_name.endswith(".lease") or
+                    file_name.endswith(".leases")):
+                continue
+            abs_path = os.path.join(lease_d, file_name)
+            try:
+                st = os.stat(abs_path)
+            except OSError:
+                continue
+            if latest is None or st.st_mtime > latest[0][0]:
+                latest = ((st.st_mtime, st.st_size), abs_path)
+        if latest is None:
+            return (None, None)
+        (key, path) = latest
+        cached = self._parsed.get(path)
+        if cached is None or cached[0] != key:
+            server = parse_server_identifier(util.load_file(path))
+            if server:
+                LOG.debug("Found DHCP identifier %s", server)
+            cached = (key, server)
+            self._parsed[path] = cached
+        return (path, cached[1])
+
+
+_LEASE_INDEX = LeaseIndex()
+
+
 def get_latest_lease():
     # find latest lease file
     lease_d = get_dhclient_d()
     if not lease_d:
         return None
-    lease_files = os.listdir(lease_d)
-    latest_mtime = -1
-    latest_file = None
-    for file_name in lease_files:
-        if file_name.endswith(".lease") or file_name.endswith(".leases"):
-            abs_path = os.path.join(lease_d, file_name)
-            mtime = os.path.getmtime(abs_path)
-            if mtime > latest_mtime:
-                latest_mtime = mtime
-                latest_file = abs_path
-    return latest_file
+    return _LEASE_INDEX.latest(lease_d)[0]
 
 
 def get_vr_address():
     # Get the address of the virtual router via dhcp leases
     # see http://bit.ly/T76eKC for documentation on the virtual router.
     # If no virtual router is detected, fallback on default gateway.
-    lease_file = get_latest_lease()
+    lease_d = get_dhclient_d()
+    (lease_file, latest_address) = (None, None)
+    if lease_d:
+        (lease_file, latest_address) = _LEASE_INDEX.latest(lease_d)
     if not lease_file:
         LOG.debug("No lease file found, using default gateway")
         return get_default_gateway()
-
-    latest_address = None
-    with open(lease_file, "r") as fd:
-        for line in fd:
-            if "dhcp-server-identifier" in line:
-                words = line.strip(" ;\r\n").split(" ")
-                if len(words) > 2:
-                    dhcp = words[2]
-                    LOG.debug("Found DHCP identifier %s", dhcp)
-                    latest_address = dhcp
     if not latest_address:
         # No virtual router found, fallback on default gateway
         LOG.debug("No DHCP found, using default gateway")
@@ -16,6 +16,9 @@
 
 
 from base64 import b64decode
+import json
+
+import six
 
 from cloudinit import log as logging
 from cloudinit import util
@@ -25,18 +28,71 @@ from cloudinit import url_helper
 LOG = logging.getLogger(__name__)
 
 BUILTIN_DS_CONFIG = {
-    'metadata_url': 'http://metadata.google.internal./computeMetadata/v1/'
+    'metadata_url': 'http://metadata.google.internal./computeMetadata/v1/',
+    # fetch all of instance/ and project/ in one request each
+    'recursive': True,
 }
 REQUIRED_FIELDS = ('instance-id', 'availability-zone', 'local-hostname')
 
 
 class GoogleMetadataFetcher(object):
-    headers = {'X-Google-Metadata-Request': True}
+    """Fetches metadata values by path (ie. instance/id).
+
+    When recursive, the first value asked for under instance/ (or project/)
+    fetches everything under it as json in one request, and that answers
+    all later paths there.  If that request fails paths are fetched one at
+    a time as usual.
+    """
+    headers = {'X-Google-Metadata-Request': 'True'}
+    recursive_query = '/?recursive=true&alt=json'
 
-    def __init__(self, metadata_address):
+    def __init__(self, metadata_address, recursive=False):
         self.metadata_address = metadata_address
+        self.recursive = recursive
+        self._trees = {}
+
+    def _get_tree(self, root):
+        if root not in self._trees:
+            tree = None
+            try:
+                resp = url_helper.readurl(
+                    url=self.metadata_address + root + self.recursive_query,
+                    headers=self.headers)
+                if resp.code == 200:
+                    tree = json.loads(util.decode_binary(resp.contents))
+                else:
+                    LOG.debug("recursive %s returned code %s", root,
+                              resp.code)
+            except url_helper.UrlError as exc:
+                LOG.debug("recursive %s raised exception %s", root, exc)
+            except ValueError as exc:
+                LOG.debug("recursive %s returned bad json: %s", root, exc)
+            if not isinstance(tree, dict):
+                LOG.debug("fetching %s values one at a time", root)
+                tree = None
+            self._trees[root] = tree
+        return self._trees[root]
+
+    def _lookup(self, tree, path, is_text):
+        value = tree
+        for part in path.split('/'):
+            if not isinstance(value, dict) or part not in value:
+                return None
+            value = value[part]
+        # what the server gives for the path itself (ie. a number as text)
+        if not isinstance(value, six.string_types):
+            value = json.dumps(value)
+        if is_text:
+            return value
+        return util.encode_text(value)
 
     def get_value(self, path, is_text):
+        if self.recursive and '/' in path:
+            (root, subpath) = path.split('/', 1)
+            tree = self._get_tree(root)
+            if tree is not None:
+                return self._lookup(tree, subpath, is_text)
+
         value = None
         try:
             resp = url_helper.readurl(url=self.metadata_address + path,
@@ -92,7 +148,9 @@ class DataSourceGCE(sources.DataSource):
             LOG.debug("%s is not resolvable", self.metadata_address)
             return False
 
-        metadata_fetcher = GoogleMetadataFetcher(self.metadata_address)
+        metadata_fetcher = GoogleMetadataFetcher(
+            self.metadata_address,
+            recursive=util.is_true(self.ds_cfg.get('recursive')))
         # iterate over url_map keys to get metadata items
         running_on_gce = False
         for (mkey, paths, required, is_text) in url_map:
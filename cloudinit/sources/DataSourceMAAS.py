@@ -99,7 +99,7 @@ class DataSourceMAAS(sources.DataSource):
 
             (userdata, metadata) = read_maas_seed_url(
                 self.base_url, read_file_or_url=self.oauth_helper.readurl,
-                paths=self.paths, retries=1)
+                paths=self.paths, retries=1, deadline=util.SEED_DEADLINE)
             self.userdata_raw = userdata
             self.metadata = metadata
             return True
@@ -165,7 +165,8 @@ def read_maas_seed_dir(seed_d):
 
 
 def read_maas_seed_url(seed_url, read_file_or_url=None, timeout=None,
-                       version=MD_VERSION, paths=None, retries=None):
+                       version=MD_VERSION, paths=None, retries=None,
+                       deadline=None):
     """
     Read the maas datasource at seed_url.
       read_file_or_url is a method that should provide an interface
@@ -175,6 +176,10 @@ def read_maas_seed_url(seed_url, read_file_or_url=None, timeout=None,
       * <seed_url>/<version>/meta-data/instance-id
       * <seed_url>/<version>/meta-data/local-hostname
       * <seed_url>/<version>/user-data
+
+    The files are fetched concurrently over one session.  If deadline
+    (seconds) is given, util.DeadlineExceededError is raised when they
+    are not all read by then.
     """
     base_url = "%s/%s" % (seed_url, version)
     file_order = [
@@ -193,29 +198,45 @@ def read_maas_seed_url(seed_url, read_file_or_url=None, timeout=None,
     if read_file_or_url is None:
         read_file_or_url = util.read_file_or_url
 
-    md = {}
-    for name in file_order:
-        url = files.get(name)
+    ssl_details = util.fetch_ssl_details(paths)
+    session = url_helper.new_session()
+
+    def fetch(name):
         if name == 'user-data':
             item_retries = 0
         else:
             item_retries = retries
-
         try:
-            ssl_details = util.fetch_ssl_details(paths)
-            resp = read_file_or_url(url, retries=item_retries,
-                                    timeout=timeout, ssl_details=ssl_details)
-            if resp.ok():
-                if name in BINARY_FIELDS:
-                    md[name] = resp.contents
-                else:
-                    md[name] = util.decode_binary(resp.contents)
-            else:
-                LOG.warn(("Fetching from %s resulted in"
-                          " an invalid http code %s"), url, resp.code)
+            return read_file_or_url(files[name], retries=item_retries,
+                                    timeout=timeout, ssl_details=ssl_details,
+                                    session=session)
         except url_helper.UrlError as e:
-            if e.code != 404:
+            # A request made alongside the first ones can fail oauth
+            # before they got the clock skew fixed, so try it again.
+            if item_retries or e.code not in (401, 403):
                 raise
+            return read_file_or_url(files[name], retries=0,
+                                    timeout=timeout, ssl_details=ssl_details,
+                                    session=session)
+
+    fetched = util.run_concurrently(fetch, file_order,
+                                    max_workers=len(file_order),
+                                    timeout=deadline)
+    md = {}
+    for (name, (resp, error)) in zip(file_order, fetched):
+        url = files.get(name)
+        if error is not None:
+            if isinstance(error, url_helper.UrlError) and error.code == 404:
+                continue
+            raise error
+        if resp.ok():
+            if name in BINARY_FIELDS:
+                md[name] = resp.contents
+            else:
+                md[name] = util.decode_binary(resp.contents)
+        else:
+            LOG.warn(("Fetching from %s resulted in"
+                      " an invalid http code %s"), url, resp.code)
     return check_seed_contents(md, seed_url)
 
 
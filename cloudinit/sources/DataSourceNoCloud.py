@@ -166,7 +166,8 @@ class DataSourceNoCloud(sources.DataSource):
 
             # This could throw errors, but the user told us to do it
             # so if errors are raised, let them raise
-            (md_seed, ud) = util.read_seeded(seedfrom, timeout=None)
+            (md_seed, ud) = util.read_seeded(seedfrom, timeout=None,
+                                             deadline=util.SEED_DEADLINE)
             LOG.debug("Using seeded cache data from %s", seedfrom)
 
             # Values in the command line override those from the seed
@@ -25,7 +25,6 @@ from xml.dom import minidom
 import base64
 import os
 import re
-import time
 
 from cloudinit import log as logging
 from cloudinit import sources
@@ -175,7 +174,8 @@ class DataSourceOVF(sources.DataSource):
                           seedfrom, self)
                 return False
 
-            (md_seed, ud) = util.read_seeded(seedfrom, timeout=None)
+            (md_seed, ud) = util.read_seeded(seedfrom, timeout=None,
+                                             deadline=util.SEED_DEADLINE)
             LOG.debug("Using seeded cache data from %s", seedfrom)
 
             md = util.mergemanydict([md, md_seed])
@@ -214,15 +214,16 @@ class DataSourceOVFNet(DataSourceOVF):
 
 
 def wait_for_imc_cfg_file(dirpath, filename, maxwait=180, naplen=5):
-    waited = 0
-
-    while waited < maxwait:
-        fileFullPath = search_file(dirpath, filename)
-        if fileFullPath:
-            return fileFullPath
-        time.sleep(naplen)
-        waited += naplen
-    return None
+    def watch():
+        # the file may turn up anywhere under dirpath (or dirpath itself)
+        if not os.path.isdir(dirpath):
+            return [util.existing_parent_dir(
+                os.path.join(dirpath, filename))]
+        return [root for (root, _dirs, _files) in os.walk(dirpath)]
+
+    fileFullPath = util.wait_for(lambda: search_file(dirpath, filename),
+                                 watch, maxwait=maxwait, naplen=naplen)
+    return fileFullPath or None
 
 
 # This will return a dict with some content
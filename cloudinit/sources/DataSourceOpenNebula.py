@@ -24,12 +24,14 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import functools
 import os
 import pwd
 import re
 import string
 
 from cloudinit import log as logging
+from cloudinit import net
 from cloudinit import sources
 from cloudinit import util
 
@@ -42,6 +44,11 @@ DEFAULT_PARSEUSER = 'nobody'
 CONTEXT_DISK_FILES = ["context.sh"]
 VALID_DSMODES = ("local", "net", "disabled")
 
+# variables that change on their own in bash (or that it uses itself), these
+# are never taken from context.sh
+EXCLUDED_VARS = ("RANDOM", "LINENO", "SECONDS", "_", "__v", "EPOCHREALTIME",
+                 "EPOCHSECONDS", "SRANDOM")
+
 
 class DataSourceOpenNebula(sources.DataSource):
     def __init__(self, sys_cfg, distro, paths):
@@ -59,20 +66,22 @@ class DataSourceOpenNebula(sources.DataSource):
         results = None
         seed = None
 
-        # decide parseuser for context.sh shell reader
+        # decide parseuser for context.sh shell reader (if bash is used)
         parseuser = DEFAULT_PARSEUSER
         if 'parseuser' in self.ds_cfg:
             parseuser = self.ds_cfg.get('parseuser')
+        reader = functools.partial(
+            read_context_disk_dir, asuser=parseuser,
+            bash_fallback=util.is_true(self.ds_cfg.get('bash_fallback')))
 
         candidates = [self.seed_dir]
         candidates.extend(find_candidate_devs())
         for cdev in candidates:
             try:
                 if os.path.isdir(self.seed_dir):
-                    results = read_context_disk_dir(cdev, asuser=parseuser)
+                    results = reader(cdev)
                 elif cdev.startswith("/dev"):
-                    results = util.mount_cb(cdev, read_context_disk_dir,
-                                            data=parseuser)
+                    results = util.mount_cb(cdev, reader)
             except NonContextDiskDir:
                 continue
             except BrokenContextDiskDir as exc:
@@ -147,18 +156,16 @@ class BrokenContextDiskDir(Exception):
     pass
 
 
-class OpenNebulaNetwork(object):
-    REG_DEV_MAC = re.compile(
-        r'^\d+: (eth\d+):.*?link\/ether (..:..:..:..:..:..) ?',
-        re.MULTILINE | re.DOTALL)
+class UnsupportedContext(Exception):
+    """context.sh uses shell syntax that parse_context does not handle."""
 
-    def __init__(self, ip, context):
-        self.ip = ip
-        self.context = context
-        self.ifaces = self.get_ifaces()
 
-    def get_ifaces(self):
-        return self.REG_DEV_MAC.findall(self.ip)
+class OpenNebulaNetwork(object):
+    def __init__(self, context, ifaces=None):
+        self.context = context
+        if ifaces is None:
+            ifaces = get_ifaces()
+        self.ifaces = ifaces
 
     def mac2ip(self, mac):
         components = mac.split(':')[2:]
@@ -263,6 +270,25 @@ def find_candidate_devs():
     return combined
 
 
+def _eth_index(name):
+    return int(name[len('eth'):])
+
+
+def get_ifaces():
+    """Return (name, mac) of each ethN device (in N order) from sysfs."""
+    ifaces = []
+    for name in net.get_devicelist():
+        if not re.match(r'^eth\d+$', name):
+            continue
+        try:
+            mac = net.read_sys_net(name, 'address')
+        except (IOError, OSError):
+            continue
+        if re.match(r'^(..:){5}..$', mac):
+            ifaces.append((name, mac))
+    return sorted(ifaces, key=lambda iface: _eth_index(iface[0]))
+
+
 def switch_user_cmd(user):
     return ['sudo', '-u', user]
 
@@ -326,7 +352,7 @@ def parse_shell_config(content, keylist=None, bash=None, asuser=None,
     (output, _error) = util.subp(cmd, data=bcmd)
 
     # exclude vars in bash that change on their own or that we used
-    excluded = ("RANDOM", "LINENO", "SECONDS", "_", "__v")
+    excluded = EXCLUDED_VARS
     preset = {}
     ret = {}
     target = None
@@ -353,11 +379,126 @@ def parse_shell_config(content, keylist=None, bash=None, asuser=None,
     return ret
 
 
-def read_context_disk_dir(source_dir, asuser=None):
+# what may follow an unquoted '$' (or one in double quotes) and make it
+# an expansion rather than a literal '$'
+EXPANSION_START = string.ascii_letters + string.digits + "_{(@*#?$!-"
+NAME_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*=')
+
+
+def _read_single_quoted(content, pos):
+    end = content.find("'", pos)
+    if end < 0:
+        raise UnsupportedContext("unterminated ' at %s" % (pos - 1))
+    return (content[pos:end], end + 1)
+
+
+def _read_double_quoted(content, pos):
+    value = []
+    while pos < len(content):
+        c = content[pos]
+        if c == '"':
+            return ("".join(value), pos + 1)
+        elif c == '\\' and pos + 1 < len(content):
+            n = content[pos + 1]
+            if n in '$`"\\':
+                value.append(n)
+            elif n != '\n':
+                # any other backslash is kept (a backslash-newline is not)
+                value.append(c + n)
+            pos += 2
+            continue
+        elif c == '`' or (c == '$' and content[pos + 1:pos + 2] and
+                          content[pos + 1] in EXPANSION_START):
+            raise UnsupportedContext("expansion at %s" % pos)
+        value.append(c)
+        pos += 1
+    raise UnsupportedContext('unterminated " in context')
+
+
+def _read_value(content, pos):
+    """Read the (possibly quoted) word that starts at pos."""
+    value = []
+    start = pos
+    while pos < len(content):
+        c = content[pos]
+        if c in ' \t\n':
+            break
+        elif c == "'":
+            (part, pos) = _read_single_quoted(content, pos + 1)
+            value.append(part)
+        elif c == '"':
+            (part, pos) = _read_double_quoted(content, pos + 1)
+            value.append(part)
+        elif c == '\\':
+            if pos + 1 == len(content):
+                value.append(c)
+            elif content[pos + 1] != '\n':
+                value.append(content[pos + 1])
+            pos += 2
+        elif (c in ';&|<>()`' or (c == '~' and pos == start) or
+              (c == '$' and content[pos + 1:pos + 2] and
+               content[pos + 1] in EXPANSION_START)):
+            raise UnsupportedContext("unsupported %r at %s" % (c, pos))
+        else:
+            value.append(c)
+            pos += 1
+    return ("".join(value), pos)
+
+
+def parse_context(content):
+    """Parse the KEY=VALUE assignments of context.sh without a shell.
+
+    Values can be single quoted, double quoted (with backslash escapes),
+    unquoted or a mix of these, and can span lines, as OpenNebula writes
+    them.  Anything else (commands, expansions...) raises
+    UnsupportedContext, that content is left to parse_shell_config.
+    The result is what parse_shell_config would return for content.
+    """
+    ret = {}
+    pos = 0
+    while pos < len(content):
+        c = content[pos]
+        if c in ' \t\n':
+            pos += 1
+            continue
+        elif c == '#':
+            end = content.find('\n', pos)
+            pos = len(content) if end < 0 else end + 1
+            continue
+        elif c == '\\' and content[pos + 1:pos + 2] == '\n':
+            pos += 2
+            continue
+        match = NAME_RE.match(content, pos)
+        if not match:
+            raise UnsupportedContext("not an assignment at %s" % pos)
+        key = match.group(0)[:-1]
+        (value, pos) = _read_value(content, match.end())
+        if key not in EXCLUDED_VARS:
+            ret[key] = value
+    return ret
+
+
+def _parse_with_bash(content, asuser):
+    if asuser is not None:
+        try:
+            pwd.getpwnam(asuser)
+        except KeyError:
+            raise BrokenContextDiskDir("configured user '%s' "
+                                       "does not exist" % asuser)
+    try:
+        return parse_shell_config(content, asuser=asuser)
+    except util.ProcessExecutionError as e:
+        raise BrokenContextDiskDir("Error processing context.sh: %s" % (e))
+
+
+def read_context_disk_dir(source_dir, asuser=None, bash_fallback=False):
     """
     read_context_disk_dir(source_dir):
     read source_dir and return a tuple with metadata dict and user-data
     string populated.  If not a valid dir, raise a NonContextDiskDir
+
+    context.sh is read with parse_context, and only if that can't and
+    bash_fallback is set is it run through bash (as asuser).
     """
     found = {}
     for af in CONTEXT_DISK_FILES:
@@ -372,20 +513,20 @@ def read_context_disk_dir(source_dir, asuser=None):
     results = {'userdata': None, 'metadata': {}}
 
     if "context.sh" in found:
-        if asuser is not None:
-            try:
-                pwd.getpwnam(asuser)
-            except KeyError as e:
-                raise BrokenContextDiskDir("configured user '%s' "
-                                           "does not exist", asuser)
         try:
             path = os.path.join(source_dir, 'context.sh')
             content = util.load_file(path)
-            context = parse_shell_config(content, asuser=asuser)
-        except util.ProcessExecutionError as e:
-            raise BrokenContextDiskDir("Error processing context.sh: %s" % (e))
         except IOError as e:
             raise NonContextDiskDir("Error reading context.sh: %s" % (e))
+        try:
+            context = parse_context(content)
+        except UnsupportedContext as e:
+            if not bash_fallback:
+                raise BrokenContextDiskDir(
+                    "Error processing context.sh: %s (set bash_fallback to "
+                    "read it with bash)" % e)
+            LOG.debug("Reading context.sh with bash: %s", e)
+            context = _parse_with_bash(content, asuser)
     else:
         raise NonContextDiskDir("Missing context.sh")
 
@@ -435,9 +576,8 @@ def read_context_disk_dir(source_dir, asuser=None):
     # http://opennebula.org/documentation:rel3.8:cong#network_configuration
     for k in context:
         if re.match(r'^ETH\d+_IP$', k):
-            (out, _) = util.subp(['/sbin/ip', 'link'])
-            net = OpenNebulaNetwork(out, context)
-            results['network-interfaces'] = net.gen_conf()
+            onet = OpenNebulaNetwork(context)
+            results['network-interfaces'] = onet.gen_conf()
             break
 
     return results
@@ -258,17 +258,7 @@ class DataSourceSmartOS(sources.DataSource):
             LOG.debug('Seed file object not found.')
             return False
         with contextlib.closing(seed_obj) as seed:
-            b64_keys = self.query('base64_keys', seed, strip=True, b64=False)
-            if b64_keys is not None:
-                self.b64_keys = [k.strip() for k in str(b64_keys).split(',')]
-
-            b64_all = self.query('base64_all', seed, strip=True, b64=False)
-            if b64_all is not None:
-                self.b64_all = util.is_true(b64_all)
-
-            for ci_noun, attribute in SMARTOS_ATTRIB_MAP.items():
-                smartos_noun, strip = attribute
-                md[ci_noun] = self.query(smartos_noun, seed, strip=strip)
+            md = self.query_all(seed)
 
         # @datadictionary: This key may contain a program that is written
         # to a file in the filesystem of the guest on each boot and then
@@ -331,16 +321,57 @@ class DataSourceSmartOS(sources.DataSource):
     def get_instance_id(self):
         return self.metadata['instance-id']
 
+    def _want_b64(self, noun):
+        if noun in self.smartos_no_base64:
+            return False
+        elif self.b64_all or noun in self.b64_keys:
+            return True
+        return None
+
     def query(self, noun, seed_file, strip=False, default=None, b64=None):
         if b64 is None:
-            if noun in self.smartos_no_base64:
-                b64 = False
-            elif self.b64_all or noun in self.b64_keys:
-                b64 = True
+            b64 = self._want_b64(noun)
 
         return self._query_data(noun, seed_file, strip=strip,
                                 default=default, b64=b64)
 
+    def query_all(self, seed_file):
+        """Query every key in SMARTOS_ATTRIB_MAP in one pipelined exchange.
+
+           Along with them go base64_keys, base64_all and the b64-<noun>
+           key of each noun that may be base64 encoded, so nothing needs
+           asking in a second round.  Returns the cloud-init metadata.
+        """
+        nouns = ['base64_keys', 'base64_all']
+        for (smartos_noun, _strip) in SMARTOS_ATTRIB_MAP.values():
+            nouns.append(smartos_noun)
+            if smartos_noun not in self.smartos_no_base64:
+                nouns.append('b64-%s' % smartos_noun)
+        values = JoyentMetadataClient(seed_file).get_metadata_many(nouns)
+
+        b64_keys = self._decode(
+            'base64_keys', values['base64_keys'], strip=True, b64=False)
+        if b64_keys is not None:
+            self.b64_keys = [k.strip() for k in str(b64_keys).split(',')]
+
+        b64_all = self._decode(
+            'base64_all', values['base64_all'], strip=True, b64=False)
+        if b64_all is not None:
+            self.b64_all = util.is_true(b64_all)
+
+        md = {}
+        for ci_noun, attribute in SMARTOS_ATTRIB_MAP.items():
+            smartos_noun, strip = attribute
+            b64 = self._want_b64(smartos_noun)
+            if b64 is None:
+                b64 = util.is_true(self._decode(
+                    'b64-%s' % smartos_noun,
+                    values.get('b64-%s' % smartos_noun), strip=True,
+                    b64=False, default=False))
+            md[ci_noun] = self._decode(smartos_noun, values[smartos_noun],
+                                       strip=strip, b64=b64)
+        return md
+
     def _query_data(self, noun, seed_file, strip=False,
                     default=None, b64=None):
         """Makes a request via "GET <NOUN>"
@@ -368,6 +399,12 @@ class DataSourceSmartOS(sources.DataSource):
                                    default=False, strip=True)
             b64 = util.is_true(b64)
 
+        return self._decode(noun, response, strip=strip, b64=b64)
+
+    def _decode(self, noun, response, strip=False, b64=False, default=None):
+        if response is None:
+            return default
+
         resp = None
         if b64 or strip:
             resp = "".join(response).rstrip()
@@ -401,14 +438,25 @@ class JoyentMetadataClient(object):
 
     The full specification can be found at
     http://eng.joyent.com/mdata/protocol.html
+
+    Replies are read from the transport as whole buffers rather than a
+    byte at a time, and get_metadata_many() keeps up to pipeline_depth
+    requests outstanding, matching replies to them by request id.
     """
     line_regex = re.compile(
         r'V2 (?P<length>\d+) (?P<checksum>[0-9a-f]+)'
         r' (?P<body>(?P<request_id>[0-9a-f]+) (?P<status>SUCCESS|NOTFOUND)'
         r'( (?P<payload>.+))?)')
 
-    def __init__(self, metasource):
+    # ~60 bytes a request, so the outstanding ones fit in a tty buffer
+    pipeline_depth = 32
+    read_size = 4096
+
+    def __init__(self, metasource, pipeline_depth=None):
         self.metasource = metasource
+        if pipeline_depth is not None:
+            self.pipeline_depth = pipeline_depth
+        self._buffer = bytearray()
 
     def _checksum(self, body):
         return '{0:08x}'.format(
@@ -436,28 +484,83 @@ class JoyentMetadataClient(object):
         LOG.debug('Value "%s" found.', value)
         return value
 
-    def get_metadata(self, metadata_key):
-        LOG.debug('Fetching metadata key "%s"...', metadata_key)
-        request_id = '{0:08x}'.format(random.randint(0, 0xffffffff))
+    def _request(self, request_id, metadata_key):
         message_body = '{0} GET {1}'.format(request_id,
                                             util.b64e(metadata_key))
-        msg = 'V2 {0} {1} {2}\n'.format(
+        return 'V2 {0} {1} {2}\n'.format(
             len(message_body), self._checksum(message_body), message_body)
-        LOG.debug('Writing "%s" to metadata transport.', msg)
-        self.metasource.write(msg.encode('ascii'))
-        self.metasource.flush()
-
-        response = bytearray()
-        response.extend(self.metasource.read(1))
-        while response[-1:] != b'\n':
-            response.extend(self.metasource.read(1))
-        response = response.rstrip().decode('ascii')
-        LOG.debug('Read "%s" from metadata transport.', response)
-
-        if 'SUCCESS' not in response:
-            return None
 
-        return self._get_value_from_frame(request_id, response)
+    def _read_chunk(self):
+        # Take whatever is already there (but wait for at least a byte)
+        # instead of asking the transport for one byte at a time.
+        if hasattr(self.metasource, 'inWaiting'):
+            return self.metasource.read(max(1, self.metasource.inWaiting()))
+        elif hasattr(self.metasource, 'read1'):
+            return self.metasource.read1(self.read_size)
+        return self.metasource.read(1)
+
+    def _read_frame(self):
+        while True:
+            end = self._buffer.find(b'\n')
+            if end != -1:
+                frame = self._buffer[:end]
+                del self._buffer[:end + 1]
+                frame = frame.rstrip().decode('ascii')
+                LOG.debug('Read "%s" from metadata transport.', frame)
+                return frame
+            chunk = self._read_chunk()
+            if not chunk:
+                raise JoyentMetadataFetchException(
+                    'Metadata transport closed mid response.')
+            self._buffer.extend(chunk)
+
+    def get_metadata(self, metadata_key):
+        return self.get_metadata_many([metadata_key])[metadata_key]
+
+    def get_metadata_many(self, metadata_keys):
+        """Fetch metadata_keys, returning a dict of key to value.
+
+        Keys that are not found have a value of None.
+        """
+        metadata_keys = list(metadata_keys)
+        start_id = random.randint(0, 0xffffffff)
+        unsent = []
+        for (i, key) in enumerate(metadata_keys):
+            unsent.append(
+                ('{0:08x}'.format((start_id + i) & 0xffffffff), key))
+        unsent.reverse()
+        pending = {}
+        values = {}
+        while unsent or pending:
+            msgs = []
+            while unsent and len(pending) < self.pipeline_depth:
+                (request_id, key) = unsent.pop()
+                LOG.debug('Fetching metadata key "%s"...', key)
+                pending[request_id] = key
+                msgs.append(self._request(request_id, key))
+            if msgs:
+                msg = ''.join(msgs)
+                LOG.debug('Writing "%s" to metadata transport.', msg)
+                self.metasource.write(msg.encode('ascii'))
+                self.metasource.flush()
+
+            response = self._read_frame()
+            match = self.line_regex.match(response)
+            if not match:
+                raise JoyentMetadataFetchException(
+                    'Unparseable response "{0}".'.format(response))
+            request_id = match.group('request_id')
+            if request_id not in pending:
+                raise JoyentMetadataFetchException(
+                    'Request ID mismatch (expected one of: {0}; '
+                    'got {1}).'.format(sorted(pending), request_id))
+            key = pending.pop(request_id)
+            if match.group('status') != 'SUCCESS':
+                values[key] = None
+            else:
+                values[key] = self._get_value_from_frame(request_id,
+                                                         response)
+        return values
 
 
 def dmi_data():
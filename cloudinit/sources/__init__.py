@@ -74,7 +74,11 @@ class DataSource(object):
             self.ds_cfg = {}
 
         if not ud_proc:
-            self.ud_proc = ud.UserDataProcessor(self.paths)
+            max_size = util.get_cfg_option_int(self.sys_cfg,
+                                               'decompress_max_size',
+                                               util.DECOMP_MAX_SIZE)
+            self.ud_proc = ud.UserDataProcessor(self.paths,
+                                                decomp_max_size=max_size)
         else:
             self.ud_proc = ud_proc
 
@@ -171,27 +171,26 @@ def parse_authorized_keys(fname):
 
 
 def update_authorized_keys(old_entries, keys):
-    to_add = list(keys)
+    keys = list(keys)
 
+    # Index the new keys by their base64, the last one given for a key wins
+    by_base64 = {}
+    for k in keys:
+        by_base64[k.base64] = k
+
+    # Replace those with the same base64 with our better one
+    replaced = set()
     for i in range(0, len(old_entries)):
         ent = old_entries[i]
-        if not ent.valid():
+        if not ent.valid() or ent.base64 not in by_base64:
             continue
-        # Replace those with the same base64
-        for k in keys:
-            if not ent.valid():
-                continue
-            if k.base64 == ent.base64:
-                # Replace it with our better one
-                ent = k
-                # Don't add it later
-                if k in to_add:
-                    to_add.remove(k)
-        old_entries[i] = ent
+        old_entries[i] = by_base64[ent.base64]
+        replaced.add(ent.base64)
 
     # Now append any entries we did not match above
-    for key in to_add:
-        old_entries.append(key)
+    for key in keys:
+        if key.base64 not in replaced:
+            old_entries.append(key)
 
     # Now format them back to strings...
     lines = [str(b) for b in old_entries]
@@ -208,7 +207,38 @@ def users_ssh_info(username):
     return (os.path.join(pw_ent.pw_dir, '.ssh'), pw_ent)
 
 
+# sshd_config path -> (its stat signature, its AuthorizedKeysFile setting)
+_AUTH_KEYS_FILE_SETTINGS = {}
+
+
+def _authorized_keys_file_setting(fname=None):
+    """Return the AuthorizedKeysFile setting of sshd_config fname.
+
+    The setting is looked up once per process, and only again when the
+    file has changed since.
+    """
+    if fname is None:
+        fname = DEF_SSHD_CFG
+    try:
+        stats = os.stat(fname)
+        signature = (stats.st_ino, stats.st_size, stats.st_mtime)
+    except OSError:
+        signature = None
+    cached = _AUTH_KEYS_FILE_SETTINGS.get(fname)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    ssh_cfg = parse_ssh_config_map(fname)
+    setting = ssh_cfg.get("authorizedkeysfile", '').strip()
+    _AUTH_KEYS_FILE_SETTINGS[fname] = (signature, setting)
+    return setting
+
+
 def extract_authorized_keys(username):
+    auth_key_fn = authorized_keys_path(username)
+    return (auth_key_fn, parse_authorized_keys(auth_key_fn))
+
+
+def authorized_keys_path(username):
     (ssh_dir, pw_ent) = users_ssh_info(username)
     auth_key_fn = None
     with util.SeLinuxGuard(ssh_dir, recursive=True):
@@ -218,8 +248,7 @@ def extract_authorized_keys(username):
             # The following tokens are defined: %% is replaced by a literal
             # '%', %h is replaced by the home directory of the user being
             # authenticated and %u is replaced by the username of that user.
-            ssh_cfg = parse_ssh_config_map(DEF_SSHD_CFG)
-            auth_key_fn = ssh_cfg.get("authorizedkeysfile", '').strip()
+            auth_key_fn = _authorized_keys_file_setting()
             if not auth_key_fn:
                 auth_key_fn = "%h/.ssh/authorized_keys"
             auth_key_fn = auth_key_fn.replace("%h", pw_ent.pw_dir)
@@ -233,29 +262,52 @@ def extract_authorized_keys(username):
             util.logexc(LOG, "Failed extracting 'AuthorizedKeysFile' in ssh "
                         "config from %r, using 'AuthorizedKeysFile' file "
                         "%r instead", DEF_SSHD_CFG, auth_key_fn)
-    return (auth_key_fn, parse_authorized_keys(auth_key_fn))
+    return auth_key_fn
 
 
 def setup_user_keys(keys, username, options=None):
-    # Make sure the users .ssh dir is setup accordingly
-    (ssh_dir, pwent) = users_ssh_info(username)
-    if not os.path.isdir(ssh_dir):
-        util.ensure_dir(ssh_dir, mode=0o700)
-        util.chownbyid(ssh_dir, pwent.pw_uid, pwent.pw_gid)
+    setup_users_keys([(keys, username, options)])
+
+
+def setup_users_keys(users_keys):
+    """Add keys to the authorized keys of many users at once.
 
-    # Turn the 'update' keys given into actual entries
+    users_keys holds (keys, username, options) tuples, each handled as
+    setup_user_keys(keys, username, options) would, in order; every
+    authorized keys file is read and written only once.
+    """
     parser = AuthKeyLineParser()
-    key_entries = []
-    for k in keys:
-        key_entries.append(parser.parse(str(k), options=options))
+    # auth_key_fn -> (entries, content, ssh_dir, pwent), in the order seen
+    updates = {}
+    order = []
+    for (keys, username, options) in users_keys:
+        # Make sure the users .ssh dir is setup accordingly
+        (ssh_dir, pwent) = users_ssh_info(username)
+        if not os.path.isdir(ssh_dir):
+            util.ensure_dir(ssh_dir, mode=0o700)
+            util.chownbyid(ssh_dir, pwent.pw_uid, pwent.pw_gid)
+
+        # Turn the 'update' keys given into actual entries
+        key_entries = []
+        for k in keys:
+            key_entries.append(parser.parse(str(k), options=options))
 
-    # Extract the old and make the new
-    (auth_key_fn, auth_key_entries) = extract_authorized_keys(username)
-    with util.SeLinuxGuard(ssh_dir, recursive=True):
+        # Extract the old (or what is already pending) and make the new
+        auth_key_fn = authorized_keys_path(username)
+        if auth_key_fn in updates:
+            auth_key_entries = updates[auth_key_fn][0]
+        else:
+            auth_key_entries = parse_authorized_keys(auth_key_fn)
+            order.append(auth_key_fn)
         content = update_authorized_keys(auth_key_entries, key_entries)
-        util.ensure_dir(os.path.dirname(auth_key_fn), mode=0o700)
-        util.write_file(auth_key_fn, content, mode=0o600)
-        util.chownbyid(auth_key_fn, pwent.pw_uid, pwent.pw_gid)
+        updates[auth_key_fn] = (auth_key_entries, content, ssh_dir, pwent)
+
+    for auth_key_fn in order:
+        (_entries, content, ssh_dir, pwent) = updates[auth_key_fn]
+        with util.SeLinuxGuard(ssh_dir, recursive=True):
+            util.ensure_dir(os.path.dirname(auth_key_fn), mode=0o700)
+            util.write_file(auth_key_fn, content, mode=0o600)
+            util.chownbyid(auth_key_fn, pwent.pw_uid, pwent.pw_gid)
 
 
 class SshdConfigLine(object):
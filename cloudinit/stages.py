@@ -44,6 +44,7 @@ from cloudinit import helpers
 from cloudinit import importer
 from cloudinit import log as logging
 from cloudinit import net
+from cloudinit import profiling
 from cloudinit import sources
 from cloudinit import type_utils
 from cloudinit import util
@@ -699,7 +700,7 @@ class Modules(object):
             mostly_mods.append([mod, raw_name, freq, run_args])
         return mostly_mods
 
-    def _run_modules(self, mostly_mods):
+    def _run_modules(self, mostly_mods, stage=None):
         cc = self.init.cloudify()
         # Return which ones ran
         # and which ones failed + the exception of why it failed
@@ -730,9 +731,23 @@ class Modules(object):
                 myrep = events.ReportEventStack(
                     name=run_name, description=desc, parent=self.reporter)
 
+                handle = mod.handle
+                profiler = None
+                if profiling.should_profile(self.cfg, name):
+                    profiler = profiling.ModuleProfiler(
+                        name, self.init.paths.get_ipath_cur('profiles'),
+                        memory=util.get_cfg_option_bool(
+                            self.cfg, 'profile_memory', False),
+                        stage=stage)
+                    handle = profiler.wrap(handle)
+
                 with myrep:
-                    ran, _r = cc.run(run_name, mod.handle, func_args,
-                                     freq=freq)
+                    try:
+                        ran, _r = cc.run(run_name, handle, func_args,
+                                         freq=freq)
+                    finally:
+                        if profiler:
+                            profiler.report(myrep)
                     if ran:
                         myrep.message = "%s ran successfully" % run_name
                     else:
@@ -753,7 +768,7 @@ class Modules(object):
         # Now resume doing the normal fixups and running
         raw_mods = [mod_to_be]
         mostly_mods = self._fixup_modules(raw_mods)
-        return self._run_modules(mostly_mods)
+        return self._run_modules(mostly_mods, stage='single')
 
     def run_section(self, section_name):
         raw_mods = self._read_modules(section_name)
@@ -784,7 +799,7 @@ class Modules(object):
         if forced:
             LOG.info("running unverified_modules: %s", forced)
 
-        return self._run_modules(mostly_mods)
+        return self._run_modules(mostly_mods, stage=section_name)
 
 
 def fetch_base_config():
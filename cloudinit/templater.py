@@ -21,7 +21,10 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import collections
+import hashlib
+import os
 import re
+import threading
 
 try:
     from Cheetah.Template import Template as CTemplate
@@ -31,7 +34,6 @@ except (ImportError, AttributeError):
 
 try:
     import jinja2
-    from jinja2 import Template as JTemplate
     JINJA_AVAILABLE = True
 except (ImportError, AttributeError):
     JINJA_AVAILABLE = False
@@ -44,6 +46,88 @@ LOG = logging.getLogger(__name__)
 TYPE_MATCHER = re.compile(r"##\s*template:(.*)", re.I)
 BASIC_MATCHER = re.compile(r'\$\{([A-Za-z0-9_.]+)\}|\$([A-Za-z0-9_.]+)')
 
+# Compiled jinja templates are kept here (when its parent exists) so that
+# later boots and instances skip compiling the same templates again.
+BYTECODE_CACHE_DIR = "/var/lib/cloud/data/template-cache"
+
+# Compiled templates by content hash, and what render_from_file() last
+# read from each file (keyed by its path, mtime, size and inode).  The
+# compiled ones are dropped once there are TEMPLATE_CACHE_MAX_ENTRIES.
+TEMPLATE_CACHE_MAX_ENTRIES = 64
+_TEMPLATES = {}
+_FILES = {}
+_JINJA_ENV = None
+_LOCK = threading.RLock()
+
+
+def _content_key(content):
+    return hashlib.sha1(util.encode_text(content)).hexdigest()
+
+
+if JINJA_AVAILABLE:
+    class _ContentLoader(jinja2.BaseLoader):
+        # Templates are named by the hash of their content, so whatever
+        # has been compiled under a name is always up to date.
+        def __init__(self):
+            self.sources = {}
+
+        def get_source(self, environment, template):
+            if template not in self.sources:
+                raise jinja2.TemplateNotFound(template)
+            return (self.sources[template], None, lambda: True)
+
+
+def _get_jinja_env():
+    global _JINJA_ENV
+    if _JINJA_ENV is None:
+        bytecode_cache = None
+        cache_dir = BYTECODE_CACHE_DIR
+        if os.path.isdir(os.path.dirname(cache_dir)):
+            try:
+                util.ensure_dir(cache_dir, mode=0o700)
+                bytecode_cache = jinja2.FileSystemBytecodeCache(cache_dir)
+            except (IOError, OSError):
+                util.logexc(LOG, "Failed creating template cache at %s",
+                            cache_dir)
+        _JINJA_ENV = jinja2.Environment(loader=_ContentLoader(),
+                                        bytecode_cache=bytecode_cache,
+                                        undefined=jinja2.StrictUndefined,
+                                        trim_blocks=True)
+    return _JINJA_ENV
+
+
+def _compile_jinja(content):
+    env = _get_jinja_env()
+    key = _content_key(content)
+    env.loader.sources[key] = content
+    return env.get_template(key)
+
+
+def _compile_cheetah(content):
+    return CTemplate.compile(source=content)
+
+
+def _compiled(kind, compiler, content):
+    global _JINJA_ENV
+    key = (kind, _content_key(content))
+    with _LOCK:
+        if key not in _TEMPLATES:
+            if len(_TEMPLATES) >= TEMPLATE_CACHE_MAX_ENTRIES:
+                # The jinja environment holds every source it compiled too
+                _TEMPLATES.clear()
+                _JINJA_ENV = None
+            _TEMPLATES[key] = compiler(content)
+        return _TEMPLATES[key]
+
+
+def clear_cache():
+    """Forget all compiled templates (those kept on disk stay)."""
+    global _JINJA_ENV
+    with _LOCK:
+        _TEMPLATES.clear()
+        _FILES.clear()
+        _JINJA_ENV = None
+
 
 def basic_render(content, params):
     """This does simple replacement of bash variable like templates.
@@ -86,14 +170,14 @@ def basic_render(content, params):
 def detect_template(text):
 
     def cheetah_render(content, params):
-        return CTemplate(content, searchList=[params]).respond()
+        template = _compiled('cheetah', _compile_cheetah, content)
+        return template(searchList=[params]).respond()
 
     def jinja_render(content, params):
         # keep_trailing_newline is in jinja2 2.7+, not 2.6
         add = "\n" if content.endswith("\n") else ""
-        return JTemplate(content,
-                         undefined=jinja2.StrictUndefined,
-                         trim_blocks=True).render(**params) + add
+        template = _compiled('jinja', _compile_jinja, content)
+        return template.render(**params) + add
 
     if text.find("\n") != -1:
         ident, rest = text.split("\n", 1)
@@ -129,10 +213,25 @@ def detect_template(text):
         return ('basic', basic_render, rest)
 
 
+def _detect_file(fn):
+    try:
+        st = os.stat(fn)
+    except OSError:
+        return detect_template(util.load_file(fn))
+    key = (st.st_mtime, st.st_size, st.st_ino)
+    with _LOCK:
+        if fn in _FILES and _FILES[fn][0] == key:
+            return _FILES[fn][1]
+    detected = detect_template(util.load_file(fn))
+    with _LOCK:
+        _FILES[fn] = (key, detected)
+    return detected
+
+
 def render_from_file(fn, params):
     if not params:
         params = {}
-    template_type, renderer, content = detect_template(util.load_file(fn))
+    template_type, renderer, content = _detect_file(fn)
     LOG.debug("Rendering content of '%s' using renderer %s", fn, template_type)
     return renderer(content, params)
 
@@ -24,6 +24,7 @@ import json
 import os
 import requests
 import six
+import threading
 import time
 
 from email.utils import parsedate
@@ -181,9 +182,15 @@ def _get_ssl_args(url, ssl_details):
     return ssl_args
 
 
+def new_session():
+    """A requests session, readurl calls given it share its connections."""
+    return requests.Session()
+
+
 def readurl(url, data=None, timeout=None, retries=0, sec_between=1,
             headers=None, headers_cb=None, ssl_details=None,
-            check_status=True, allow_redirects=True, exception_cb=None):
+            check_status=True, allow_redirects=True, exception_cb=None,
+            session=None):
     url = _cleanurl(url)
     req_args = {
         'url': url,
@@ -242,7 +249,10 @@ def readurl(url, data=None, timeout=None, retries=0, sec_between=1,
             LOG.debug("[%s/%s] open '%s' with %s configuration", i,
                       manual_tries, url, filtered_req_args)
 
-            r = requests.request(**req_args)
+            if session is not None:
+                r = session.request(**req_args)
+            else:
+                r = requests.request(**req_args)
             if check_status:
                 r.raise_for_status()
             LOG.debug("Read from %s (%s, %sb) after %s attempts", url,
@@ -402,6 +412,8 @@ class OauthUrlHelper(object):
 
         old = self.read_skew_file()
         self.skew_data = old or {}
+        # requests may be made (and fail) concurrently
+        self._skew_lock = threading.Lock()
 
     def read_skew_file(self):
         if self.skew_data_file and os.path.isfile(self.skew_data_file):
@@ -438,11 +450,12 @@ class OauthUrlHelper(object):
 
         skew = int(remote_time - time.time())
         host = urlparse(exception.url).netloc
-        old_skew = self.skew_data.get(host, 0)
-        if abs(old_skew - skew) > self.skew_change_limit:
-            self.update_skew_file(host, skew)
-            LOG.warn("Setting oauth clockskew for %s to %d", host, skew)
-        self.skew_data[host] = skew
+        with self._skew_lock:
+            old_skew = self.skew_data.get(host, 0)
+            if abs(old_skew - skew) > self.skew_change_limit:
+                self.update_skew_file(host, skew)
+                LOG.warn("Setting oauth clockskew for %s to %d", host, skew)
+            self.skew_data[host] = skew
 
         return
 
@@ -20,7 +20,10 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import os
+import sys
+import time
 
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
@@ -28,10 +31,12 @@ from email.mime.nonmultipart import MIMENonMultipart
 from email.mime.text import MIMEText
 
 import six
+from six.moves import cPickle as pickle
 
 from cloudinit import handlers
 from cloudinit import log as logging
 from cloudinit import util
+from cloudinit import version
 
 LOG = logging.getLogger(__name__)
 
@@ -61,8 +66,23 @@ DECOMP_TYPES = [
     'application/x-gunzip',
     'application/x-gzip',
     'application/x-gzip-compressed',
+    'application/bzip2',
+    'application/x-bzip',
+    'application/x-bzip2',
+    'application/x-lzma',
+    'application/x-xz',
+    'application/xz',
 ]
 
+# How many #include urls are fetched at once, and how long (in seconds) all
+# the includes of one user-data may take to fetch in total
+INCLUDE_MAX_WORKERS = 4
+INCLUDE_TIMEOUT = 300
+
+# Processed data kept per instance: user-data and vendor-data take one
+# entry each, the rest lets them change (and change back) between boots
+PROCESSED_CACHE_MAX_ENTRIES = 4
+
 # Msg header used to track attachments
 ATTACHMENT_FIELD = 'Number-Attachments'
 
@@ -83,19 +103,98 @@ def _set_filename(msg, filename):
 
 
 class UserDataProcessor(object):
-    def __init__(self, paths):
+    def __init__(self, paths, include_workers=INCLUDE_MAX_WORKERS,
+                 include_timeout=INCLUDE_TIMEOUT, decomp_max_size=None):
         self.paths = paths
+        self.decomp_max_size = decomp_max_size
         self.ssl_details = util.fetch_ssl_details(paths)
+        self.include_workers = include_workers
+        self.include_timeout = include_timeout
+        self._include_deadline = None
+        self._dont_cache = False
 
     def process(self, blob):
+        cache_fn = self._get_processed_cache_filename(blob)
+        if cache_fn and os.path.isfile(cache_fn):
+            try:
+                cached = pickle.loads(util.load_file(cache_fn, decode=False))
+                # Mark it as in use so pruning keeps it
+                os.utime(cache_fn, None)
+                return cached
+            except Exception:
+                util.logexc(LOG, "Failed loading processed data from %s",
+                            cache_fn)
+
         accumulating_msg = MIMEMultipart()
-        if isinstance(blob, list):
-            for b in blob:
-                self._process_msg(convert_string(b), accumulating_msg)
-        else:
-            self._process_msg(convert_string(blob), accumulating_msg)
+        if self.include_timeout is not None:
+            self._include_deadline = time.time() + self.include_timeout
+        self._dont_cache = False
+        try:
+            if isinstance(blob, list):
+                for b in blob:
+                    self._process_msg(self._convert_string(b),
+                                      accumulating_msg)
+            else:
+                self._process_msg(self._convert_string(blob),
+                                  accumulating_msg)
+        finally:
+            self._include_deadline = None
+
+        # What '#include' urls return may change, so only keep results
+        # that depend on nothing but the blob (and '#include-once' urls
+        # that were fetched fine).
+        if cache_fn and not self._dont_cache:
+            try:
+                util.write_file(cache_fn, pickle.dumps(accumulating_msg),
+                                mode=0o600)
+                self._prune_processed_cache(os.path.dirname(cache_fn))
+            except Exception:
+                util.logexc(LOG, "Failed caching processed data in %s",
+                            cache_fn)
         return accumulating_msg
 
+    def _prune_processed_cache(self, cache_dir):
+        # Only the most recently used entries are kept
+        entries = []
+        for fname in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, fname)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        entries.sort(reverse=True)
+        for (_mtime, path) in entries[PROCESSED_CACHE_MAX_ENTRIES:]:
+            util.del_file(path)
+
+    def _get_processed_cache_filename(self, blob):
+        # Only once cloud-init has set up an instance to keep it in
+        if not self.paths or not os.path.isdir(self.paths.instance_link):
+            return None
+        blobs = blob
+        if not isinstance(blob, list):
+            blobs = [blob]
+        digest = hashlib.sha256()
+        # What is pickled is only good for the same cloud-init and python
+        digest.update(util.encode_text("%s:%s.%s:%s" % (
+            version.version_string(), sys.version_info[0],
+            sys.version_info[1], self.decomp_max_size)))
+        for b in blobs:
+            if b is None:
+                b = b''
+            if not isinstance(b, (six.text_type, six.binary_type)):
+                return None
+            try:
+                b = util.encode_text(b)
+            except UnicodeEncodeError:
+                return None
+            digest.update(util.encode_text("%s:" % len(b)))
+            digest.update(b)
+        return os.path.join(self.paths.get_ipath_cur('data'),
+                            'processedcache', digest.hexdigest())
+
+    def _convert_string(self, raw_data):
+        return convert_string(raw_data, max_size=self.decomp_max_size)
+
     def _process_msg(self, base_msg, append_msg):
 
         def find_ctype(payload):
@@ -110,12 +209,13 @@ class UserDataProcessor(object):
             payload = util.fully_decoded_payload(part)
             was_compressed = False
 
-            # When the message states it is of a gzipped content type ensure
+            # When the message states it is of a compressed content type ensure
             # that we attempt to decode said payload so that the decompressed
             # data can be examined (instead of the compressed data).
             if ctype_orig in DECOMP_TYPES:
                 try:
-                    payload = util.decomp_gzip(payload, quiet=False)
+                    payload = util.decompress(payload, quiet=False,
+                                              max_size=self.decomp_max_size)
                     # At this point we don't know what the content-type is
                     # since we just decompressed it.
                     ctype_orig = None
@@ -207,6 +307,7 @@ class UserDataProcessor(object):
         # also support '#include <url here>'
         # or #include-once '<url here>'
         include_once_on = False
+        includes = []
         for line in content.splitlines():
             lc_line = line.lower()
             if lc_line.startswith("#include-once"):
@@ -225,29 +326,55 @@ class UserDataProcessor(object):
             include_url = line.strip()
             if not include_url:
                 continue
-
-            include_once_fn = None
-            content = None
-            if include_once_on:
-                include_once_fn = self._get_include_once_filename(include_url)
-            if include_once_on and os.path.isfile(include_once_fn):
-                content = util.load_file(include_once_fn)
-            else:
-                resp = util.read_file_or_url(include_url,
-                                             ssl_details=self.ssl_details)
-                if include_once_on and resp.ok():
-                    util.write_file(include_once_fn, resp.contents, mode=0o600)
-                if resp.ok():
-                    content = resp.contents
-                else:
-                    LOG.warn(("Fetching from %s resulted in"
-                              " a invalid http code of %s"),
-                             include_url, resp.code)
-
+            includes.append((include_url, include_once_on))
+
+        if any(include_once_on for (_url, include_once_on) in includes):
+            # Make the cache dir before the fetches race to do so
+            util.ensure_dir(os.path.dirname(
+                self._get_include_once_filename('')))
+
+        # Fetch all the includes of this level at once, but process them
+        # (and so fetch what they include in turn) in their original order.
+        timeout = None
+        if self._include_deadline is not None:
+            timeout = max(0, self._include_deadline - time.time())
+        fetched = util.run_concurrently(self._fetch_include, includes,
+                                        max_workers=self.include_workers,
+                                        timeout=timeout)
+        for ((include_url, _once), (content, error)) in zip(includes,
+                                                            fetched):
+            if isinstance(error, util.DeadlineExceededError):
+                LOG.warn("Fetching from %s was abandoned: %s",
+                         include_url, error)
+                self._dont_cache = True
+                continue
+            elif error is not None:
+                raise error
             if content is not None:
-                new_msg = convert_string(content)
+                new_msg = self._convert_string(content)
                 self._process_msg(new_msg, append_msg)
 
+    def _fetch_include(self, include):
+        (include_url, include_once_on) = include
+        include_once_fn = None
+        if include_once_on:
+            include_once_fn = self._get_include_once_filename(include_url)
+        if include_once_on and os.path.isfile(include_once_fn):
+            return util.load_file(include_once_fn)
+        if not include_once_on:
+            self._dont_cache = True
+        resp = util.read_file_or_url(include_url,
+                                     ssl_details=self.ssl_details)
+        if include_once_on and resp.ok():
+            util.write_file(include_once_fn, resp.contents, mode=0o600)
+        if resp.ok():
+            return resp.contents
+        LOG.warn(("Fetching from %s resulted in"
+                  " a invalid http code of %s"),
+                 include_url, resp.code)
+        self._dont_cache = True
+        return None
+
     def _explode_archive(self, archive, append_msg):
         entries = util.load_yaml(archive, default=[], allowed=(list, set))
         for ent in entries:
@@ -334,12 +461,23 @@ def is_skippable(part):
 
 
 # Coverts a raw string into a mime message
-def convert_string(raw_data, headers=None):
+def convert_string(raw_data, headers=None, max_size=None):
     if not raw_data:
         raw_data = ''
     if not headers:
         headers = {}
-    data = util.decode_binary(util.decomp_gzip(raw_data))
+    if util.compression_type(raw_data):
+        # Plain data can start like compressed data does, so only data
+        # that decompresses to more than max_size is refused.
+        try:
+            raw_data = util.decompress(raw_data, quiet=False, decode=False,
+                                       max_size=max_size)
+        except util.DecompressionTooLarge:
+            raise
+        except util.DecompressionError as e:
+            LOG.warn("Failed decompressing data of length %s, using it"
+                     " as is: %s", len(raw_data), e)
+    data = util.decode_binary(raw_data)
     if "mime-version:" in data[0:4096].lower():
         msg = util.message_from_string(data)
         for (key, val) in headers.items():
@@ -20,22 +20,25 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import bz2
 import contextlib
 import copy as obj_copy
 import ctypes
+import difflib
 import email
 import errno
 import glob
 import grp
-import gzip
 import hashlib
 import json
+import marshal
 import os
 import os.path
 import platform
 import pwd
 import random
 import re
+import select
 import shutil
 import socket
 import stat
@@ -43,14 +46,22 @@ import string
 import subprocess
 import sys
 import tempfile
+import threading
 import time
+import zlib
 
 from base64 import b64decode, b64encode
+from six.moves import queue
 from six.moves.urllib import parse as urlparse
 
 import six
 import yaml
 
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
 from cloudinit import importer
 from cloudinit import log as logging
 from cloudinit import mergers
@@ -59,7 +70,7 @@ from cloudinit import type_utils
 from cloudinit import url_helper
 from cloudinit import version
 
-from cloudinit.settings import (CFG_BUILTIN)
+from cloudinit.settings import (CFG_BUILTIN, CLOUD_CONFIG)
 
 
 _DNS_REDIRECT_IP = None
@@ -80,8 +91,48 @@ CONTAINER_TESTS = (['systemd-detect-virt', '--quiet', '--container'],
                    ['running-in-container'],
                    ['lxc-is-container'])
 
+# Files naming the container type, as left by systemd and upstart's
+# container-detect, and ones whose mere presence means docker or podman
+CONTAINER_TYPE_FILES = ('/run/systemd/container', '/run/container_type')
+CONTAINER_MARKER_FILES = ('/.dockerenv', '/run/.containerenv')
+
+# Where is_container() keeps its answer for the later stages of this boot
+CONTAINER_CACHE_FILE = "/run/cloud-init/.is-container"
+
+_IS_CONTAINER = None
+
+# Parsed yaml documents by content hash, see load_yaml().  Documents are
+# also kept (marshalled) in YAML_CACHE_DIR for the later stages of a boot.
+# Documents over YAML_CACHE_MAX_SIZE aren't cached, and the in memory cache
+# starts over once it holds YAML_CACHE_MAX_ENTRIES documents.
+YAML_CACHE_DIR = "/run/cloud-init/yaml-cache"
+YAML_CACHE_MAX_SIZE = 1024 * 1024
+YAML_CACHE_MAX_ENTRIES = 128
+_YAML_CACHE = {}
+
 PROC_CMDLINE = None
 
+# Leading bytes identifying the compressed formats decompress() handles
+COMPRESSION_MAGIC = (
+    ('gzip', b'\x1f\x8b'),
+    ('bzip2', b'BZh'),
+    ('xz', b'\xfd7zXZ\x00'),
+)
+
+# Largest amount of data decompress() will produce, guards against
+# small payloads that expand to fill all memory (ie zip bombs)
+DECOMP_MAX_SIZE = 64 * 1024 * 1024
+DECOMP_CHUNK_SIZE = 64 * 1024
+
+# Seconds between SIGTERM and SIGKILL for commands exceeding their timeout
+SUBP_KILL_GRACE = 5
+
+# Every command run by subp() in this process, see subp_ledger()
+_SUBP_LEDGER = []
+_SUBP_LEDGER_LOCK = threading.Lock()
+
+PROC_MOUNTINFO = "/proc/self/mountinfo"
+
 
 def decode_binary(blob, encoding='utf-8'):
     # Converts a binary type into a text type using given encoding.
@@ -159,6 +210,40 @@ DMIDECODE_TO_DMI_SYS_MAPPING = {
     'system-version': 'product_version',
 }
 
+# The --string keywords dmidecode knows, by the section and field they are
+# shown as in its (-t bios -t system -t baseboard -t chassis) dump
+DMIDECODE_DUMP_SECTIONS = {
+    'BIOS Information': {
+        'Vendor': 'bios-vendor',
+        'Version': 'bios-version',
+        'Release Date': 'bios-release-date',
+    },
+    'System Information': {
+        'Manufacturer': 'system-manufacturer',
+        'Product Name': 'system-product-name',
+        'Version': 'system-version',
+        'Serial Number': 'system-serial-number',
+        'UUID': 'system-uuid',
+    },
+    'Base Board Information': {
+        'Manufacturer': 'baseboard-manufacturer',
+        'Product Name': 'baseboard-product-name',
+        'Version': 'baseboard-version',
+        'Serial Number': 'baseboard-serial-number',
+        'Asset Tag': 'baseboard-asset-tag',
+    },
+    'Chassis Information': {
+        'Manufacturer': 'chassis-manufacturer',
+        'Type': 'chassis-type',
+        'Version': 'chassis-version',
+        'Serial Number': 'chassis-serial-number',
+        'Asset Tag': 'chassis-asset-tag',
+    },
+}
+
+# Per process DMI data, see read_dmi_data()
+_DMI_SNAPSHOT = None
+
 
 class ProcessExecutionError(IOError):
 
@@ -262,6 +347,16 @@ class DecompressionError(Exception):
     pass
 
 
+class DecompressionTooLarge(DecompressionError):
+    pass
+
+
+class DeadlineExceededError(Exception):
+    def __init__(self, timeout):
+        Exception.__init__(self, "Not done within %s seconds" % timeout)
+        self.timeout = timeout
+
+
 def ExtendedTemporaryFile(**kwargs):
     fh = tempfile.NamedTemporaryFile(**kwargs)
     # Replace its unlink with a quiet version
@@ -385,19 +480,116 @@ def clean_filename(fn):
     return fn
 
 
-def decomp_gzip(data, quiet=True, decode=True):
+def compression_type(data):
+    """Return the name of the format data is compressed with, or None."""
+    head = encode_text(data[0:8])
+    for (name, magic) in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def _decompressor(ctype):
+    if ctype == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif ctype == 'bzip2':
+        return bz2.BZ2Decompressor()
+    elif ctype in ('xz', 'lzma'):
+        if lzma is None:
+            raise DecompressionError("No lzma module available to"
+                                     " decompress %s data" % ctype)
+        if ctype == 'xz':
+            return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+        return lzma.LZMADecompressor(format=lzma.FORMAT_ALONE)
+    raise DecompressionError("Unknown compression type %s" % ctype)
+
+
+def _iter_stream(dec, data, chunk_size):
+    if hasattr(dec, 'unconsumed_tail'):
+        # zlib, which can bound output everywhere
+        while data:
+            yield dec.decompress(data, chunk_size)
+            data = dec.unconsumed_tail
+        yield dec.flush()
+    elif hasattr(dec, 'needs_input'):
+        # bz2 and lzma on python 3.5+
+        yield dec.decompress(data, chunk_size)
+        while not dec.eof and not dec.needs_input:
+            yield dec.decompress(b'', chunk_size)
+    else:
+        # Older bz2 cannot bound its output, so the size is only checked
+        # once the whole stream is out.
+        yield dec.decompress(data)
+
+
+def decompress_stream(data, ctype=None, max_size=None,
+                      chunk_size=DECOMP_CHUNK_SIZE):
+    """Yield the decompressed contents of data a chunk at a time.
+
+    The format is found from the leading bytes of data unless given
+    as ctype.  Concatenated streams (ie 'cat a.gz b.gz') are followed
+    like their command line tools do.  DecompressionError is raised if
+    data is not compressed, is corrupt or would decompress to more than
+    max_size (DECOMP_MAX_SIZE by default) bytes.
+    """
+    if max_size is None:
+        max_size = DECOMP_MAX_SIZE
+    data = encode_text(data)
+    if ctype is None:
+        ctype = compression_type(data)
+        if ctype is None:
+            raise DecompressionError("Data is not in a known compressed"
+                                     " format")
+    # lzma (alone) has no magic to follow concatenated streams by
+    magic = dict(COMPRESSION_MAGIC).get(ctype)
+    total = 0
+    while True:
+        dec = _decompressor(ctype)
+        try:
+            for chunk in _iter_stream(dec, data, chunk_size):
+                total += len(chunk)
+                if total > max_size:
+                    raise DecompressionTooLarge(
+                        "Decompressed %s data exceeds %s bytes" %
+                        (ctype, max_size))
+                if chunk:
+                    yield chunk
+        except DecompressionError:
+            raise
+        except Exception as e:
+            raise DecompressionError(six.text_type(e))
+        if not getattr(dec, 'eof', True):
+            raise DecompressionError("Truncated %s data" % ctype)
+        data = dec.unused_data
+        if not magic or not data.startswith(magic):
+            break
+
+
+def decompress(data, quiet=True, decode=True, max_size=None, types=None):
+    """Decompress data in any of the formats in COMPRESSION_MAGIC.
+
+    types limits the formats tried.  When quiet, data that is not
+    compressed (or is corrupt, or too large) is returned untouched,
+    otherwise DecompressionError is raised.
+    """
     try:
-        buf = six.BytesIO(encode_text(data))
-        with contextlib.closing(gzip.GzipFile(None, "rb", 1, buf)) as gh:
-            if decode:
-                return decode_binary(gh.read())
-            else:
-                return gh.read()
-    except Exception as e:
+        ctype = compression_type(data)
+        if ctype is None or (types and ctype not in types):
+            raise DecompressionError("Data is not in a known compressed"
+                                     " format")
+        result = b''.join(decompress_stream(data, ctype, max_size=max_size))
+    except DecompressionError:
         if quiet:
             return data
-        else:
-            raise DecompressionError(six.text_type(e))
+        raise
+    if decode:
+        return decode_binary(result)
+    return result
+
+
+def decomp_gzip(data, quiet=True, decode=True, max_size=None):
+    return decompress(data, quiet=quiet, decode=decode, max_size=max_size,
+                      types=('gzip',))
 
 
 def extract_usergroup(ug_pair):
@@ -772,7 +964,7 @@ def fetch_ssl_details(paths=None):
 
 def read_file_or_url(url, timeout=5, retries=10,
                      headers=None, data=None, sec_between=1, ssl_details=None,
-                     headers_cb=None, exception_cb=None):
+                     headers_cb=None, exception_cb=None, session=None):
     url = url.lstrip()
     if url.startswith("/"):
         url = "file://%s" % url
@@ -798,7 +990,55 @@ def read_file_or_url(url, timeout=5, retries=10,
                                   data=data,
                                   sec_between=sec_between,
                                   ssl_details=ssl_details,
-                                  exception_cb=exception_cb)
+                                  exception_cb=exception_cb,
+                                  session=session)
+
+
+def _yaml_cache_path(key):
+    # marshal's format differs across python versions
+    fname = "%s-py%s%s" % ((key,) + tuple(sys.version_info[:2]))
+    return os.path.join(YAML_CACHE_DIR, fname)
+
+
+def _parse_yaml_cached(blob):
+    if len(blob) > YAML_CACHE_MAX_SIZE:
+        return safeyaml.load(blob)
+    try:
+        key = hashlib.sha1(encode_text(blob)).hexdigest()
+    except UnicodeEncodeError:
+        return safeyaml.load(blob)
+    if key not in _YAML_CACHE:
+        if len(_YAML_CACHE) >= YAML_CACHE_MAX_ENTRIES:
+            _YAML_CACHE.clear()
+        cache_path = _yaml_cache_path(key)
+        try:
+            with open(cache_path, 'rb') as fh:
+                _YAML_CACHE[key] = marshal.loads(fh.read())
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            _YAML_CACHE[key] = safeyaml.load(blob)
+            _write_yaml_cache(cache_path, _YAML_CACHE[key])
+    # Callers are free to modify what they get back (and some do)
+    return obj_copy.deepcopy(_YAML_CACHE[key])
+
+
+def _write_yaml_cache(cache_path, obj):
+    # Only persist when running as cloud-init (which makes /run/cloud-init)
+    cache_dir = os.path.dirname(cache_path)
+    if not os.path.isdir(os.path.dirname(cache_dir)):
+        return
+    try:
+        # Documents with types marshal can't store (ie dates) aren't kept
+        data = marshal.dumps(obj)
+    except ValueError:
+        return
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as fh:
+            fh.write(data)
+        os.rename(fh.name, cache_path)
+    except (IOError, OSError):
+        LOG.debug("Failed caching parsed yaml in %s", cache_path)
 
 
 def load_yaml(blob, default=None, allowed=(dict,)):
@@ -808,7 +1048,7 @@ def load_yaml(blob, default=None, allowed=(dict,)):
         LOG.debug("Attempting to load yaml from string "
                   "of length %s with allowed root types %s",
                   len(blob), allowed)
-        converted = safeyaml.load(blob)
+        converted = _parse_yaml_cached(blob)
         if not isinstance(converted, allowed):
             # Yes this will just be caught, but thats ok for now...
             raise TypeError(("Yaml load allows %s root types,"
@@ -823,7 +1063,18 @@ def load_yaml(blob, default=None, allowed=(dict,)):
     return loaded
 
 
-def read_seeded(base="", ext="", timeout=5, retries=10, file_retries=0):
+# How long (seconds) datasources give a network seed to be read in full
+SEED_DEADLINE = 120
+
+
+def read_seeded(base="", ext="", timeout=5, retries=10, file_retries=0,
+                deadline=None):
+    """Read (meta-data, user-data) from base.
+
+    Over the network both are fetched at once (over one session), and if
+    deadline (seconds) is given a DeadlineExceededError is raised when
+    they are not both read by then.
+    """
     if base.startswith("/"):
         base = "file://%s" % base
 
@@ -838,12 +1089,27 @@ def read_seeded(base="", ext="", timeout=5, retries=10, file_retries=0):
         ud_url = "%s%s%s" % (base, "user-data", ext)
         md_url = "%s%s%s" % (base, "meta-data", ext)
 
-    md_resp = read_file_or_url(md_url, timeout, retries, file_retries)
+    if base.startswith("file://"):
+        md_resp = read_file_or_url(md_url, timeout, retries, file_retries)
+        ud_resp = read_file_or_url(ud_url, timeout, retries, file_retries)
+    else:
+        session = url_helper.new_session()
+
+        def fetch(url):
+            return read_file_or_url(url, timeout, retries, file_retries,
+                                    session=session)
+
+        fetched = run_concurrently(fetch, [md_url, ud_url], max_workers=2,
+                                   timeout=deadline)
+        for (_resp, error) in fetched:
+            if error is not None:
+                raise error
+        ((md_resp, _), (ud_resp, _)) = fetched
+
     md = None
     if md_resp.ok():
         md = load_yaml(decode_binary(md_resp.contents), default={})
 
-    ud_resp = read_file_or_url(ud_url, timeout, retries, file_retries)
     ud = None
     if ud_resp.ok():
         ud = ud_resp.contents
@@ -1365,6 +1631,16 @@ def is_group(name):
         return False
 
 
+def get_user_names():
+    """Return the set of names of all users, from one passwd lookup."""
+    return set(entry.pw_name for entry in pwd.getpwall())
+
+
+def get_group_names():
+    """Return the set of names of all groups, from one group lookup."""
+    return set(entry.gr_name for entry in grp.getgrall())
+
+
 def rename(src, dest):
     LOG.debug("Renaming %s to %s", src, dest)
     # TODO(harlowja) use a se guard here??
@@ -1425,30 +1701,120 @@ def unmounter(umount):
             subp(umount_cmd)
 
 
+class MountTable(object):
+    """Index of the mounts visible to this process.
+
+    The mountinfo file is read once and kept open; the kernel flags that open
+    file with POLLPRI/POLLERR whenever the mount table changes, so later
+    lookups only re-read it after something was actually (un)mounted.
+    """
+
+    def __init__(self, path=PROC_MOUNTINFO):
+        self.path = path
+        self._fh = None
+        self._poller = None
+        self._lines = None
+        self._mounts = None
+
+    def _changed(self):
+        if self._poller is None:
+            return True
+        try:
+            return bool(self._poller.poll(0))
+        except (IOError, OSError, select.error):
+            return True
+
+    def _read(self):
+        if self._fh is None:
+            self._fh = open(self.path, 'rb')
+            if hasattr(select, 'poll'):
+                self._poller = select.poll()
+                self._poller.register(self._fh,
+                                      select.POLLPRI | select.POLLERR)
+        else:
+            self._fh.seek(0)
+        return decode_binary(self._fh.read()).splitlines()
+
+    def invalidate(self):
+        self._lines = None
+        self._mounts = None
+
+    def close(self):
+        self.invalidate()
+        self._poller = None
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def lines(self):
+        if self._lines is None or self._changed():
+            try:
+                self._lines = self._read()
+            except (IOError, OSError):
+                self.close()
+                raise
+            self._mounts = None
+        return self._lines
+
+    def mounts(self):
+        lines = self.lines()
+        if self._mounts is None:
+            self._mounts = parse_mountinfo_mounts(lines)
+        return self._mounts
+
+
+_MOUNT_TABLE = MountTable()
+
+
+def parse_mountinfo_mounts(mountinfo_lines):
+    """Return the mounts() style dict (device -> fstype, mountpoint, opts)
+    given the lines from /proc/$$/mountinfo."""
+    mounted = {}
+    for line in mountinfo_lines:
+        # 36 35 98:0 /mnt1 /mnt2 rw,noatime master:1 - ext3 /dev/root rw
+        parts = line.split()
+        try:
+            sep = parts.index('-', 6)
+            mp = parts[4]
+            mnt_opts = parts[5].split(",")
+            fstype = parts[sep + 1]
+            dev = parts[sep + 2]
+            super_opts = parts[sep + 3].split(",")
+        except (ValueError, IndexError):
+            continue
+        # /proc/mounts shows the per mount options followed by the
+        # superblock ones, do the same here.
+        opts = mnt_opts + [o for o in super_opts
+                           if o not in ('ro', 'rw') and o not in mnt_opts]
+        mounted[dev.replace("\\040", " ")] = {
+            'fstype': fstype,
+            'mountpoint': mp.replace("\\040", " "),
+            'opts': ",".join(opts),
+        }
+    return mounted
+
+
 def mounts():
     mounted = {}
     try:
         # Go through mounts to see what is already mounted
-        if os.path.exists("/proc/mounts"):
-            mount_locs = load_file("/proc/mounts").splitlines()
-            method = 'proc'
-        else:
-            (mountoutput, _err) = subp("mount")
-            mount_locs = mountoutput.splitlines()
-            method = 'mount'
+        if os.path.exists(_MOUNT_TABLE.path):
+            # Hand out copies so callers can't corrupt the index
+            for (dev, info) in _MOUNT_TABLE.mounts().items():
+                mounted[dev] = dict(info)
+            return mounted
+        (mountoutput, _err) = subp("mount")
+        mount_locs = mountoutput.splitlines()
         mountre = r'^(/dev/[\S]+) on (/.*) \((.+), .+, (.+)\)$'
         for mpline in mount_locs:
             # Linux: /dev/sda1 on /boot type ext4 (rw,relatime,data=ordered)
             # FreeBSD: /dev/vtbd0p2 on / (ufs, local, journaled soft-updates)
             try:
-                if method == 'proc':
-                    (dev, mp, fstype, opts, _freq, _passno) = mpline.split()
-                else:
-                    m = re.search(mountre, mpline)
-                    dev = m.group(1)
-                    mp = m.group(2)
-                    fstype = m.group(3)
-                    opts = m.group(4)
+                m = re.search(mountre, mpline)
+                dev = m.group(1)
+                mp = m.group(2)
+                fstype = m.group(3)
+                opts = m.group(4)
             except:
                 continue
             # If the name of the mount point contains spaces these
@@ -1459,7 +1825,7 @@ def mounts():
                 'mountpoint': mp,
                 'opts': opts,
             }
-        LOG.debug("Fetched %s mounts from %s", mounted, method)
+        LOG.debug("Fetched %s mounts from %s", mounted, 'mount')
     except (IOError, OSError):
         logexc(LOG, "Failed fetching mount points")
     return mounted
@@ -1654,6 +2020,36 @@ def write_file(filename, content, mode=0o644, omode="wb"):
     chmod(filename, mode)
 
 
+def write_file_if_changed(filename, content, mode=0o644, omode="wb",
+                          log_diff=True):
+    """
+    Writes a file (as write_file does) unless it already holds content.
+
+    The sha256 of content is compared with that of what is on disk so an
+    unchanged file keeps its inode and mtime (and whatever watches it is
+    not woken); when it did change a unified diff is logged, unless
+    log_diff is False (say for files holding secrets).
+
+    @return: True if the file was written, False if it was left alone.
+    """
+    try:
+        current = load_file(filename, decode=False)
+    except (IOError, OSError):
+        current = None
+    if current is not None and (hash_blob(current, 'sha256') ==
+                                hash_blob(content, 'sha256')):
+        LOG.debug("Not rewriting %s, content unchanged", filename)
+        return False
+    if current is not None and log_diff:
+        diff = difflib.unified_diff(
+            decode_binary(current).splitlines(),
+            decode_binary(content).splitlines(),
+            filename, filename, lineterm="")
+        LOG.debug("Changes to %s:\n%s", filename, "\n".join(diff))
+    write_file(filename, content, mode=mode, omode=omode)
+    return True
+
+
 def delete_dir_contents(dirname):
     """
     Deletes all contents of a directory without deleting the directory itself.
@@ -1668,10 +2064,119 @@ def delete_dir_contents(dirname):
             del_file(node_fullpath)
 
 
+class _ProcessKiller(object):
+    """Terminates, and if needed kills, a process that runs too long."""
+
+    def __init__(self, proc, timeout, grace=SUBP_KILL_GRACE):
+        self.proc = proc
+        self.timeout = timeout
+        self.grace = grace
+        self.fired = False
+        self._timer = None
+
+    def _arm(self, delay, func):
+        self._timer = threading.Timer(delay, func)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _expire(self):
+        # It may have just finished, before cancel() got to run
+        if self.proc.poll() is not None:
+            return
+        self.fired = True
+        try:
+            self.proc.terminate()
+        except OSError:
+            return
+        self._arm(self.grace, self._kill)
+
+    def _kill(self):
+        if self.proc.poll() is None:
+            try:
+                self.proc.kill()
+            except OSError:
+                pass
+
+    def start(self):
+        self._arm(self.timeout, self._expire)
+
+    def cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+
+def _stream_communicate(sp, data, output_cb):
+    def pump(name, fh):
+        for line in iter(fh.readline, fh.read(0)):
+            try:
+                output_cb(name, line)
+            except Exception:
+                logexc(LOG, "Output callback failed on %s line %r",
+                       name, line)
+        fh.close()
+
+    pumps = []
+    for (name, fh) in (('stdout', sp.stdout), ('stderr', sp.stderr)):
+        pump_thread = threading.Thread(target=pump, args=(name, fh))
+        pump_thread.daemon = True
+        pump_thread.start()
+        pumps.append(pump_thread)
+    try:
+        if data:
+            sp.stdin.write(data)
+        sp.stdin.close()
+    except IOError as e:
+        # The command not reading its input is not our problem
+        if e.errno not in (errno.EPIPE, errno.EINVAL):
+            raise
+    for pump_thread in pumps:
+        pump_thread.join()
+    sp.wait()
+    return ('', '')
+
+
+def _record_subp(cmd, start, exit_code, timed_out):
+    entry = {
+        'cmd': cmd,
+        'start': start,
+        'elapsed': time.time() - start,
+        'exit_code': exit_code,
+    }
+    if timed_out:
+        entry['timed_out'] = True
+    with _SUBP_LEDGER_LOCK:
+        _SUBP_LEDGER.append(entry)
+
+
+def subp_ledger(clear=False):
+    """Return the commands run by subp() so far as a list of dicts with the
+    'cmd', 'start', 'elapsed' (wall time) and 'exit_code' of each."""
+    with _SUBP_LEDGER_LOCK:
+        entries = [dict(entry) for entry in _SUBP_LEDGER]
+        if clear:
+            del _SUBP_LEDGER[:]
+    return entries
+
+
 def subp(args, data=None, rcs=None, env=None, capture=True, shell=False,
-         logstring=False):
+         logstring=False, timeout=None, output_cb=None):
+    """Run a command, returning its (stdout, stderr).
+
+    If timeout (seconds) is given, a command still running after it is sent
+    SIGTERM (and SIGKILL SUBP_KILL_GRACE seconds later) and a
+    ProcessExecutionError is raised.  If output_cb is given, it is called as
+    output_cb(stream_name, line) for every line of output as the command
+    produces it, instead of buffering the output; empty output is returned
+    in that case.
+    """
     if rcs is None:
         rcs = [0]
+    if output_cb is not None:
+        capture = True
+    killer = None
+    out = err = None
+    rc = None
+    start = time.time()
     try:
 
         if not logstring:
@@ -1693,11 +2198,30 @@ def subp(args, data=None, rcs=None, env=None, capture=True, shell=False,
         if six.PY3:
             # Use this so subprocess output will be (Python 3) str, not bytes.
             kws['universal_newlines'] = True
-        sp = subprocess.Popen(args, **kws)
-        (out, err) = sp.communicate(data)
-    except OSError as e:
-        raise ProcessExecutionError(cmd=args, reason=e)
-    rc = sp.returncode
+        try:
+            sp = subprocess.Popen(args, **kws)
+            if timeout is not None:
+                killer = _ProcessKiller(sp, timeout)
+                killer.start()
+            try:
+                if output_cb is None:
+                    (out, err) = sp.communicate(data)
+                else:
+                    (out, err) = _stream_communicate(sp, data, output_cb)
+            finally:
+                if killer:
+                    killer.cancel()
+        except OSError as e:
+            raise ProcessExecutionError(cmd=args, reason=e)
+        rc = sp.returncode
+    finally:
+        _record_subp(logstring or args, start, rc,
+                     bool(killer and killer.fired))
+    if killer and killer.fired:
+        raise ProcessExecutionError(stdout=out, stderr=err,
+                                    exit_code=rc, cmd=args,
+                                    reason=("Timed out after %s seconds" %
+                                            timeout))
     if rc not in rcs:
         raise ProcessExecutionError(stdout=out, stderr=err,
                                     exit_code=rc,
@@ -1710,6 +2234,217 @@ def subp(args, data=None, rcs=None, env=None, capture=True, shell=False,
     return (out, err)
 
 
+def run_concurrently(func, items, max_workers=4, timeout=None):
+    """Call func(item) for each of items on at most max_workers threads.
+
+    Returns a list holding, in the order of items, a (result, exception)
+    tuple for each call.  If timeout (seconds) is given, calls that have
+    not finished by then are abandoned and get a DeadlineExceededError.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    pending = queue.Queue()
+    for index in range(len(items)):
+        pending.put(index)
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    done = threading.Condition()
+    finished = [0]
+
+    def worker():
+        while True:
+            try:
+                index = pending.get_nowait()
+            except queue.Empty:
+                return
+            if deadline is not None and time.time() >= deadline:
+                result = (None, DeadlineExceededError(timeout))
+            else:
+                try:
+                    result = (func(items[index]), None)
+                except Exception as e:
+                    result = (None, e)
+            with done:
+                results[index] = result
+                finished[0] += 1
+                done.notify_all()
+
+    for _i in range(min(max(1, max_workers), len(items))):
+        worker_thread = threading.Thread(target=worker)
+        worker_thread.daemon = True
+        worker_thread.start()
+
+    with done:
+        while finished[0] < len(items):
+            if deadline is None:
+                done.wait()
+                continue
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            done.wait(remaining)
+        for (index, result) in enumerate(results):
+            if result is None:
+                results[index] = (None, DeadlineExceededError(timeout))
+        return list(results)
+
+
+def subp_batch(commands, max_workers=4, **kwargs):
+    """Run independent commands concurrently, at most max_workers at a time.
+
+    Each entry of commands is passed to subp() as its args, along with the
+    given keyword arguments.  Returns a list with, in the order of commands,
+    either the (stdout, stderr) of that command or the ProcessExecutionError
+    it raised.
+    """
+    def run(args):
+        return subp(args, **kwargs)
+
+    results = []
+    for (result, error) in run_concurrently(run, commands, max_workers):
+        if error is None:
+            results.append(result)
+        elif isinstance(error, ProcessExecutionError):
+            results.append(error)
+        else:
+            raise error
+    return results
+
+
+# inotify(7) events that may mean a waited for path now exists
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WAIT_EVENTS = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE |
+               IN_DELETE_SELF | IN_MOVE_SELF)
+
+_INOTIFY_LIBC = None
+
+
+def _inotify_libc():
+    # The libc functions, or False where there is no inotify
+    global _INOTIFY_LIBC
+    if _INOTIFY_LIBC is None:
+        _INOTIFY_LIBC = False
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [
+                ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            _INOTIFY_LIBC = libc
+        except (OSError, AttributeError, TypeError):
+            LOG.debug("inotify is not available, waiting will poll")
+    return _INOTIFY_LIBC
+
+
+class _DirWatcher(object):
+    """Wakes up wait() when something happens in watched directories.
+
+    Uses inotify where it can, otherwise wait() just sleeps (polls)."""
+
+    def __init__(self):
+        self.fd = None
+        self.watched = set()
+        libc = _inotify_libc()
+        if libc:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                LOG.debug("inotify_init1 failed: %s",
+                          os.strerror(ctypes.get_errno()))
+            else:
+                self.fd = fd
+
+    def watch(self, dirs):
+        if self.fd is None:
+            return
+        libc = _inotify_libc()
+        for path in set(dirs) - self.watched:
+            if libc.inotify_add_watch(self.fd, encode_text(path),
+                                      WAIT_EVENTS) >= 0:
+                self.watched.add(path)
+
+    def wait(self, timeout):
+        if self.fd is None:
+            time.sleep(timeout)
+            return
+        (readable, _w, _x) = select.select([self.fd], [], [], timeout)
+        if readable:
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def existing_parent_dir(path):
+    """The closest existing directory at or above the one path is in."""
+    path = os.path.dirname(os.path.abspath(path))
+    while not os.path.isdir(path) and path != os.path.dirname(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def wait_for(check, watch, maxwait=None, deadline=None, naplen=1.0):
+    """Wait until check() returns something true and return that.
+
+    watch() gives the directories in which a change may make check()
+    pass; they are watched with inotify (and re-asked after each change)
+    so waiting ends as soon as that happens.  check() is also retried
+    every naplen seconds in case a change goes unseen (or there's no
+    inotify).  Gives up, returning the last check() result, after maxwait
+    seconds or at deadline (a time.time()), whichever is first.
+    """
+    if maxwait is not None:
+        until = time.time() + maxwait
+        if deadline is None or until < deadline:
+            deadline = until
+    watcher = _DirWatcher()
+    try:
+        while True:
+            # Watch first so nothing can happen unseen after the check
+            watcher.watch(watch())
+            result = check()
+            if result:
+                return result
+            timeout = naplen
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return result
+                timeout = min(timeout, remaining)
+            watcher.wait(timeout)
+    finally:
+        watcher.close()
+
+
+def wait_for_paths(paths, maxwait=None, deadline=None, naplen=1.0):
+    """Wait for all of paths to exist, returning the set still missing."""
+    need = set(paths)
+
+    def check():
+        need.difference_update([p for p in need if os.path.exists(p)])
+        return not need
+
+    def watch():
+        return [existing_parent_dir(p) for p in need]
+
+    wait_for(check, watch, maxwait=maxwait, deadline=deadline,
+             naplen=naplen)
+    return need
+
+
 def make_header(comment_char="#", base='created'):
     ci_ver = version.version_string()
     header = str(comment_char)
@@ -1763,8 +2498,51 @@ def strip_prefix_suffix(line, prefix=None, suffix=None):
 def is_container():
     """
     Checks to see if this code running in a container of some sort
+
+    The answer is worked out from /proc and /run without running anything;
+    only when that finds no container, and 'container_helpers' is enabled
+    in the system config (it is not by default), are the CONTAINER_TESTS
+    helper programs tried.  It is then kept for the rest of this process,
+    and in CONTAINER_CACHE_FILE for the later stages of this boot.
     """
+    global _IS_CONTAINER
+    if _IS_CONTAINER is not None:
+        return _IS_CONTAINER
+
+    try:
+        cached = load_file(CONTAINER_CACHE_FILE).strip()
+    except (IOError, OSError):
+        cached = None
+    if cached in ('True', 'False'):
+        _IS_CONTAINER = cached == 'True'
+        return _IS_CONTAINER
+
+    result = _is_container_from_files()
+    if not result and _container_helpers_enabled():
+        result = _is_container_from_helpers()
+    _IS_CONTAINER = result
+
+    # Only persist it when running as cloud-init (which makes this dir)
+    if os.path.isdir(os.path.dirname(CONTAINER_CACHE_FILE)):
+        try:
+            write_file(CONTAINER_CACHE_FILE, str(result))
+        except (IOError, OSError):
+            pass
+    return result
 
+
+def _container_helpers_enabled():
+    # This runs before the full config is assembled (get_cmdline needs it),
+    # so only the system config files are consulted.
+    try:
+        cfg = read_conf_with_confd(CLOUD_CONFIG)
+    except Exception:
+        logexc(LOG, "Failed reading %s", CLOUD_CONFIG)
+        return False
+    return get_cfg_option_bool(cfg, 'container_helpers', False)
+
+
+def _is_container_from_helpers():
     for helper in CONTAINER_TESTS:
         try:
             # try to run a helper program. if it returns true/zero
@@ -1773,6 +2551,20 @@ def is_container():
             return True
         except (IOError, OSError):
             pass
+    return False
+
+
+def _is_container_from_files():
+    for fname in CONTAINER_MARKER_FILES:
+        if os.path.exists(fname):
+            return True
+
+    for fname in CONTAINER_TYPE_FILES:
+        try:
+            if load_file(fname).strip() not in ('', 'none'):
+                return True
+        except (IOError, OSError):
+            pass
 
     # this code is largely from the logic in
     # ubuntu's /etc/init/container-detect.conf
@@ -1992,10 +2784,8 @@ def get_mount_info(path, log=LOG):
     #
     # So use /proc/$$/mountinfo to find the device underlying the
     # input path.
-    mountinfo_path = '/proc/%s/mountinfo' % os.getpid()
-    if os.path.exists(mountinfo_path):
-        lines = load_file(mountinfo_path).splitlines()
-        return parse_mount_info(path, lines, log)
+    if os.path.exists(_MOUNT_TABLE.path):
+        return parse_mount_info(path, _MOUNT_TABLE.lines(), log)
     elif os.path.exists("/etc/mtab"):
         return parse_mtab(path)
     else:
@@ -2194,6 +2984,98 @@ def _call_dmidecode(key, dmidecode_path):
         return None
 
 
+def _read_dmi_sysfs_all():
+    """
+    Reads every mapped key from /sys/class/dmi/id in one pass
+    """
+    values = {}
+    if not os.path.exists(DMI_SYS_PATH):
+        return values
+    for key in DMIDECODE_TO_DMI_SYS_MAPPING:
+        value = _read_dmi_syspath(key)
+        if value is not None:
+            values[key] = value
+    return values
+
+
+def parse_dmidecode(output):
+    """
+    Parses a dmidecode dump into a dict keyed by --string keyword
+    """
+    values = {}
+    fields = None
+    for line in output.splitlines():
+        if not line.startswith("\t"):
+            fields = DMIDECODE_DUMP_SECTIONS.get(line.strip())
+            continue
+        if fields is None or line.startswith("\t\t") or ':' not in line:
+            continue
+        (name, value) = line.strip().split(":", 1)
+        key = fields.get(name)
+        # Like --string only report the first of many (ie baseboards)
+        if key and key not in values:
+            value = value.strip()
+            if value.replace(".", "") == "":
+                value = ""
+            values[key] = value
+    return values
+
+
+def _dmidecode_dump(dmidecode_path):
+    """
+    Calls out to dmidecode once for all the keywords it can report.
+    """
+    cmd = [dmidecode_path]
+    for dmi_type in ('bios', 'system', 'baseboard', 'chassis'):
+        cmd.extend(['-t', dmi_type])
+    try:
+        (result, _err) = subp(cmd)
+    except (IOError, OSError) as e:
+        LOG.debug('failed dmidecode cmd: %s\n%s', cmd, e)
+        return {}
+    return parse_dmidecode(result)
+
+
+class DMISnapshot(object):
+    """
+    DMI data read once (per source) and then served from memory.
+
+    All the mapped /sys/class/dmi/id files are read in one pass on first
+    use.  Keys not found there come from a single dmidecode dump, falling
+    back to `dmidecode --string` only for keywords that dump lacks.
+    """
+
+    def __init__(self):
+        self._sysfs = None
+        self._dmidecode_path = None
+        self._dmidecode = None
+        self._values = {}
+
+    def get(self, key):
+        if key not in self._values:
+            self._values[key] = self._lookup(key)
+        return self._values[key]
+
+    def _lookup(self, key):
+        if self._sysfs is None:
+            self._sysfs = _read_dmi_sysfs_all()
+        if key in self._sysfs:
+            return self._sysfs[key]
+
+        if self._dmidecode_path is None:
+            self._dmidecode_path = which('dmidecode') or ''
+        if not self._dmidecode_path:
+            LOG.warn("did not find either path %s or dmidecode command",
+                     DMI_SYS_PATH)
+            return None
+
+        if self._dmidecode is None:
+            self._dmidecode = _dmidecode_dump(self._dmidecode_path)
+        if key in self._dmidecode:
+            return self._dmidecode[key]
+        return _call_dmidecode(key, self._dmidecode_path)
+
+
 def read_dmi_data(key):
     """
     Wrapper for reading DMI data.
@@ -2202,22 +3084,17 @@ def read_dmi_data(key):
     result):
         1) Use a mapping to translate `key` from dmidecode naming to
            sysfs naming and look in /sys/class/dmi/... for a value.
-        2) Use `key` as a sysfs key directly and look in /sys/class/dmi/...
+        2) Look `key` up in a dmidecode dump of the bios, system,
+           baseboard and chassis tables.
         3) Fall-back to passing `key` to `dmidecode --string`.
 
     If all of the above fail to find a value, None will be returned.
+    Results are kept for the life of the process (see DMISnapshot).
     """
-    syspath_value = _read_dmi_syspath(key)
-    if syspath_value is not None:
-        return syspath_value
-
-    dmidecode_path = which('dmidecode')
-    if dmidecode_path:
-        return _call_dmidecode(key, dmidecode_path)
-
-    LOG.warn("did not find either path %s or dmidecode command",
-             DMI_SYS_PATH)
-    return None
+    global _DMI_SNAPSHOT
+    if _DMI_SNAPSHOT is None:
+        _DMI_SNAPSHOT = DMISnapshot()
+    return _DMI_SNAPSHOT.get(key)
 
 
 def message_from_string(string):
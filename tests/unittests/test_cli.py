@@ -1,6 +1,10 @@
 import imp
+import json
 import os
+import shutil
 import sys
+import tempfile
+
 import six
 
 from . import helpers as test_helpers
@@ -52,3 +56,38 @@ class TestCLI(test_helpers.FilesystemMockingTestCase):
         self._call_main()
         self.assertIn('cloud-init: error: too few arguments',
                       self.stderr.getvalue())
+
+
+class TestSubpLedger(test_helpers.TestCase):
+
+    def setUp(self):
+        super(TestSubpLedger, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.ledger = os.path.join(self.tmp, 'subp-ledger.json')
+        self.cli = imp.load_source('cli', BIN_CLOUDINIT)
+        self.entries = [{'cmd': ['true'], 'elapsed': 0.1, 'exit_code': 0}]
+        patcher = mock.patch.object(self.cli.util, 'subp_ledger',
+                                    return_value=self.entries)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _report(self):
+        self.cli.report_subp_ledger(self.ledger, 'init', None)
+        with open(self.ledger) as fp:
+            return json.load(fp)
+
+    @test_helpers.skipIf(not os.path.isfile(BIN_CLOUDINIT), "no bin/cloudinit")
+    def test_appends_to_ledger(self):
+        with open(self.ledger, 'w') as fp:
+            json.dump({'v1': [{'cmd': ['false']}]}, fp)
+        self.assertEqual([['false'], ['true']],
+                         [e['cmd'] for e in self._report()['v1']])
+
+    @test_helpers.skipIf(not os.path.isfile(BIN_CLOUDINIT), "no bin/cloudinit")
+    def test_unusable_ledger_replaced(self):
+        for content in ('{}', '[]', '{"v1": 1}', '{not json'):
+            with open(self.ledger, 'w') as fp:
+                fp.write(content)
+            self.assertEqual([['true']],
+                             [e['cmd'] for e in self._report()['v1']])
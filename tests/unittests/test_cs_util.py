@@ -1,10 +1,19 @@
 from __future__ import print_function
 
+import json
 import sys
 import unittest
 
+import six
+
+from cloudinit import cs_utils
 from cloudinit.cs_utils import Cepko
 
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 try:
     skip = unittest.skip
 except AttributeError:
@@ -82,3 +91,99 @@ class CepkoResultTests(unittest.TestCase):
         self.assertEqual('much server', result[0])
         self.assertTrue('very performance' in result)
         self.assertEqual(2, len(result))
+
+
+class FakeSerial(object):
+    """Stands in for serial.Serial on the CloudSigma server context port.
+
+    Each request written is recorded and answered from context, like the
+    host does over its (slow) virtual serial port.
+    """
+    requests = []
+    context = SERVER_CONTEXT
+
+    def __init__(self, port, timeout=None, writeTimeout=None):
+        self.port = port
+        self.response = None
+        self.closed = False
+
+    def write(self, data):
+        request = data.decode('ascii')
+        self.requests.append(request)
+        value = self.context
+        for part in [p for p in request[2:-2].split('/') if p]:
+            try:
+                if isinstance(value, list):
+                    value = value[int(part)]
+                else:
+                    value = value[part]
+            except (KeyError, IndexError, ValueError):
+                value = None
+                break
+        if value is None:
+            raw = ''
+        elif isinstance(value, six.string_types):
+            raw = value
+        else:
+            raw = json.dumps(value)
+        self.response = raw.encode('ascii') + b'\x04\n'
+
+    def readline(self):
+        return self.response
+
+    def close(self):
+        self.closed = True
+
+
+class CepkoBulkTests(unittest.TestCase):
+
+    def setUp(self):
+        FakeSerial.requests = []
+        patcher = mock.patch.object(cs_utils.serial, 'Serial', FakeSerial)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _lookups(self, cepko):
+        return [
+            cepko.all().result,
+            cepko.get('uuid').result,
+            cepko.get('tags').result,
+            cepko.get('tags/1').result,
+            cepko.get('smp').result,
+            cepko.meta('ssh_public_key').result,
+            cepko.meta().result,
+            cepko.global_context('some_global_key').result,
+            cepko.global_context().result,
+        ]
+
+    def test_bulk_same_as_per_key(self):
+        per_key = self._lookups(Cepko())
+        self.assertEqual(9, len(FakeSerial.requests))
+        FakeSerial.requests = []
+        self.assertEqual(per_key, self._lookups(Cepko(bulk=True)))
+        self.assertEqual(["<\n\n>"], FakeSerial.requests)
+
+    def test_missing_key_asks_serial(self):
+        cepko = Cepko(bulk=True)
+        self.assertEqual('test_server', cepko.get('name').result)
+        self.assertEqual('', cepko.meta('no-such-key').result)
+        self.assertEqual(["<\n\n>", "<\n/meta/no-such-key\n>"],
+                         FakeSerial.requests)
+
+    def test_given_context(self):
+        cepko = Cepko(bulk=True, context=json.dumps(SERVER_CONTEXT))
+        self.assertEqual(SERVER_CONTEXT['tags'], cepko.get('tags').result)
+        self.assertEqual(SERVER_CONTEXT, cepko.all().result)
+        self.assertEqual([], FakeSerial.requests)
+
+    def test_bulk_one_request(self):
+        # each lookup is a round trip over the serial port, unless bulk
+        cepko = Cepko()
+        self._lookups(cepko)
+        self._lookups(cepko)
+        self.assertEqual(18, len(FakeSerial.requests))
+        FakeSerial.requests = []
+        cepko = Cepko(bulk=True)
+        self._lookups(cepko)
+        self._lookups(cepko)
+        self.assertEqual(["<\n\n>"], FakeSerial.requests)
@@ -1,10 +1,13 @@
 """Tests for handling of userdata within cloud init."""
 
+import bz2
+import collections
 import gzip
 import logging
 import os
 import shutil
 import tempfile
+import threading
 
 try:
     from unittest import mock
@@ -24,6 +27,7 @@ from cloudinit import log
 from cloudinit.settings import (PER_INSTANCE)
 from cloudinit import sources
 from cloudinit import stages
+from cloudinit import url_helper
 from cloudinit import user_data as ud
 from cloudinit import util
 
@@ -560,3 +564,194 @@ class TestUDProcess(helpers.ResourceUsingTestCase):
         ud_proc = ud.UserDataProcessor(self.getCloudPaths())
         message = ud_proc.process(msg)
         self.assertTrue(count_messages(message) == 1)
+
+    def test_bzip2_in_userdata(self):
+        msg = bz2.compress(b'#cloud-config\napt_update: True\n')
+
+        ud_proc = ud.UserDataProcessor(self.getCloudPaths())
+        message = ud_proc.process(msg)
+        self.assertTrue(count_messages(message) == 1)
+        for part in message.walk():
+            if not ud.is_skippable(part):
+                self.assertEqual('text/cloud-config', part.get_content_type())
+
+    def test_compressed_userdata_too_large(self):
+        msg = gzip_text('#cloud-config\napt_update: True\n')
+
+        ud_proc = ud.UserDataProcessor(self.getCloudPaths(),
+                                       decomp_max_size=10)
+        self.assertRaises(util.DecompressionTooLarge, ud_proc.process, msg)
+
+    def test_looks_compressed_kept_as_is(self):
+        ud_proc = ud.UserDataProcessor(self.getCloudPaths())
+        for msg in ('BZh is my shell script name\n',
+                    ']\x00\x00 starts like lzma\n'):
+            message = ud_proc.process(msg)
+            self.assertEqual([msg], [p.get_payload() for p in message.walk()
+                                     if not ud.is_skippable(p)])
+
+    def test_corrupt_compressed_kept_as_is(self):
+        blob = b'BZh91AY&SY not really bzip2\n'
+        message = ud.UserDataProcessor(self.getCloudPaths()).process(blob)
+        self.assertEqual([blob.decode()],
+                         [p.get_payload() for p in message.walk()
+                          if not ud.is_skippable(p)])
+
+    def test_mime_bzip2_part(self):
+        message = MIMEMultipart('test')
+        message.attach(MIMEApplication(
+            bz2.compress(b'#cloud-config\na: 2\n'), 'x-bzip2'))
+        message.attach(MIMEApplication(gzip_text('#cloud-config\nb: 3\n'),
+                                       'gzip'))
+        ud_proc = ud.UserDataProcessor(self.getCloudPaths())
+        processed = ud_proc.process(str(message))
+        payloads = [util.fully_decoded_payload(part)
+                    for part in processed.walk()
+                    if not ud.is_skippable(part)]
+        self.assertEqual(['#cloud-config\na: 2\n', '#cloud-config\nb: 3\n'],
+                         [util.decode_binary(p) for p in payloads])
+
+    def test_mime_part_too_large_is_skipped(self):
+        message = MIMEMultipart('test')
+        message.attach(MIMEApplication(
+            bz2.compress(b'#cloud-config\na: 2\n'), 'x-bzip2'))
+        ud_proc = ud.UserDataProcessor(self.getCloudPaths(),
+                                       decomp_max_size=10)
+        self.assertEqual(0, count_messages(ud_proc.process(str(message))))
+
+
+class TestUDInclude(helpers.ResourceUsingTestCase):
+
+    def setUp(self):
+        super(TestUDInclude, self).setUp()
+        self.fetched = []
+        # url -> event its fetch waits on before answering
+        self.waits = {}
+        self.done = collections.defaultdict(threading.Event)
+
+        def _read_file_or_url(url, **_kwargs):
+            if url in self.waits:
+                self.waits[url].wait(5)
+            self.fetched.append(url)
+            self.done[url].set()
+            return url_helper.StringResponse(
+                '#cloud-config\nsource: %s\n' % url)
+
+        patcher = mock.patch.object(ud.util, 'read_file_or_url',
+                                    _read_file_or_url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _sources(self, message):
+        return [util.load_yaml(part.get_payload())['source']
+                for part in message.walk() if not ud.is_skippable(part)]
+
+    def test_parts_attached_in_include_order(self):
+        urls = ['http://host/%s' % i for i in range(ud.INCLUDE_MAX_WORKERS)]
+        # each fetch only finishes after the next one did, so they
+        # complete in the reverse of their include order
+        for (url, next_url) in zip(urls, urls[1:]):
+            self.waits[url] = self.done[next_url]
+        ud_proc = ud.UserDataProcessor(self.getCloudPaths())
+        message = ud_proc.process('#include\n' + '\n'.join(urls))
+        self.assertEqual(urls, self._sources(message))
+
+    def test_include_once_not_refetched(self):
+        paths = self.getCloudPaths()
+        blob = '#include-once\nhttp://host/once\n#include\nhttp://host/al\n'
+        ud.UserDataProcessor(paths).process(blob)
+        message = ud.UserDataProcessor(paths).process(blob)
+        self.assertEqual(['http://host/once', 'http://host/al'],
+                         self._sources(message))
+        self.assertEqual(1, self.fetched.count('http://host/once'))
+        self.assertEqual(2, self.fetched.count('http://host/al'))
+
+    def test_slow_includes_abandoned_at_deadline(self):
+        # the slow fetch is held until the test is over
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.waits['http://host/slow'] = release
+        ud_proc = ud.UserDataProcessor(self.getCloudPaths(),
+                                       include_timeout=0.2)
+        message = ud_proc.process('#include\nhttp://host/slow\n'
+                                  'http://host/fast\n')
+        self.assertEqual(['http://host/fast'], self._sources(message))
+
+
+class TestUDProcessedCache(helpers.ResourceUsingTestCase):
+
+    def setUp(self):
+        super(TestUDProcessedCache, self).setUp()
+        self.paths = self.getCloudPaths()
+        util.ensure_dir(self.paths.instance_link)
+
+    def _process_twice(self, blob):
+        first = ud.UserDataProcessor(self.paths).process(blob)
+        ud_proc = ud.UserDataProcessor(self.paths)
+        with mock.patch.object(ud_proc, '_process_msg') as m_process:
+            second = ud_proc.process(blob)
+        return (first, second, m_process)
+
+    def test_unchanged_blob_not_reprocessed(self):
+        blob = gzip_text('#cloud-config\napt_update: True\n')
+        (first, second, m_process) = self._process_twice(blob)
+        self.assertFalse(m_process.called)
+        self.assertEqual([p.get_payload() for p in first.walk()][1:],
+                         [p.get_payload() for p in second.walk()][1:])
+        self.assertEqual(first.items(), second.items())
+
+    def test_changed_blob_reprocessed(self):
+        ud.UserDataProcessor(self.paths).process('#cloud-config\na: 1\n')
+        ud_proc = ud.UserDataProcessor(self.paths)
+        message = ud_proc.process('#cloud-config\na: 2\n')
+        self.assertEqual('#cloud-config\na: 2\n',
+                         [p for p in message.walk()][1].get_payload())
+
+    def test_least_recently_used_pruned(self):
+        blobs = ['#cloud-config\na: %s\n' % i for i in range(3)]
+        ud_proc = ud.UserDataProcessor(self.paths)
+        cache_fns = [ud_proc._get_processed_cache_filename(b) for b in blobs]
+        with mock.patch.object(ud, 'PROCESSED_CACHE_MAX_ENTRIES', 2):
+            for (i, blob) in enumerate(blobs[:2]):
+                ud_proc.process(blob)
+                os.utime(cache_fns[i], (1000 + i, 1000 + i))
+            # using the oldest entry keeps it over the other one
+            ud_proc.process(blobs[0])
+            ud_proc.process(blobs[2])
+        self.assertTrue(os.path.isfile(cache_fns[0]))
+        self.assertFalse(os.path.exists(cache_fns[1]))
+        self.assertTrue(os.path.isfile(cache_fns[2]))
+
+    def test_not_cached_without_instance(self):
+        shutil.rmtree(self.paths.instance_link)
+        (_first, _second, m_process) = self._process_twice('#!/bin/sh\n')
+        self.assertTrue(m_process.called)
+
+    def test_includes_not_cached(self):
+        blob = '#include\nhttp://host/a\n'
+        with mock.patch.object(ud.util, 'read_file_or_url') as m_read:
+            m_read.return_value = url_helper.StringResponse('#!/bin/sh\n')
+            (_first, _second, m_process) = self._process_twice(blob)
+        self.assertTrue(m_process.called)
+
+    def test_failed_include_once_not_cached(self):
+        blob = '#include-once\nhttp://host/a\n'
+        with mock.patch.object(ud.util, 'read_file_or_url') as m_read:
+            m_read.return_value = url_helper.StringResponse('', code=404)
+            (_first, _second, m_process) = self._process_twice(blob)
+        self.assertTrue(m_process.called)
+
+    def test_abandoned_include_once_not_cached(self):
+        blob = '#include-once\nhttp://host/a\n'
+        with mock.patch.object(ud.util, 'run_concurrently') as m_run:
+            m_run.return_value = [(None, util.DeadlineExceededError(1))]
+            (_first, _second, m_process) = self._process_twice(blob)
+        self.assertTrue(m_process.called)
+
+    def test_cache_keyed_on_python_version(self):
+        ud_proc = ud.UserDataProcessor(self.paths)
+        blob = '#cloud-config\na: 1\n'
+        cache_fn = ud_proc._get_processed_cache_filename(blob)
+        with mock.patch.object(ud.sys, 'version_info', (1, 0, 0)):
+            self.assertNotEqual(
+                cache_fn, ud_proc._get_processed_cache_filename(blob))
@@ -1,7 +1,8 @@
 from cloudinit import helpers
+from cloudinit import util
 from cloudinit.util import b64e, decode_binary, load_file
 from cloudinit.sources import DataSourceAzure
-from ..helpers import TestCase, populate_dir
+from ..helpers import TestCase, populate_dir, skipIf
 
 try:
     from unittest import mock
@@ -18,6 +19,8 @@ import stat
 import yaml
 import shutil
 import tempfile
+import threading
+import time
 import xml.etree.ElementTree as ET
 
 
@@ -644,3 +647,30 @@ class TestReadAzureOvf(TestCase):
         (_md, _ud, cfg) = DataSourceAzure.read_azure_ovf(content)
         for mypk in mypklist:
             self.assertIn(mypk, cfg['_pubkeys'])
+
+
+class TestWaitForFiles(TestCase):
+    def setUp(self):
+        super(TestWaitForFiles, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_returns_missing(self):
+        found = os.path.join(self.tmp, 'found.crt')
+        missing = os.path.join(self.tmp, 'missing.crt')
+        populate_dir(self.tmp, {'found.crt': ''})
+        self.assertEqual([], DataSourceAzure.wait_for_files([found]))
+        self.assertEqual(set([missing]), DataSourceAzure.wait_for_files(
+            [found, missing], maxwait=0.1, naplen=0.05))
+
+    @skipIf(not util._inotify_libc(), "No inotify")
+    def test_no_nap_after_file_appears(self):
+        path = os.path.join(self.tmp, 'late.crt')
+        timer = threading.Timer(0.1, populate_dir,
+                                (self.tmp, {'late.crt': ''}))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        start = time.time()
+        self.assertEqual([], DataSourceAzure.wait_for_files([path],
+                                                            naplen=30))
+        self.assertTrue(time.time() - start < 5)
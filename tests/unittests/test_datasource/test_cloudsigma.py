@@ -1,11 +1,22 @@
 # coding: utf-8
 import copy
+import json
+import os
+import shutil
+import tempfile
 
+from cloudinit import cs_utils
 from cloudinit.cs_utils import Cepko
 from cloudinit.sources import DataSourceCloudSigma
+from cloudinit import util
 
 from .. import helpers as test_helpers
 
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 
 SERVER_CONTEXT = {
     "cpu": 1000,
@@ -40,6 +51,13 @@ class CepkoMock(Cepko):
 class DataSourceCloudSigmaTest(test_helpers.TestCase):
     def setUp(self):
         super(DataSourceCloudSigmaTest, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.cache_file = os.path.join(self.tmp, 'cloudsigma-context.json')
+        patcher = mock.patch.object(DataSourceCloudSigma,
+                                    'CONTEXT_CACHE_FILE', self.cache_file)
+        patcher.start()
+        self.addCleanup(patcher.stop)
         self.datasource = DataSourceCloudSigma.DataSourceCloudSigma("", "", "")
         self.datasource.is_running_in_cloudsigma = lambda: True
         self.datasource.cepko = CepkoMock(SERVER_CONTEXT)
@@ -97,3 +115,33 @@ class DataSourceCloudSigmaTest(test_helpers.TestCase):
         self.datasource.get_data()
 
         self.assertIsNone(self.datasource.vendordata_raw)
+
+    def test_context_cached(self):
+        self.assertEqual(SERVER_CONTEXT,
+                         json.loads(util.load_file(self.cache_file)))
+        # the net stage reads the context from the cache, not the port
+        with mock.patch.object(cs_utils.CepkoResult, '_execute',
+                               side_effect=AssertionError("serial read")):
+            net_ds = DataSourceCloudSigma.DataSourceCloudSigmaNet("", "", "")
+            net_ds.is_running_in_cloudsigma = lambda: True
+            self.assertTrue(net_ds.get_data())
+        self.assertEqual(SERVER_CONTEXT, net_ds.metadata)
+
+    def test_context_not_logged(self):
+        changed = copy.deepcopy(SERVER_CONTEXT)
+        changed['meta']['ssh_public_key'] = 'ssh-rsa AAAAsecret new'
+        with mock.patch.object(util.LOG, 'debug') as m_debug:
+            DataSourceCloudSigma.cache_context(changed)
+        self.assertEqual(changed, json.loads(util.load_file(self.cache_file)))
+        logged = "\n".join(call[0][0] % call[0][1:]
+                           for call in m_debug.call_args_list)
+        self.assertNotIn("ssh_public_key", logged)
+
+    def test_corrupt_cache_ignored(self):
+        util.write_file(self.cache_file, "{not json")
+        with mock.patch.object(cs_utils.CepkoResult, '_execute',
+                               return_value=json.dumps(SERVER_CONTEXT)):
+            ds = DataSourceCloudSigma.DataSourceCloudSigma("", "", "")
+            ds.is_running_in_cloudsigma = lambda: True
+            self.assertTrue(ds.get_data())
+        self.assertEqual(SERVER_CONTEXT, ds.metadata)
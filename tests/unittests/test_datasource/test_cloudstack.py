@@ -1,5 +1,15 @@
+import os
+import shutil
+import tempfile
+import threading
+
+from six.moves import BaseHTTPServer
+
 from cloudinit import helpers
-from cloudinit.sources.DataSourceCloudStack import DataSourceCloudStack
+from cloudinit.sources import DataSourceCloudStack
+from cloudinit.sources.DataSourceCloudStack import (
+    CloudStackPasswordServerClient, DataSourceCloudStack as CloudStackDS)
+from cloudinit import util
 from ..helpers import TestCase
 
 try:
@@ -12,6 +22,18 @@ except ImportError:
     from contextlib2 import ExitStack
 
 
+LEASE = """\
+lease {
+  interface "eth0";
+  fixed-address 10.0.0.10;
+  option subnet-mask 255.255.255.0;
+  option routers 10.0.0.254;
+  option dhcp-server-identifier %s;
+  renew 4 2016/06/09 01:24:36;
+}
+"""
+
+
 class TestCloudStackPasswordFetching(TestCase):
 
     def setUp(self):
@@ -20,61 +42,58 @@ class TestCloudStackPasswordFetching(TestCase):
         self.addCleanup(self.patches.close)
         mod_name = 'cloudinit.sources.DataSourceCloudStack'
         self.patches.enter_context(mock.patch('{0}.ec2'.format(mod_name)))
-        self.patches.enter_context(mock.patch('{0}.uhelp'.format(mod_name)))
+        self.uhelp = self.patches.enter_context(
+            mock.patch('{0}.uhelp'.format(mod_name)))
 
     def _set_password_server_response(self, response_string):
-        subp = mock.MagicMock(return_value=(response_string, ''))
-        self.patches.enter_context(
-            mock.patch('cloudinit.sources.DataSourceCloudStack.util.subp',
-                       subp))
-        return subp
+        readurl = self.uhelp.readurl
+        readurl.return_value = mock.MagicMock(
+            contents=response_string.encode())
+        return readurl
 
     def test_empty_password_doesnt_create_config(self):
         self._set_password_server_response('')
-        ds = DataSourceCloudStack({}, None, helpers.Paths({}))
+        ds = CloudStackDS({}, None, helpers.Paths({}))
         ds.get_data()
         self.assertEqual({}, ds.get_config_obj())
 
     def test_saved_password_doesnt_create_config(self):
         self._set_password_server_response('saved_password')
-        ds = DataSourceCloudStack({}, None, helpers.Paths({}))
+        ds = CloudStackDS({}, None, helpers.Paths({}))
         ds.get_data()
         self.assertEqual({}, ds.get_config_obj())
 
     def test_password_sets_password(self):
         password = 'SekritSquirrel'
         self._set_password_server_response(password)
-        ds = DataSourceCloudStack({}, None, helpers.Paths({}))
+        ds = CloudStackDS({}, None, helpers.Paths({}))
         ds.get_data()
         self.assertEqual(password, ds.get_config_obj()['password'])
 
     def test_bad_request_doesnt_stop_ds_from_working(self):
         self._set_password_server_response('bad_request')
-        ds = DataSourceCloudStack({}, None, helpers.Paths({}))
+        ds = CloudStackDS({}, None, helpers.Paths({}))
         self.assertTrue(ds.get_data())
 
-    def assertRequestTypesSent(self, subp, expected_request_types):
+    def assertRequestTypesSent(self, readurl, expected_request_types):
         request_types = []
-        for call in subp.call_args_list:
-            args = call[0][0]
-            for arg in args:
-                if arg.startswith('DomU_Request'):
-                    request_types.append(arg.split()[1])
+        for call in readurl.call_args_list:
+            request_types.append(call[1]['headers']['DomU_Request'])
         self.assertEqual(expected_request_types, request_types)
 
     def test_valid_response_means_password_marked_as_saved(self):
         password = 'SekritSquirrel'
-        subp = self._set_password_server_response(password)
-        ds = DataSourceCloudStack({}, None, helpers.Paths({}))
+        readurl = self._set_password_server_response(password)
+        ds = CloudStackDS({}, None, helpers.Paths({}))
         ds.get_data()
-        self.assertRequestTypesSent(subp,
+        self.assertRequestTypesSent(readurl,
                                     ['send_my_password', 'saved_password'])
 
     def _check_password_not_saved_for(self, response_string):
-        subp = self._set_password_server_response(response_string)
-        ds = DataSourceCloudStack({}, None, helpers.Paths({}))
+        readurl = self._set_password_server_response(response_string)
+        ds = CloudStackDS({}, None, helpers.Paths({}))
         ds.get_data()
-        self.assertRequestTypesSent(subp, ['send_my_password'])
+        self.assertRequestTypesSent(readurl, ['send_my_password'])
 
     def test_password_not_saved_if_empty(self):
         self._check_password_not_saved_for('')
@@ -84,3 +103,119 @@ class TestCloudStackPasswordFetching(TestCase):
 
     def test_password_not_saved_if_bad_request(self):
         self._check_password_not_saved_for('bad_request')
+
+
+class FakePasswordServer(BaseHTTPServer.HTTPServer):
+    """A local stand-in for the virtual router's password server."""
+
+    def __init__(self, password):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           FakePasswordHandler)
+        self.password = password
+        self.requests = []
+
+
+class FakePasswordHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        request = self.headers.get('DomU_Request')
+        self.server.requests.append((request, self.client_address))
+        if request == 'send_my_password':
+            body = self.server.password
+            self.server.password = 'saved_password'
+        elif request == 'saved_password':
+            body = 'saved_password'
+        else:
+            body = 'bad_request'
+        body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestCloudStackPasswordServerClient(TestCase):
+
+    def setUp(self):
+        super(TestCloudStackPasswordServerClient, self).setUp()
+        self.server = FakePasswordServer('SekritSquirrel\n')
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def _client(self):
+        client = CloudStackPasswordServerClient('127.0.0.1')
+        client.port = self.server.server_port
+        return client
+
+    def test_password_fetched_and_acknowledged(self):
+        with mock.patch.object(util, 'subp') as subp:
+            self.assertEqual('SekritSquirrel',
+                             self._client().get_password())
+        self.assertEqual([], subp.call_args_list)
+        self.assertEqual(['send_my_password', 'saved_password'],
+                         [r[0] for r in self.server.requests])
+        # both over the one (kept alive) connection
+        self.assertEqual(1, len(set(r[1] for r in self.server.requests)))
+
+    def test_saved_password(self):
+        self._client().get_password()
+        self.assertIsNone(self._client().get_password())
+        self.assertEqual(['send_my_password', 'saved_password',
+                          'send_my_password'],
+                         [r[0] for r in self.server.requests])
+
+
+class TestLeaseIndex(TestCase):
+
+    def setUp(self):
+        super(TestLeaseIndex, self).setUp()
+        self.lease_d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.lease_d)
+        self.patches = ExitStack()
+        self.addCleanup(self.patches.close)
+        self.patches.enter_context(mock.patch.object(
+            DataSourceCloudStack, 'get_dhclient_d',
+            return_value=self.lease_d))
+        self.patches.enter_context(mock.patch.object(
+            DataSourceCloudStack, 'get_default_gateway',
+            return_value='10.0.0.254'))
+        self.patches.enter_context(mock.patch.object(
+            DataSourceCloudStack, '_LEASE_INDEX',
+            DataSourceCloudStack.LeaseIndex()))
+
+    def _write_lease(self, name, servers, mtime):
+        path = os.path.join(self.lease_d, name)
+        util.write_file(path, "".join(LEASE % server for server in servers))
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_newest_file_last_lease(self):
+        self._write_lease('dhclient.eth1.leases', ['10.0.0.9'], 1000)
+        newest = self._write_lease('dhclient.eth0.leases',
+                                   ['10.0.0.1', '10.0.0.2'], 2000)
+        self._write_lease('dhclient.conf', ['10.0.0.8'], 3000)
+        self.assertEqual(newest, DataSourceCloudStack.get_latest_lease())
+        self.assertEqual('10.0.0.2', DataSourceCloudStack.get_vr_address())
+
+    def test_parsed_once(self):
+        path = self._write_lease('dhclient.leases', ['10.0.0.1'], 1000)
+        self.assertEqual('10.0.0.1', DataSourceCloudStack.get_vr_address())
+        with mock.patch.object(util, 'load_file') as load_file:
+            self.assertEqual('10.0.0.1',
+                             DataSourceCloudStack.get_vr_address())
+        self.assertEqual([], load_file.call_args_list)
+        self._write_lease('dhclient.leases', ['10.0.0.1', '10.0.0.3'], 2000)
+        self.assertEqual('10.0.0.3', DataSourceCloudStack.get_vr_address())
+        self.assertEqual(path, DataSourceCloudStack.get_latest_lease())
+
+    def test_default_gateway(self):
+        self.assertEqual('10.0.0.254', DataSourceCloudStack.get_vr_address())
+        self._write_lease('dhclient.leases', [], 1000)
+        self.assertEqual('10.0.0.254', DataSourceCloudStack.get_vr_address())
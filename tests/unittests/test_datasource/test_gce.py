@@ -15,9 +15,12 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
 import re
+import threading
 
 from base64 import b64encode, b64decode
+from six.moves import BaseHTTPServer
 from six.moves.urllib_parse import urlparse
 
 from cloudinit import settings
@@ -164,3 +167,116 @@ class TestDataSourceGCE(test_helpers.HttprettyTestCase):
         _set_mock_metadata()
         self.ds.get_data()
         self.assertEqual('bar', self.ds.availability_zone)
+
+
+class FakeMetadataServer(BaseHTTPServer.HTTPServer):
+    """A local stand-in for the GCE metadata server, serving gce_meta.
+
+    Flat paths are served as is, "<root>/?recursive=true&alt=json" as the
+    json of everything under root (unless recursive is False).
+    """
+
+    def __init__(self, gce_meta, recursive=True):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           FakeMetadataHandler)
+        self.gce_meta = gce_meta
+        self.recursive = recursive
+        self.requests = []
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s/computeMetadata/v1/' % self.server_port
+
+    def tree(self, root):
+        tree = {}
+        for (path, value) in self.gce_meta.items():
+            parts = path.split('/')
+            if parts[0] != root:
+                continue
+            node = tree
+            for part in parts[1:-1]:
+                node = node.setdefault(part, {})
+            if isinstance(value, bytes):
+                value = value.decode('utf-8')
+            if parts[-1] == 'id':
+                value = int(value)
+            node[parts[-1]] = value
+        return tree
+
+
+class FakeMetadataHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        url = urlparse(self.path)
+        path = url.path.split('/computeMetadata/v1/', 1)[-1]
+        body = None
+        if self.headers.get('X-Google-Metadata-Request') != 'True':
+            body = None
+        elif url.query == 'recursive=true&alt=json':
+            if server.recursive:
+                body = json.dumps(server.tree(path.rstrip('/')))
+        elif path in server.gce_meta:
+            body = server.gce_meta[path]
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDataSourceGCERecursive(test_helpers.TestCase):
+
+    def _get_data(self, gce_meta, recursive=True, server_recursive=True):
+        server = FakeMetadataServer(gce_meta, recursive=server_recursive)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        ds = DataSourceGCE.DataSourceGCE(
+            {'datasource': {'GCE': {'metadata_url': server.url,
+                                    'recursive': recursive}}},
+            None, helpers.Paths({}))
+        self.assertTrue(ds.get_data())
+        return (ds.metadata, server.requests)
+
+    def test_two_requests(self):
+        for meta in (GCE_META, GCE_META_PARTIAL, GCE_META_ENCODING):
+            (metadata, requests) = self._get_data(meta)
+            self.assertEqual(
+                ['/computeMetadata/v1/instance/?recursive=true&alt=json',
+                 '/computeMetadata/v1/project/?recursive=true&alt=json'],
+                requests)
+            (expected, per_key) = self._get_data(meta, recursive=False)
+            self.assertEqual(expected, metadata)
+            self.assertEqual(7, len(per_key))
+
+    def test_instance_keys(self):
+        meta = GCE_META.copy()
+        meta['instance/attributes/sshKeys'] = 'user:ssh-rsa JustAUser'
+        (metadata, _requests) = self._get_data(meta)
+        self.assertEqual('123', metadata['instance-id'])
+        self.assertEqual('bar', metadata['availability-zone'])
+        self.assertEqual(['ssh-rsa JustAUser'], metadata['public-keys'])
+        self.assertEqual(b'/bin/echo foo\n', metadata['user-data'])
+
+    def test_encoded_user_data(self):
+        (metadata, _requests) = self._get_data(GCE_META_ENCODING)
+        self.assertEqual(b'/bin/echo baz\n', metadata['user-data'])
+
+    def test_falls_back_per_key(self):
+        (metadata, requests) = self._get_data(GCE_META,
+                                              server_recursive=False)
+        (expected, _requests) = self._get_data(GCE_META, recursive=False)
+        self.assertEqual(expected, metadata)
+        self.assertEqual(2 + 7, len(requests))
@@ -1,10 +1,18 @@
 from copy import copy
+import json
 import os
+import re
 import shutil
 import tempfile
+import threading
+import time
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
 
 from cloudinit.sources import DataSourceMAAS
 from cloudinit import url_helper
+from cloudinit import util
 from ..helpers import TestCase, populate_dir
 
 try:
@@ -118,28 +126,29 @@ class TestMAASDataSource(TestCase):
         def my_headers_cb(url):
             return my_headers
 
-        # Each time url_helper.readurl() is called, something different is
-        # returned based on the canned data above.  We need to build up a list
-        # of side effect return values, which the mock will return.  At the
-        # same time, we'll build up a list of expected call arguments for
-        # asserting after the code under test is run.
+        # Each time url_helper.readurl() is called, the canned data above for
+        # the url is returned (the files are fetched concurrently, so in no
+        # particular order).  At the same time, we'll build up a list of
+        # expected call arguments for asserting after the code under test is
+        # run.
         calls = []
-
-        def side_effect():
-            for key in valid_order:
-                resp = valid.get(key)
-                url = "%s/%s/%s" % (my_seed, my_ver, key)
-                calls.append(
-                    mock.call(url, headers=None, timeout=mock.ANY,
-                              data=mock.ANY, sec_between=mock.ANY,
-                              ssl_details=mock.ANY, retries=mock.ANY,
-                              headers_cb=my_headers_cb,
-                              exception_cb=mock.ANY))
-                yield url_helper.StringResponse(resp)
+        responses = {}
+        for key in valid_order:
+            url = "%s/%s/%s" % (my_seed, my_ver, key)
+            responses[url] = url_helper.StringResponse(valid.get(key))
+            calls.append(
+                mock.call(url, headers=None, timeout=mock.ANY,
+                          data=mock.ANY, sec_between=mock.ANY,
+                          ssl_details=mock.ANY, retries=mock.ANY,
+                          headers_cb=my_headers_cb,
+                          exception_cb=mock.ANY, session=mock.ANY))
+
+        def side_effect(url, **kwargs):
+            return responses[url]
 
         # Now do the actual call of the code under test.
         with mock.patch.object(url_helper, 'readurl',
-                               side_effect=side_effect()) as mockobj:
+                               side_effect=side_effect) as mockobj:
             userdata, metadata = DataSourceMAAS.read_maas_seed_url(
                 my_seed, version=my_ver)
 
@@ -160,4 +169,161 @@ class TestMAASDataSource(TestCase):
         pass
 
 
+class FakeMAASServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A local metadata server.
+
+    No request is answered before wait_for requests have come in (or the
+    test is over), so with wait_for set only concurrent clients get their
+    answers.  If skew is set its clock is that many seconds ahead, and
+    requests with an oauth timestamp too far from it are refused (as MAAS
+    does).
+    """
+    daemon_threads = True
+    block_on_close = False
+
+    def __init__(self, files, wait_for=0, skew=None):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           FakeMAASHandler)
+        self.files = files
+        self.wait_for = wait_for
+        self.skew = skew
+        self.requests = []
+        self.started = 0
+        self.started_lock = threading.Lock()
+        self.all_started = threading.Event()
+        self.timed_out = False
+
+    def wait_for_all(self):
+        with self.started_lock:
+            self.started += 1
+            if self.started >= self.wait_for:
+                self.all_started.set()
+        self.all_started.wait(5)
+        if not self.all_started.is_set():
+            self.timed_out = True
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s/MAAS/metadata' % self.server_port
+
+
+class FakeMAASHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def date_time_string(self, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time() + (self.server.skew or 0)
+        return BaseHTTPServer.BaseHTTPRequestHandler.date_time_string(
+            self, timestamp)
+
+    def _authorized(self):
+        if self.server.skew is None:
+            return True
+        found = re.search(r'oauth_timestamp="(\d+)"',
+                          self.headers.get('Authorization', ''))
+        return bool(found and abs(int(found.group(1)) - time.time() -
+                                  self.server.skew) < 10)
+
+    def do_GET(self):
+        self.server.wait_for_all()
+        path = self.path.split('/', 4)[-1]
+        authorized = self._authorized()
+        self.server.requests.append((path, authorized))
+        if not authorized:
+            self.send_response(401)
+            self.end_headers()
+            return
+        if path not in self.server.files:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.server.files[path]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestMAASSeedUrlConcurrent(TestCase):
+
+    files = {
+        'meta-data/instance-id': b'i-instanceid',
+        'meta-data/local-hostname': b'test-hostname',
+        'meta-data/public-keys': b'ssh-rsa AAAAB3Nz test',
+        'user-data': b'foodata',
+    }
+
+    def setUp(self):
+        super(TestMAASSeedUrlConcurrent, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def _start(self, **kwargs):
+        server = FakeMAASServer(**kwargs)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(server.all_started.set)
+        return server
+
+    def test_concurrent(self):
+        # every file is only served once all of them were asked for
+        server = self._start(files=self.files, wait_for=len(self.files))
+        (userdata, metadata) = DataSourceMAAS.read_maas_seed_url(
+            server.url, version='latest')
+        self.assertFalse(server.timed_out)
+        self.assertEqual(b'foodata', userdata)
+        self.assertEqual({'instance-id': 'i-instanceid',
+                          'local-hostname': 'test-hostname',
+                          'public-keys': 'ssh-rsa AAAAB3Nz test'}, metadata)
+
+    def test_optional_missing(self):
+        files = copy(self.files)
+        del files['user-data']
+        del files['meta-data/public-keys']
+        server = self._start(files=files)
+        (userdata, metadata) = DataSourceMAAS.read_maas_seed_url(
+            server.url, version='latest')
+        self.assertEqual(b'', userdata)
+        self.assertEqual(['instance-id', 'local-hostname'],
+                         sorted(metadata.keys()))
+
+    def test_required_missing(self):
+        files = copy(self.files)
+        del files['meta-data/instance-id']
+        server = self._start(files=files)
+        self.assertRaises(DataSourceMAAS.MAASSeedDirMalformed,
+                          DataSourceMAAS.read_maas_seed_url,
+                          server.url, version='latest')
+
+    def test_deadline(self):
+        # nothing is served before the deadline
+        server = self._start(files=self.files, wait_for=len(self.files) + 1)
+        self.assertRaises(util.DeadlineExceededError,
+                          DataSourceMAAS.read_maas_seed_url,
+                          server.url, version='latest', deadline=0.5)
+
+    def test_oauth_clock_skew(self):
+        server = self._start(files=self.files, skew=3600)
+        skew_file = os.path.join(self.tmp, 'oauth_skew.json')
+        helper = url_helper.OauthUrlHelper(
+            consumer_key='ckey', token_key='tkey', token_secret='tsecret',
+            skew_data_file=skew_file)
+        (userdata, metadata) = DataSourceMAAS.read_maas_seed_url(
+            server.url, version='latest', read_file_or_url=helper.readurl,
+            retries=1)
+        self.assertEqual(b'foodata', userdata)
+        self.assertEqual('i-instanceid', metadata['instance-id'])
+        # every file was refused at first, and read once the skew was fixed
+        self.assertEqual(sorted(self.files),
+                         sorted(p for (p, ok) in server.requests if ok))
+        with open(skew_file) as fp:
+            skew = json.load(fp)['127.0.0.1:%s' % server.server_port]
+        self.assertTrue(abs(skew - 3600) < 10)
+
+
 # vi: ts=4 expandtab
@@ -102,6 +102,19 @@ class TestNoCloudDataSource(TestCase):
         self.assertEqual(dsrc.metadata.get('instance-id'), 'IID')
         self.assertTrue(ret)
 
+    def test_seedfrom_read_with_deadline(self):
+        sys_cfg = {'datasource': {'NoCloud': {
+            'fs_label': None, 'seedfrom': 'http://seed.example/'}}}
+        dsrc = DataSourceNoCloud.DataSourceNoCloudNet(
+            sys_cfg=sys_cfg, distro=None, paths=self.paths)
+        with mock.patch.object(util, 'read_seeded') as m_read:
+            m_read.return_value = ({'instance-id': 'IID'}, b"USER_DATA")
+            self.assertTrue(dsrc.get_data())
+        m_read.assert_called_once_with(
+            'http://seed.example/', timeout=None,
+            deadline=util.SEED_DEADLINE)
+        self.assertEqual(b"USER_DATA", dsrc.userdata_raw)
+
     def test_nocloud_seed_with_vendordata(self):
         md = {'instance-id': 'IID', 'dsmode': 'local'}
         ud = b"USER_DATA_HERE"
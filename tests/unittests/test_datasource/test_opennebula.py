@@ -1,7 +1,7 @@
 from cloudinit import helpers
 from cloudinit.sources import DataSourceOpenNebula as ds
 from cloudinit import util
-from ..helpers import TestCase, populate_dir
+from ..helpers import TestCase, populate_dir, skipIf
 
 import os
 import pwd
@@ -9,6 +9,11 @@ import shutil
 import tempfile
 import unittest
 
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 
 TEST_VARS = {
     'VAR1': 'single',
@@ -31,12 +36,64 @@ SSH_KEY = 'ssh-rsa AAAAB3NzaC1....sIkJhq8wdX+4I3A4cYbYP ubuntu@server-460-%i'
 HOSTNAME = 'foo.example.com'
 PUBLIC_IP = '10.0.0.3'
 
-CMD_IP_OUT = '''\
-1: lo: <LOOPBACK,UP,LOWER_UP> mtu 16436 qdisc noqueue state UNKNOWN
-    link/loopback 00:00:00:00:00:00 brd 00:00:00:00:00:00
-2: eth0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc mq state UP qlen 1000
-    link/ether 02:00:0a:12:01:01 brd ff:ff:ff:ff:ff:ff
-'''
+IFACES = [('eth0', '02:00:0a:12:01:01')]
+
+SYS_NET_ADDRESSES = {
+    'lo': '00:00:00:00:00:00',
+    'eth0': '02:00:0a:12:01:01',
+    'eth10': '02:00:0a:12:01:0a',
+    'eth2': '02:00:0a:12:01:02',
+    'ib0': '80:00:02:08:fe:80:00:00:00:00:00:00:00:02:c9:03:00:0e:1c:81',
+}
+
+# context.sh contents, as OpenNebula writes them and otherwise, that
+# parse_context has to read just as bash does
+CONTEXT_CORPUS = [
+    r"",
+    r"""# Context variables generated by OpenNebula
+DISK_ID='1'
+""",
+    r"""A='single'
+B='double word'
+C='multi
+line
+'
+""",
+    r"""A='it'\''s'
+B=''\'''\'''
+""",
+    r"""A="double \"quoted\" \$dollar \`tick\` \\ \t"
+B="multi
+line"
+C="continued \
+line"
+""",
+    r"""A="$"
+B="a $ b"
+C=$
+""",
+    r"""A=unquoted
+B=escaped\ space\'s
+C=mixed'single'"double"
+""",
+    "A=1 B=2\n\tC=3   # comment\n\nD=\n",
+    r"""SECONDS=2
+RANDOM=3
+A=1
+""",
+    r"""A='first'
+A='second'
+""",
+    r"""A='#not a comment' B=x#y
+""",
+    "A=trailing\\\nB=after\\\n",
+    r"""USER_DATA='#cloud-config
+packages: ["a", "b"]
+runcmd:
+ - [ sh, -c, "echo $HOME > /tmp/x" ]
+'
+""",
+]
 
 
 class TestOpenNebulaDataSource(TestCase):
@@ -87,11 +144,29 @@ class TestOpenNebulaDataSource(TestCase):
         finally:
             util.find_devs_with = orig_find_devs_with
 
+    def test_get_data_bash_fallback(self):
+        orig_find_devs_with = util.find_devs_with
+        try:
+            # dont' try to lookup for CDs
+            util.find_devs_with = lambda n: []
+            populate_dir(self.seed_dir, {'context.sh': 'KEY1=val1; KEY2=2'})
+            dsrc = self.ds(sys_cfg=self.sys_cfg, distro=None, paths=self.paths)
+            self.assertRaises(ds.BrokenContextDiskDir, dsrc.get_data)
+
+            self.sys_cfg['datasource']['OpenNebula']['bash_fallback'] = True
+            dsrc = self.ds(sys_cfg=self.sys_cfg, distro=None, paths=self.paths)
+            self.assertTrue(dsrc.get_data())
+            self.assertEqual('val1', dsrc.metadata['KEY1'])
+            self.assertEqual('nobody', self.parsed_user)
+        finally:
+            util.find_devs_with = orig_find_devs_with
+
     def test_get_data_invalid_identity(self):
         orig_find_devs_with = util.find_devs_with
         try:
             # generate non-existing system user name
             sys_cfg = self.sys_cfg
+            sys_cfg['datasource']['OpenNebula']['bash_fallback'] = True
             invalid_user = 'invalid'
             while not sys_cfg['datasource']['OpenNebula'].get('parseuser'):
                 try:
@@ -103,7 +178,8 @@ class TestOpenNebulaDataSource(TestCase):
 
             # dont' try to lookup for CDs
             util.find_devs_with = lambda n: []
-            populate_context_dir(self.seed_dir, {'KEY1': 'val1'})
+            # the parse user only matters to (contexts that need) bash
+            populate_dir(self.seed_dir, {'context.sh': 'KEY1=$(echo val1)'})
             dsrc = self.ds(sys_cfg=sys_cfg, distro=None, paths=self.paths)
             self.assertRaises(ds.BrokenContextDiskDir, dsrc.get_data)
         finally:
@@ -210,9 +286,11 @@ class TestOpenNebulaDataSource(TestCase):
 
     def test_network_interfaces(self):
         populate_context_dir(self.seed_dir, {'ETH0_IP': '1.2.3.4'})
-        results = ds.read_context_disk_dir(self.seed_dir)
+        with mock.patch.object(ds, 'get_ifaces', return_value=IFACES):
+            results = ds.read_context_disk_dir(self.seed_dir)
 
         self.assertTrue('network-interfaces' in results)
+        self.assertIn('address 1.2.3.4', results['network-interfaces'])
 
     def test_find_candidates(self):
         def my_devs_with(criteria):
@@ -237,14 +315,14 @@ class TestOpenNebulaNetwork(unittest.TestCase):
         super(TestOpenNebulaNetwork, self).setUp()
 
     def test_lo(self):
-        net = ds.OpenNebulaNetwork('', {})
+        net = ds.OpenNebulaNetwork({}, [])
         self.assertEqual(net.gen_conf(), u'''\
 auto lo
 iface lo inet loopback
 ''')
 
     def test_eth0(self):
-        net = ds.OpenNebulaNetwork(CMD_IP_OUT, {})
+        net = ds.OpenNebulaNetwork({}, IFACES)
         self.assertEqual(net.gen_conf(), u'''\
 auto lo
 iface lo inet loopback
@@ -267,7 +345,7 @@ iface eth0 inet static
             'ETH0_DNS': '1.2.3.6 1.2.3.7'
         }
 
-        net = ds.OpenNebulaNetwork(CMD_IP_OUT, context)
+        net = ds.OpenNebulaNetwork(context, IFACES)
         self.assertEqual(net.gen_conf(), u'''\
 auto lo
 iface lo inet loopback
@@ -291,6 +369,73 @@ class TestParseShellConfig(unittest.TestCase):
         self.assertEqual(ret, {"foo": "bar", "xx": "foo"})
 
 
+class TestGetIfaces(unittest.TestCase):
+
+    def test_eth_from_sysfs(self):
+        with mock.patch.object(ds.net, 'get_devicelist',
+                               return_value=list(SYS_NET_ADDRESSES)):
+            with mock.patch.object(
+                    ds.net, 'read_sys_net',
+                    side_effect=lambda name, path: SYS_NET_ADDRESSES[name]):
+                self.assertEqual([('eth0', '02:00:0a:12:01:01'),
+                                  ('eth2', '02:00:0a:12:01:02'),
+                                  ('eth10', '02:00:0a:12:01:0a')],
+                                 ds.get_ifaces())
+
+    def test_no_subp(self):
+        with mock.patch.object(util, 'subp') as subp:
+            ds.OpenNebulaNetwork({'ETH0_IP': '1.2.3.4'}).gen_conf()
+        self.assertEqual([], subp.call_args_list)
+
+
+class TestParseContext(unittest.TestCase):
+
+    def test_quoting(self):
+        content = '\n'.join([
+            r"A='it'\''s'",
+            r'B="a \"b\" \$c \d',
+            r'e"',
+            r"C=x\ y",
+            r"D='multi",
+            r"line'",
+        ])
+        self.assertEqual({'A': "it's", 'B': 'a "b" $c \\d\ne', 'C': 'x y',
+                          'D': 'multi\nline'},
+                         ds.parse_context(content))
+
+    def test_unsupported(self):
+        for content in (';', 'A=1; B=2', 'A=$(id)', 'A="$HOME"', 'A=${B}',
+                        'A=`id`', 'echo hi', 'export A=1', 'A=~',
+                        "A='unterminated", 'A="unterminated'):
+            self.assertRaises(ds.UnsupportedContext, ds.parse_context,
+                              content)
+
+    def test_no_subp(self):
+        with mock.patch.object(util, 'subp') as subp:
+            self.assertEqual({'A': 'b'}, ds.parse_context("A='b'\n"))
+        self.assertEqual([], subp.call_args_list)
+
+
+@skipIf(not util.which('bash'), "bash not available")
+class TestParseContextMatchesBash(unittest.TestCase):
+    """parse_context and parse_shell_config (bash) agree on contexts."""
+
+    def assertSameAsBash(self, content):
+        self.assertEqual(ds.parse_shell_config(content),
+                         ds.parse_context(content),
+                         "parsed differently: %r" % content)
+
+    def test_corpus(self):
+        for content in CONTEXT_CORPUS:
+            self.assertSameAsBash(content)
+
+    def test_generated(self):
+        data = "# Context variables generated by OpenNebula\n"
+        for k, v in sorted(TEST_VARS.items()):
+            data += ("%s='%s'\n" % (k, v.replace(r"'", r"'\''")))
+        self.assertSameAsBash(data)
+
+
 def populate_context_dir(path, variables):
     data = "# Context variables generated by OpenNebula\n"
     for k, v in variables.items():
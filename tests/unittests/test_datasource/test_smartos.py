@@ -27,9 +27,12 @@ from __future__ import print_function
 import os
 import os.path
 import re
+import select
 import shutil
+import socket
 import stat
 import tempfile
+import threading
 import uuid
 from binascii import crc32
 
@@ -38,7 +41,7 @@ import six
 
 from cloudinit import helpers as c_helpers
 from cloudinit.sources import DataSourceSmartOS
-from cloudinit.util import b64e
+from cloudinit.util import b64d, b64e
 
 from .. import helpers
 
@@ -46,6 +49,10 @@ try:
     from unittest import mock
 except ImportError:
     import mock
+try:
+    from contextlib import ExitStack
+except ImportError:
+    from contextlib2 import ExitStack
 
 MOCK_RETURNS = {
     'hostname': 'test-host',
@@ -73,6 +80,9 @@ def get_mock_client(mockdata):
 
         def get_metadata(self, metadata_key):
             return mockdata.get(metadata_key)
+
+        def get_metadata_many(self, metadata_keys):
+            return dict((k, mockdata.get(k)) for k in metadata_keys)
     return MockMetadataClient
 
 
@@ -476,6 +486,8 @@ class TestJoyentMetadataClient(helpers.FilesystemMockingTestCase):
             return resp
 
         self.serial.read.side_effect = read_response
+        self.serial.inWaiting.side_effect = (
+            lambda: len(self.metasource_data or b''))
         self.patched_funcs.enter_context(
             mock.patch('cloudinit.sources.DataSourceSmartOS.random.randint',
                        mock.Mock(return_value=self.request_id)))
@@ -550,7 +562,10 @@ class TestJoyentMetadataClient(helpers.FilesystemMockingTestCase):
     def test_get_metadata_reads_a_line(self):
         client = self._get_client()
         client.get_metadata('some_key')
-        self.assertEqual(self.metasource_data_len, self.serial.read.call_count)
+        # one byte to wait for the reply, then the rest of it in one go
+        self.assertEqual(
+            [mock.call(1), mock.call(self.metasource_data_len - 1)],
+            self.serial.read.call_args_list)
 
     def test_get_metadata_returns_valid_value(self):
         client = self._get_client()
@@ -583,3 +598,143 @@ class TestJoyentMetadataClient(helpers.FilesystemMockingTestCase):
         client = self._get_client()
         client._checksum = lambda _: self.response_parts['crc']
         self.assertIsNone(client.get_metadata('some_key'))
+
+
+class FakeMetadataAgent(object):
+    """Answers V2 GET requests written to fd like the SmartOS agent would.
+
+    Requests are only answered once no more arrive for a moment, and each
+    such round is answered in reverse order, so a client needs to match
+    replies by request id.  rounds records the keys asked in each round.
+    """
+
+    def __init__(self, fd, metadata, settle=0.05):
+        self.fd = fd
+        self.metadata = metadata
+        self.settle = settle
+        self.rounds = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _reply(self, request):
+        (request_id, _get, key) = request.split(' ')[3:6]
+        key = b64d(key)
+        value = self.metadata.get(key)
+        if value is None:
+            body = '{0} NOTFOUND'.format(request_id)
+        else:
+            body = '{0} SUCCESS {1}'.format(request_id, b64e(value))
+        return key, 'V2 {0} {1:08x} {2}\n'.format(
+            len(body), crc32(body.encode('utf-8')) & 0xffffffff, body)
+
+    def _run(self):
+        data = b''
+        requests = []
+        while not self._stop.is_set():
+            (readable, _w, _x) = select.select([self.fd], [], [],
+                                               self.settle)
+            if readable:
+                try:
+                    data += os.read(self.fd, 4096)
+                except OSError:
+                    return
+                while b'\n' in data:
+                    (line, data) = data.split(b'\n', 1)
+                    requests.append(line.decode('ascii'))
+                continue
+            if requests:
+                replies = [self._reply(r) for r in reversed(requests)]
+                self.rounds.append([key for (key, _r) in reversed(replies)])
+                requests = []
+                os.write(self.fd, ''.join(
+                    r for (_k, r) in replies).encode('ascii'))
+
+
+class TestJoyentMetadataClientWithAgent(helpers.TestCase):
+
+    def setUp(self):
+        super(TestJoyentMetadataClientWithAgent, self).setUp()
+        (master, slave) = os.openpty()
+        self.addCleanup(os.close, master)
+        # with no slave open, reading the master fails with EIO
+        self.addCleanup(os.close, slave)
+        self.tty = os.ttyname(slave)
+        self.agent = FakeMetadataAgent(master, MOCK_RETURNS)
+        self.agent.start()
+        self.addCleanup(self.agent.stop)
+
+    def _serial(self):
+        ser = serial.Serial(self.tty, timeout=10)
+        self.addCleanup(ser.close)
+        return ser
+
+    def test_pipelined(self):
+        client = DataSourceSmartOS.JoyentMetadataClient(self._serial())
+        keys = sorted(MOCK_RETURNS) + ['not-there']
+        values = client.get_metadata_many(keys)
+        expected = dict((k, MOCK_RETURNS.get(k)) for k in keys)
+        self.assertEqual(expected, values)
+        self.assertEqual([keys], self.agent.rounds)
+
+    def test_pipeline_depth(self):
+        client = DataSourceSmartOS.JoyentMetadataClient(self._serial(),
+                                                        pipeline_depth=2)
+        keys = sorted(MOCK_RETURNS)
+        values = client.get_metadata_many(keys)
+        self.assertEqual(dict((k, MOCK_RETURNS[k]) for k in keys), values)
+        self.assertEqual(keys, sum(self.agent.rounds, []))
+        self.assertEqual(2, max(len(r) for r in self.agent.rounds))
+
+    def test_single_key(self):
+        client = DataSourceSmartOS.JoyentMetadataClient(self._serial())
+        self.assertEqual('test-host', client.get_metadata('hostname'))
+        self.assertIsNone(client.get_metadata('not-there'))
+        self.assertEqual([['hostname'], ['not-there']], self.agent.rounds)
+
+    def test_socket(self):
+        (ours, theirs) = socket.socketpair()
+        self.addCleanup(ours.close)
+        self.addCleanup(theirs.close)
+        agent = FakeMetadataAgent(theirs.fileno(), MOCK_RETURNS)
+        agent.start()
+        self.addCleanup(agent.stop)
+        fp = ours.makefile('rwb')
+        self.addCleanup(fp.close)
+        client = DataSourceSmartOS.JoyentMetadataClient(fp)
+        keys = ['hostname', 'sdc:uuid']
+        self.assertEqual(dict((k, MOCK_RETURNS[k]) for k in keys),
+                         client.get_metadata_many(keys))
+        self.assertEqual([keys], agent.rounds)
+
+    def test_datasource_fetches_in_one_round(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        ds_cfg = {'serial_device': self.tty, 'serial_timeout': 10}
+        mod = DataSourceSmartOS
+        with ExitStack() as mocks:
+            mocks.enter_context(mock.patch.object(
+                mod, 'LEGACY_USER_D', os.path.join(tmp, 'legacy')))
+            mocks.enter_context(mock.patch.object(
+                mod, 'dmi_data', return_value=DMI_DATA_RETURN))
+            mocks.enter_context(mock.patch.object(os, 'uname', return_value=(
+                'LINUX', 'NODENAME', 'RELEASE', 'VERSION', 'x86_64')))
+            mocks.enter_context(mock.patch.object(mod.util, 'subp',
+                                                  return_value=('', '')))
+            dsrc = mod.DataSourceSmartOS(
+                {'datasource': {'SmartOS': ds_cfg}}, distro=None,
+                paths=c_helpers.Paths({'cloud_dir': tmp}))
+            self.assertTrue(dsrc.get_data())
+        self.assertEqual(MOCK_RETURNS['sdc:uuid'],
+                         dsrc.metadata['instance-id'])
+        self.assertEqual(MOCK_RETURNS['cloud-init:user-data'],
+                         dsrc.userdata_raw)
+        self.assertEqual(1, len(self.agent.rounds))
+        self.assertIn('b64-hostname', self.agent.rounds[0])
@@ -0,0 +1,188 @@
+import os
+import shlex
+import shutil
+import tempfile
+
+from cloudinit import distros
+from cloudinit import util
+
+from .. import helpers
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+GROUPS = {
+    'admins': ['root', 'nosuchuser'],
+    'ops': [],
+    'root': [],
+}
+
+USERS = {
+    'alice': {'groups': ['admins', 'wheel'], 'sudo': 'ALL=(ALL) ALL',
+              'plain_text_passwd': 'sekrit', 'lock_passwd': False,
+              'ssh_authorized_keys': ['ssh-rsa AAAA alice']},
+    'bob': {'groups': 'ops,dev', 'primary_group': 'bob-primary',
+            'hashed_passwd': '$6$salt$hash', 'shell': '/bin/zsh'},
+    'carol': {'create_groups': False, 'groups': 'missing',
+              'sudo': ['ALL=(ALL) NOPASSWD:ALL', 'ALL=(ALL) ALL'],
+              'no_create_home': True},
+    'root': {'ssh_authorized_keys': 'ssh-rsa AAAA root'},
+}
+
+
+class FakeSystem(object):
+    """The passwd and group databases and the commands changing them."""
+
+    def __init__(self, fail_users=()):
+        self.users = set(['root'])
+        self.groups = set(['root', 'wheel'])
+        self.fail_users = fail_users
+        self.invocations = []
+        self.commands = []
+
+    def run(self, args):
+        """Run one command, returning its exit code."""
+        self.commands.append(tuple(args))
+        if args[0] == 'groupadd':
+            if args[1] in self.groups:
+                return 9
+            self.groups.add(args[1])
+        elif args[0] == 'useradd':
+            if args[1] in self.users or args[1] in self.fail_users:
+                return 1
+            self.users.add(args[1])
+        return 0
+
+    def subp(self, args, data=None, **kwargs):
+        self.invocations.append(args[0])
+        if args[0] == 'sh':
+            err = []
+            for line in data.splitlines():
+                # <command> || echo <marker> <index> $? >&2
+                (cmd, marker) = line.split(' || ')
+                rc = self.run(shlex.split(cmd))
+                if rc:
+                    (_echo, word, index) = marker.split()[:3]
+                    err.append("%s %s %s" % (word, index, rc))
+            return ('', "\n".join(err))
+        elif args[0] == 'chpasswd':
+            for line in data.splitlines():
+                self.commands.append(tuple(args) + (line,))
+            return ('', '')
+        if self.run(args):
+            raise util.ProcessExecutionError(cmd=args, exit_code=1)
+        return ('', '')
+
+
+class TestCreateUsers(helpers.TestCase):
+
+    def setUp(self):
+        super(TestCreateUsers, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def _distro(self, name='ubuntu'):
+        cls = distros.fetch(name)
+        distro = cls(name, {}, None)
+        distro.ci_sudoers_fn = os.path.join(self.tmp, name, 'sudoers')
+        return distro
+
+    def _patch(self, system):
+        patches = [
+            mock.patch.object(util, 'subp', side_effect=system.subp),
+            mock.patch.object(util, 'is_user',
+                              side_effect=lambda n: n in system.users),
+            mock.patch.object(util, 'is_group',
+                              side_effect=lambda n: n in system.groups),
+            mock.patch.object(util, 'get_user_names',
+                              side_effect=lambda: set(system.users)),
+            mock.patch.object(util, 'get_group_names',
+                              side_effect=lambda: set(system.groups)),
+            mock.patch.object(distros.Distro, 'ensure_sudo_dir'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        setup_keys = mock.patch.object(distros.ssh_util, 'setup_user_keys')
+        self.addCleanup(setup_keys.stop)
+        setup_keys = setup_keys.start()
+
+        def setup_users_keys(users_keys):
+            for (keys, username, options) in users_keys:
+                setup_keys(keys, username, options=options)
+        patch = mock.patch.object(distros.ssh_util, 'setup_users_keys',
+                                  side_effect=setup_users_keys)
+        self.addCleanup(patch.stop)
+        self.setup_users_keys = patch.start()
+        return setup_keys
+
+    def _per_user(self, distro, users, groups):
+        # what cc_users_groups did before create_users
+        for (name, members) in groups.items():
+            distro.create_group(name, members)
+        for (user, config) in users.items():
+            distro.create_user(user, **config)
+
+    def test_same_as_per_user(self):
+        per_user = FakeSystem()
+        setup_keys = self._patch(per_user)
+        distro = self._distro()
+        self._per_user(distro, USERS, GROUPS)
+        per_user_keys = sorted(setup_keys.call_args_list)
+        per_user_sudoers = util.load_file(distro.ci_sudoers_fn)
+
+        batched = FakeSystem()
+        setup_keys = self._patch(batched)
+        distro = self._distro('debian')
+        distro.create_users(USERS, GROUPS)
+
+        self.assertEqual(per_user.users, batched.users)
+        self.assertEqual(per_user.groups, batched.groups)
+        self.assertEqual(sorted(per_user.commands), sorted(batched.commands))
+        self.assertEqual(per_user_keys, sorted(setup_keys.call_args_list))
+        self.assertEqual(1, self.setup_users_keys.call_count)
+        self.assertEqual(sorted(per_user_sudoers.splitlines()),
+                         sorted(util.load_file(
+                             distro.ci_sudoers_fn).splitlines()))
+
+    def test_commands_do_not_grow_with_users(self):
+        system = FakeSystem()
+        self._patch(system)
+        users = {}
+        for i in range(200):
+            users['user%s' % i] = {'groups': ['team%s' % (i % 10)],
+                                   'plain_text_passwd': 'pw%s' % i,
+                                   'sudo': 'ALL=(ALL) ALL'}
+        distro = self._distro()
+        distro.create_users(users, {})
+        self.assertEqual(['sh', 'chpasswd', 'sh'], system.invocations)
+        self.assertEqual(201, len(system.users))
+        self.assertEqual(10, len([c for c in system.commands
+                                  if c[0] == 'groupadd']))
+        self.assertEqual(200, util.load_file(
+            distro.ci_sudoers_fn).count('ALL=(ALL) ALL'))
+
+    def test_failed_user_retried_on_its_own(self):
+        system = FakeSystem(fail_users=('bob',))
+        self._patch(system)
+        distro = self._distro()
+        self.assertRaises(util.ProcessExecutionError, distro.create_users,
+                          USERS, GROUPS)
+        # everyone else was still set up
+        self.assertEqual(set(['root', 'alice', 'carol']), system.users)
+        self.assertIn(('passwd', '-l', 'carol'), system.commands)
+        self.assertEqual(2, len([c for c in system.commands
+                                 if c[:2] == ('useradd', 'bob')]))
+
+    def test_per_user_for_overriding_distros(self):
+        distro = self._distro('freebsd')
+        with mock.patch.object(distro, 'create_user') as create_user:
+            with mock.patch.object(distro, 'create_group') as create_group:
+                distro.create_users({'alice': {'shell': '/bin/sh'}},
+                                    {'ops': ['alice']})
+        create_user.assert_called_once_with('alice', shell='/bin/sh')
+        create_group.assert_called_once_with('ops', ['alice'])
+
+# vi: ts=4 expandtab
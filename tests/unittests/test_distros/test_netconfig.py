@@ -320,3 +320,41 @@ defaultrouter="192.168.1.254"
 '''
             self.assertCfgEquals(expected_buf, str(write_buf))
             self.assertEquals(write_buf.mode, 0o644)
+
+    def _apply_repeatedly(self, distro, net_cfg, changed_cfg):
+        files = {}
+
+        def replace_write(filename, content, mode=0o644, omode="wb"):
+            files[filename] = util.decode_binary(content)
+
+        def replace_read(fname, read_cb=None, quiet=False, decode=True):
+            if fname not in files:
+                raise IOError("%s not found" % fname)
+            return files[fname]
+
+        brought_up = []
+        with ExitStack() as mocks:
+            mocks.enter_context(
+                mock.patch.object(util, 'write_file', replace_write))
+            mocks.enter_context(
+                mock.patch.object(util, 'load_file', replace_read))
+            mocks.enter_context(
+                mock.patch.object(os.path, 'isfile', return_value=False))
+            mocks.enter_context(mock.patch.object(
+                distro, '_bring_up_interfaces',
+                side_effect=lambda names: brought_up.append(sorted(names))))
+            for cfg in (net_cfg, net_cfg, changed_cfg):
+                distro.apply_network(cfg, True)
+        return brought_up
+
+    def test_unchanged_not_brought_up_ub(self):
+        brought_up = self._apply_repeatedly(
+            self._get_distro('ubuntu'), BASE_NET_CFG,
+            BASE_NET_CFG.replace('192.168.1.5', '192.168.1.7'))
+        self.assertEqual([['all'], ['all']], brought_up)
+
+    def test_unchanged_not_brought_up_rh(self):
+        brought_up = self._apply_repeatedly(
+            self._get_distro('rhel'), BASE_NET_CFG,
+            BASE_NET_CFG.replace('192.168.1.5', '192.168.1.7'))
+        self.assertEqual([['eth0', 'eth1', 'lo'], ['eth0']], brought_up)
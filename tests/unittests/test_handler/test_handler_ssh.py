@@ -0,0 +1,83 @@
+from cloudinit.config import cc_ssh
+from cloudinit import util
+
+from .. import helpers as t_help
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+LOG = logging.getLogger(__name__)
+
+
+class TestGenerateHostKeys(t_help.TestCase):
+
+    def setUp(self):
+        super(TestGenerateHostKeys, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        tpl = os.path.join(self.tmp, 'ssh', 'ssh_host_%s_key')
+        patcher = mock.patch.object(cc_ssh, 'KEY_FILE_TPL', tpl)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.keyfile = lambda keytype: tpl % keytype
+
+    def test_generated_concurrently(self):
+        keytypes = ['rsa', 'dsa', 'ecdsa', 'ed25519']
+        started = []
+        timed_out = []
+        all_started = threading.Event()
+
+        def subp(args, **kwargs):
+            keytype = args[2]
+            started.append(keytype)
+            if len(started) == len(keytypes):
+                all_started.set()
+            # only returns early if every generation runs at the same time
+            all_started.wait(5)
+            if not all_started.is_set():
+                timed_out.append(keytype)
+            self.assertEqual('C', kwargs['env']['LANG'])
+            if keytype == 'dsa':
+                raise util.ProcessExecutionError(
+                    cmd=args, exit_code=1, stderr="unknown key type dsa\n")
+            if keytype == 'ecdsa':
+                raise util.ProcessExecutionError(
+                    cmd=args, exit_code=255, stderr="no entropy\n")
+            util.write_file(args[-1], keytype)
+            return ('generated %s\n' % keytype, '')
+
+        log = mock.Mock()
+        with mock.patch.object(util, 'subp', side_effect=subp):
+            with mock.patch('sys.stdout') as stdout:
+                cc_ssh.generate_host_keys(keytypes, log)
+
+        self.assertEqual([], timed_out)
+        self.assertEqual('rsa', util.load_file(self.keyfile('rsa')))
+        self.assertEqual('ed25519', util.load_file(self.keyfile('ed25519')))
+        self.assertEqual([mock.call('generated rsa\n'),
+                          mock.call('generated ed25519\n')],
+                         stdout.write.call_args_list)
+        log.debug.assert_called_once_with(
+            "ssh-keygen: unknown key type '%s'", 'dsa')
+        self.assertEqual(1, log.warn.call_count)
+        self.assertEqual('ecdsa', log.warn.call_args[0][1])
+
+    def test_existing_keys_kept(self):
+        util.write_file(self.keyfile('rsa'), 'old')
+        with mock.patch.object(util, 'subp') as m_subp:
+            m_subp.return_value = ('', '')
+            cc_ssh.generate_host_keys(['rsa', 'ed25519'], LOG)
+        self.assertEqual(1, m_subp.call_count)
+        self.assertEqual(['ssh-keygen', '-t', 'ed25519', '-N', '', '-f',
+                          self.keyfile('ed25519')], m_subp.call_args[0][0])
+        self.assertEqual('old', util.load_file(self.keyfile('rsa')))
+
+# vi: ts=4 expandtab
@@ -2,14 +2,20 @@ from cloudinit import util
 from cloudinit import log as logging
 from cloudinit.config.cc_write_files import write_files
 
-from ..helpers import FilesystemMockingTestCase
+from ..helpers import FilesystemMockingTestCase, skipIf
 
 import base64
+import bz2
 import gzip
 import shutil
 import six
 import tempfile
 
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
 LOG = logging.getLogger(__name__)
 
 YAML_TEXT = """
@@ -70,14 +76,19 @@ class TestWriteFiles(FilesystemMockingTestCase):
 
         gz_aliases = ('gz', 'gzip')
         gz_b64_aliases = ('gz+base64', 'gzip+base64', 'gz+b64', 'gzip+b64')
+        bz2_aliases = ('bz2', 'bzip2')
+        bz2_b64_aliases = ('bz2+base64', 'bzip2+base64', 'bz2+b64',
+                           'bzip2+b64')
         b64_aliases = ('base64', 'b64')
 
         datum = (("utf8", utf8_valid), ("no-utf8", utf8_invalid))
         for name, data in datum:
             gz = (_gzip_bytes(data), gz_aliases)
             gz_b64 = (base64.b64encode(_gzip_bytes(data)), gz_b64_aliases)
+            bz = (bz2.compress(data), bz2_aliases)
+            bz_b64 = (base64.b64encode(bz2.compress(data)), bz2_b64_aliases)
             b64 = (base64.b64encode(data), b64_aliases)
-            for content, aliases in (gz, gz_b64, b64):
+            for content, aliases in (gz, gz_b64, bz, bz_b64, b64):
                 for enc in aliases:
                     cur = {'content': content,
                            'path': '/tmp/file-%s-%s' % (name, enc),
@@ -92,9 +103,39 @@ class TestWriteFiles(FilesystemMockingTestCase):
 
         # make sure we actually wrote *some* files.
         flen_expected = (
-            len(gz_aliases + gz_b64_aliases + b64_aliases) * len(datum))
+            len(gz_aliases + gz_b64_aliases + bz2_aliases + bz2_b64_aliases +
+                b64_aliases) * len(datum))
         self.assertEqual(len(expected), flen_expected)
 
+    @skipIf(lzma is None, "No lzma module")
+    def test_xz_decodings(self):
+        self.patchUtils(self.tmp)
+        data = b"foobzr"
+        xz = lzma.compress(data)
+        files = [{'content': xz, 'path': '/tmp/xz', 'encoding': 'xz'},
+                 {'content': base64.b64encode(xz), 'path': '/tmp/xz-b64',
+                  'encoding': 'xz+b64'}]
+        write_files("test_xz", files, LOG)
+        for f_info in files:
+            self.assertEqual(util.load_file(f_info['path'], decode=False),
+                             data)
+
+    def test_compressed_too_large(self):
+        self.patchUtils(self.tmp)
+        files = [{'content': _gzip_bytes(b"0" * 1024), 'path': '/tmp/big',
+                  'encoding': 'gzip'}]
+        self.assertRaises(util.DecompressionError, write_files,
+                          "test_too_large", files, LOG, max_size=1023)
+        write_files("test_large", files, LOG, max_size=1024)
+        self.assertEqual(util.load_file('/tmp/big'), "0" * 1024)
+
+    def test_encoding_must_match(self):
+        self.patchUtils(self.tmp)
+        files = [{'content': bz2.compress(b"foobzr"), 'path': '/tmp/bz',
+                  'encoding': 'gzip'}]
+        self.assertRaises(util.DecompressionError, write_files,
+                          "test_mismatch", files, LOG)
+
 
 def _gzip_bytes(data):
     buf = six.BytesIO()
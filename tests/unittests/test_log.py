@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+
+from . import helpers
+
+from cloudinit import log as ci_logging
+
+from six import StringIO
+
+LOG_CFG = """
+[loggers]
+keys=root
+
+[handlers]
+keys=streamHandler
+
+[formatters]
+keys=simpleFormatter
+
+[logger_root]
+level=DEBUG
+handlers=streamHandler
+
+[handler_streamHandler]
+class=StreamHandler
+level=DEBUG
+formatter=simpleFormatter
+args=(sys.stdout,)
+
+[formatter_simpleFormatter]
+format=%(levelname)s: %(message)s
+"""
+
+
+class BlockingHandler(logging.Handler):
+    """A log sink that blocks (like syslog can) until released."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.released = threading.Event()
+        self.messages = []
+
+    def emit(self, record):
+        self.released.wait()
+        self.messages.append(self.format(record))
+
+
+class TestQueuedLogging(helpers.TestCase):
+
+    def setUp(self):
+        super(TestQueuedLogging, self).setUp()
+        self.root = logging.getLogger()
+        self.addCleanup(ci_logging.resetLogging)
+        ci_logging.resetLogging()
+        self.sink = BlockingHandler()
+        # whatever happens, never leave the logging thread stuck
+        self.addCleanup(self.sink.released.set)
+        self.root.handlers = [self.sink]
+        self.root.setLevel(logging.DEBUG)
+
+    def _run_module(self, messages=100):
+        # stand in for a config module that logs as it goes
+        log = ci_logging.getLogger('cloudinit.config.cc_fake')
+        start = time.time()
+        for i in range(messages):
+            log.debug("step %s of %s", i, messages)
+        return time.time() - start
+
+    def test_blocked_sink_does_not_stall(self):
+        ci_logging.queueHandlers(self.root)
+        took = self._run_module()
+        self.assertTrue(took < 2, "logging stalled for %.2fs" % took)
+        self.assertEqual([], self.sink.messages)
+        self.sink.released.set()
+        ci_logging.flushLoggers(self.root)
+        self.assertEqual(["step %s of 100" % i for i in range(100)],
+                         self.sink.messages)
+
+    def test_blocked_sink_stalls_unqueued(self):
+        threading.Timer(0.5, self.sink.released.set).start()
+        self.assertTrue(self._run_module(messages=1) >= 0.4)
+
+    def test_full_queue_drops(self):
+        qh = ci_logging.queueHandlers(self.root, maxsize=10)
+        self._run_module()
+        self.assertTrue(qh.dropped > 0)
+        self.sink.released.set()
+        ci_logging.flushLoggers(self.root)
+        kept = 100 - qh.dropped
+        self.assertEqual(["step %s of 100" % i for i in range(kept)],
+                         self.sink.messages[:-1])
+        self.assertTrue(self.sink.messages[-1].startswith(
+            "%s log messages were dropped" % qh.dropped))
+
+    def test_args_formatted_when_queued(self):
+        ci_logging.queueHandlers(self.root)
+        data = {'a': 1}
+        ci_logging.getLogger().debug("data is %s", data)
+        data['a'] = 2
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError:
+            ci_logging.getLogger().exception("failed")
+        self.sink.released.set()
+        ci_logging.flushLoggers(self.root)
+        self.assertEqual("data is {'a': 1}", self.sink.messages[0])
+        self.assertTrue(self.sink.messages[1].startswith("failed\n"))
+        self.assertIn("RuntimeError: boom", self.sink.messages[1])
+
+    def test_close_drains(self):
+        qh = ci_logging.queueHandlers(self.root)
+        self._run_module(messages=5)
+        self.sink.released.set()
+        ci_logging.resetLogging()
+        self.assertEqual(5, len(self.sink.messages))
+        self.assertNotIn(qh, self.root.handlers)
+
+    def test_flush_and_close_full_queue_blocked_sink(self):
+        qh = ci_logging.queueHandlers(self.root, maxsize=10)
+        self._run_module()
+        self.assertTrue(qh.dropped > 0)
+
+        def flush_and_close():
+            qh.flush(timeout=0.1)
+            qh.close()
+        closer = threading.Thread(target=flush_and_close)
+        closer.daemon = True
+        with helpers.mock.patch.object(ci_logging, 'LOG_QUEUE_FLUSH_TIMEOUT',
+                                       0.1):
+            closer.start()
+            closer.join(10)
+        self.assertFalse(closer.is_alive(), "flush or close hung")
+        self.assertEqual([], self.sink.messages)
+
+    def test_setup_logging_queued(self):
+        self.sink.released.set()
+        stdout = StringIO()
+        with helpers.mock.patch('sys.stdout', stdout):
+            ci_logging.setupLogging({'log_cfgs': [LOG_CFG],
+                                     'log_queue': True})
+            self.assertEqual([ci_logging.QueueHandler],
+                             [type(h) for h in self.root.handlers])
+            self.root.info("hello")
+            ci_logging.flushLoggers(self.root)
+        self.assertEqual("INFO: hello\n", stdout.getvalue())
+
+    def test_setup_logging_unqueued_by_default(self):
+        stdout = StringIO()
+        with helpers.mock.patch('sys.stdout', stdout):
+            ci_logging.setupLogging({'log_cfgs': [LOG_CFG]})
+        self.assertEqual([logging.StreamHandler],
+                         [type(h) for h in self.root.handlers])
+
+# vi: ts=4 expandtab
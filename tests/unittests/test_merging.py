@@ -4,6 +4,7 @@ from cloudinit.handlers import cloud_config
 from cloudinit.handlers import (CONTENT_START, CONTENT_END)
 
 from cloudinit import helpers as c_helpers
+from cloudinit import mergers
 from cloudinit import util
 
 import collections
@@ -135,6 +136,27 @@ class TestSimpleRun(helpers.ResourceUsingTestCase):
             d = util.mergemanydict(test)
             self.assertEquals(c, d)
 
+    def test_constructed_mergers_shared(self):
+        spec = mergers.string_extract_mergers("list(append)+dict()+str()")
+        merger = mergers.construct(spec)
+        self.assertIs(merger, mergers.construct(
+            mergers.string_extract_mergers("list(append)+dict()+str()")))
+        self.assertIsNot(merger, mergers.construct(
+            mergers.string_extract_mergers("list()+dict()+str()")))
+
+    def test_cached_engine_matches_fresh_construct(self):
+        spec = mergers.string_extract_mergers(
+            "list(append,recurse_dict)+dict(recurse_array)+str(append)")
+        cached = mergers.construct(spec)
+        for i in range(1, 20):
+            srcs = [make_dict(5, i * j) for j in range(1, 10)]
+            expected = {}
+            merged = {}
+            for src in srcs:
+                expected = mergers._construct(spec).merge(expected, src)
+                merged = cached.merge(merged, src)
+            self.assertEqual(expected, merged)
+
     def test_merge_cc_samples(self):
         tests = self._load_merge_files()
         paths = c_helpers.Paths({})
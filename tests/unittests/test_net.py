@@ -4,10 +4,20 @@ from .helpers import TestCase
 
 import base64
 import copy
+import errno
 import io
 import gzip
 import json
 import os
+import shutil
+import tempfile
+
+from six.moves import builtins
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
 
 DHCP_CONTENT_1 = """
 DEVICE='eth0'
@@ -125,3 +135,156 @@ def _gzip_data(data):
         gzfp.write(data)
         gzfp.close()
         return iobuf.getvalue()
+
+
+class TestNetDevSnapshot(TestCase):
+
+    def setUp(self):
+        super(TestNetDevSnapshot, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.sys_class_net = os.path.join(self.tmp, 'class', 'net') + '/'
+        for patcher in (
+                mock.patch.object(net, 'SYS_CLASS_NET', self.sys_class_net),
+                mock.patch.object(net, '_NETDEV_SNAPSHOT', None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        os.makedirs(self.sys_class_net)
+        util.write_file(os.path.join(self.sys_class_net, 'bonding_masters'),
+                        '')
+
+    def add_dev(self, name, physical=True, wireless=False, **attrs):
+        for (attr, value) in attrs.items():
+            util.write_file(net.sys_dev_path(name, attr), "%s\n" % value)
+        util.ensure_dir(net.sys_dev_path(name))
+        if physical:
+            util.ensure_dir(net.sys_dev_path(name, 'device'))
+        if wireless:
+            util.ensure_dir(net.sys_dev_path(name, 'wireless'))
+
+    def test_helpers(self):
+        self.add_dev('eth0', address='aa:bb:cc:dd:ee:00', carrier=1,
+                     operstate='up', iflink=2)
+        self.add_dev('wlan0', wireless=True, carrier=1, operstate='down',
+                     iflink=3)
+        self.add_dev('veth0', physical=False, operstate='unknown')
+        self.assertEqual(['eth0', 'veth0', 'wlan0'],
+                         sorted(net.get_devicelist()))
+        self.assertTrue(net.is_up('eth0'))
+        self.assertFalse(net.is_up('wlan0'))
+        self.assertTrue(net.is_up('veth0'))
+        self.assertTrue(net.is_physical('eth0'))
+        self.assertFalse(net.is_physical('veth0'))
+        self.assertTrue(net.is_wireless('wlan0'))
+        self.assertFalse(net.is_wireless('eth0'))
+        self.assertTrue(net.is_connected('eth0'))
+        self.assertTrue(net.is_connected('wlan0'))
+        self.assertFalse(net.is_connected('veth0'))
+        self.assertTrue(net.is_present('veth0'))
+        self.assertFalse(net.is_present('eth9'))
+        self.assertEqual('aa:bb:cc:dd:ee:00',
+                         net.sys_netdev_info('eth0', 'address'))
+        self.assertEqual('aa:bb:cc:dd:ee:00',
+                         net.read_sys_net('eth0', 'address'))
+        self.assertFalse(net.read_sys_net('veth0', 'carrier', enoent=False))
+        self.assertRaises(OSError, net.sys_netdev_info, 'veth0', 'carrier')
+        self.assertRaises(OSError, net.sys_netdev_info, 'eth9', 'address')
+
+    def test_unreadable_attr(self):
+        self.add_dev('eth0', carrier=1)
+        snapshot = net.get_netdev_snapshot()
+        snapshot.devices['eth0']['attrs']['carrier'] = errno.EINVAL
+        self.assertRaises(IOError, net.read_sys_net, 'eth0', 'carrier')
+        self.assertRaises(IOError, net.sys_netdev_info, 'eth0', 'carrier')
+
+    def test_uncovered_reads_are_live(self):
+        self.add_dev('eth0', operstate='up', mtu=1500)
+        net.get_netdev_snapshot()
+        self.add_dev('eth1', operstate='down')
+        self.assertEqual('1500', net.read_sys_net('eth0', 'mtu'))
+        self.assertFalse(net.is_up('eth1'))
+        self.assertTrue(net.is_present('eth1'))
+
+    def test_refresh(self):
+        self.add_dev('eth0', operstate='down')
+        self.assertFalse(net.is_up('eth0'))
+        util.write_file(net.sys_dev_path('eth0', 'operstate'), 'up\n')
+        self.assertFalse(net.is_up('eth0'))
+        net.refresh_netdev_snapshot()
+        self.assertTrue(net.is_up('eth0'))
+
+    def test_fallback_config_reads_each_file_once(self):
+        for i in range(50):
+            self.add_dev('veth%s' % i, physical=False, carrier=0,
+                         dormant=0, operstate='lowerlayerdown',
+                         address='aa:bb:cc:dd:ee:%02x' % i)
+        self.add_dev('eth1', address='aa:bb:cc:dd:ee:ff', carrier=1,
+                     dormant=0, operstate='up')
+        with mock.patch.object(builtins, 'open', wraps=open) as m_open:
+            nconf = net.generate_fallback_config()
+        self.assertEqual('eth1', nconf['config'][0]['name'])
+        self.assertEqual('aa:bb:cc:dd:ee:ff',
+                         nconf['config'][0]['mac_address'])
+        self.assertEqual(51 * 4, m_open.call_count)
+
+
+class TestRenderNetworkState(TestCase):
+
+    def setUp(self):
+        super(TestRenderNetworkState, self).setUp()
+        self.target = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.target)
+        self.ns = net.parse_net_config_data({
+            'version': 1,
+            'config': [
+                {'type': 'physical', 'name': 'eth0',
+                 'mac_address': 'aa:bb:cc:dd:ee:00',
+                 'subnets': [{'type': 'dhcp'}]},
+                {'type': 'physical', 'name': 'eth1',
+                 'mac_address': 'aa:bb:cc:dd:ee:01',
+                 'subnets': [{'type': 'static', 'address': '10.0.0.2/24'}]},
+            ]})
+
+    def rendered(self):
+        found = {}
+        for (root, _dirs, files) in os.walk(self.target):
+            for fname in files:
+                path = os.path.join(root, fname)
+                found[os.path.relpath(path, self.target)] = (
+                    util.load_file(path), os.stat(path).st_ino)
+        return found
+
+    def test_rerender_unchanged(self):
+        self.assertTrue(net.render_network_state(self.target, self.ns))
+        before = self.rendered()
+        self.assertEqual(
+            ['etc/network/interfaces',
+             'etc/systemd/network/50-cloud-init-eth0.link',
+             'etc/systemd/network/50-cloud-init-eth1.link',
+             'etc/udev/rules.d/70-persistent-net.rules'],
+            sorted(before))
+        with mock.patch.object(util, 'write_file') as m_write:
+            self.assertFalse(net.render_network_state(self.target, self.ns))
+        self.assertEqual(0, m_write.call_count)
+        self.assertEqual(before, self.rendered())
+
+    def test_only_changed_files_rewritten(self):
+        net.render_network_state(self.target, self.ns)
+        self.ns['interfaces']['eth1']['mac_address'] = 'aa:bb:cc:dd:ee:02'
+        with mock.patch.object(util, 'write_file',
+                               wraps=util.write_file) as m_write:
+            self.assertTrue(net.render_network_state(self.target, self.ns))
+        written = sorted(os.path.relpath(call[0][0], self.target)
+                         for call in m_write.call_args_list)
+        self.assertEqual(
+            ['etc/systemd/network/50-cloud-init-eth1.link',
+             'etc/udev/rules.d/70-persistent-net.rules'], written)
+
+    def test_stale_links_removed(self):
+        net.render_network_state(self.target, self.ns)
+        del self.ns['interfaces']['eth1']
+        self.assertTrue(net.render_systemd_links(self.target, self.ns))
+        self.assertEqual(
+            ['etc/systemd/network/50-cloud-init-eth0.link'],
+            sorted(f for f in self.rendered() if f.endswith('.link')))
+        self.assertFalse(net.render_systemd_links(self.target, self.ns))
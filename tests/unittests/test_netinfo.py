@@ -0,0 +1,210 @@
+import os
+import shutil
+import socket
+import struct
+import tempfile
+
+from . import helpers
+
+from cloudinit.net import netlink
+from cloudinit import netinfo
+from cloudinit import util
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+# What the recorded dumps (and /proc/net files) in tests/data/netinfo
+# describe, as ifconfig -a, netstat -rn and ip -6 route would show it.
+EXPECTED_NETDEV = {
+    'eth0': {'addr': '192.0.2.2', 'addr6': 'fd00::2/64',
+             'bcast': '192.0.2.255', 'hwaddr': '02:fc:00:00:00:01',
+             'mask': '255.255.255.0', 'scope6': 'global', 'up': True},
+    'ifb0': {'addr': '', 'bcast': '', 'hwaddr': '96:63:9b:48:14:65',
+             'mask': '', 'up': False},
+    'ifb1': {'addr': '', 'bcast': '', 'hwaddr': '82:6a:37:67:03:6b',
+             'mask': '', 'up': False},
+    'lo': {'addr': '127.0.0.1', 'addr6': '::1/128', 'bcast': '',
+           'hwaddr': '', 'mask': '255.0.0.0', 'scope6': 'host',
+           'up': True},
+}
+
+EXPECTED_ROUTES = {
+    'ipv4': [
+        {'destination': '0.0.0.0', 'gateway': '192.0.2.1',
+         'genmask': '0.0.0.0', 'flags': 'UG', 'metric': '0', 'ref': '0',
+         'use': '0', 'iface': 'eth0'},
+        {'destination': '192.0.2.0', 'gateway': '0.0.0.0',
+         'genmask': '255.255.255.0', 'flags': 'U', 'metric': '0',
+         'ref': '0', 'use': '0', 'iface': 'eth0'},
+    ],
+    'ipv6': [
+        {'destination': 'fd00::/64', 'gateway': '::', 'flags': 'U',
+         'metric': '256', 'ref': '0', 'use': '0', 'iface': 'eth0'},
+        {'destination': 'fe80::/64', 'gateway': '::', 'flags': 'U',
+         'metric': '256', 'ref': '0', 'use': '0', 'iface': 'eth0'},
+        {'destination': '::/0', 'gateway': 'fd00::1', 'flags': 'UG',
+         'metric': '1024', 'ref': '0', 'use': '0', 'iface': 'eth0'},
+    ],
+}
+
+# What SIOCGIFADDR and friends answer for each device
+IOCTL_IPV4 = {
+    ('eth0', netinfo.SIOCGIFADDR): '192.0.2.2',
+    ('eth0', netinfo.SIOCGIFNETMASK): '255.255.255.0',
+    ('eth0', netinfo.SIOCGIFBRDADDR): '192.0.2.255',
+    ('lo', netinfo.SIOCGIFADDR): '127.0.0.1',
+    ('lo', netinfo.SIOCGIFNETMASK): '255.0.0.0',
+    ('lo', netinfo.SIOCGIFBRDADDR): '0.0.0.0',
+}
+
+SYSFS = {
+    'eth0': ('0x1003', '02:fc:00:00:00:01'),
+    'ifb0': ('0x82', '96:63:9b:48:14:65'),
+    'ifb1': ('0x82', '82:6a:37:67:03:6b'),
+    'lo': ('0x9', '00:00:00:00:00:00'),
+}
+
+
+def _no_subp(*args, **kwargs):
+    raise AssertionError("Unexpected subp(%s, %s)" % (args, kwargs))
+
+
+class NetinfoTestCase(helpers.ResourceUsingTestCase):
+
+    def setUp(self):
+        super(NetinfoTestCase, self).setUp()
+        patcher = mock.patch.object(util, 'subp', side_effect=_no_subp)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def recorded(self, name):
+        with open(self.resourceLocation(os.path.join('netinfo', name)),
+                  'rb') as fh:
+            return fh.read()
+
+    def recorded_dump(self, msg_type, family=socket.AF_UNSPEC):
+        if msg_type == netlink.RTM_GETLINK:
+            return self.recorded('netlink-links')
+        elif msg_type == netlink.RTM_GETADDR:
+            return self.recorded('netlink-addrs')
+        elif family == socket.AF_INET:
+            return self.recorded('netlink-routes4')
+        return self.recorded('netlink-routes6')
+
+
+class TestNetlinkParsing(NetinfoTestCase):
+
+    def test_links(self):
+        links = netlink.parse_links(self.recorded('netlink-links'))
+        self.assertEqual(['lo', 'ifb0', 'ifb1', 'eth0'],
+                         [link['name'] for link in links])
+        self.assertEqual([1, 2, 3, 4], [link['index'] for link in links])
+        self.assertEqual([True, False, False, True],
+                         [link['up'] for link in links])
+        self.assertEqual('02:fc:00:00:00:01', links[3]['address'])
+        self.assertEqual(1400, links[3]['mtu'])
+
+    def test_addrs(self):
+        addrs = netlink.parse_addrs(self.recorded('netlink-addrs'))
+        self.assertEqual(
+            [(4, '192.0.2.2', 24, '192.0.2.255'), (4, 'fd00::2', 64, None),
+             (4, 'fe80::fc:ff:fe00:1', 64, None)],
+            [(a['index'], a['address'], a['prefixlen'], a['broadcast'])
+             for a in addrs if a['index'] == 4])
+
+    def test_routes(self):
+        routes = netlink.parse_routes(self.recorded('netlink-routes4'))
+        main = [r for r in routes if r['table'] == netlink.RT_TABLE_MAIN]
+        self.assertEqual([(None, 0, '192.0.2.1'), ('192.0.2.0', 24, None)],
+                         [(r['dst'], r['dst_len'], r['gateway'])
+                          for r in main])
+
+    def test_error_message(self):
+        error = netlink.NLMSGHDR.pack(20, netlink.NLMSG_ERROR, 0, 1, 0)
+        error += struct.pack("=i", -1)
+        self.assertRaises(netlink.NetlinkError, netlink.parse_messages,
+                          error)
+        # an error of 0 is an acknowledgement
+        ack = error[:-4] + struct.pack("=i", 0)
+        self.assertEqual([netlink.NLMSG_ERROR],
+                         [t for (t, _p) in netlink.parse_messages(ack)])
+
+    def test_truncated(self):
+        data = self.recorded('netlink-links')
+        self.assertRaises(netlink.NetlinkError, netlink.parse_messages,
+                          data[:-10])
+
+
+class TestNetinfo(NetinfoTestCase):
+
+    def setUp(self):
+        super(TestNetinfo, self).setUp()
+        patcher = mock.patch.object(netlink, 'dump',
+                                    side_effect=self.recorded_dump)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_netdev_info(self):
+        self.assertEqual(EXPECTED_NETDEV, netinfo.netdev_info())
+
+    def test_netdev_info_empty(self):
+        devs = netinfo.netdev_info(empty=".")
+        self.assertEqual(".", devs['ifb0']['addr'])
+        self.assertEqual(".", devs['lo']['hwaddr'])
+
+    def test_route_info(self):
+        self.assertEqual(EXPECTED_ROUTES, netinfo.route_info())
+
+    def test_getgateway(self):
+        self.assertEqual("192.0.2.1[eth0]", netinfo.getgateway())
+
+    def test_debug_info(self):
+        info = netinfo.debug_info()
+        self.assertIn("fd00::2/64", info)
+        self.assertIn("| Route | Destination | Gateway | Interface | Flags |",
+                      info)
+        self.assertNotIn("failed", info)
+
+
+class TestNetinfoProcFallback(NetinfoTestCase):
+
+    def setUp(self):
+        super(TestNetinfoProcFallback, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        proc_net = os.path.join(self.tmp, 'proc', 'net')
+        for name in ('dev', 'route', 'ipv6_route', 'if_inet6'):
+            util.write_file(os.path.join(proc_net, name),
+                            self.recorded('proc-net-%s' % name))
+        sys_class_net = os.path.join(self.tmp, 'sys', 'class', 'net')
+        for (dev, (flags, address)) in SYSFS.items():
+            util.write_file(os.path.join(sys_class_net, dev, 'flags'),
+                            flags + "\n")
+            util.write_file(os.path.join(sys_class_net, dev, 'address'),
+                            address + "\n")
+        for patcher in (
+                mock.patch.object(netinfo, 'PROC_NET', proc_net),
+                mock.patch.object(netinfo, 'SYS_CLASS_NET', sys_class_net),
+                mock.patch.object(netinfo, '_ipv4_ioctl',
+                                  lambda name, req: IOCTL_IPV4.get(
+                                      (name, req))),
+                mock.patch.object(netlink, 'dump', side_effect=socket.error(
+                    "Address family not supported by protocol"))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_netdev_info(self):
+        self.assertEqual(EXPECTED_NETDEV, netinfo.netdev_info())
+
+    def test_route_info(self):
+        self.assertEqual(EXPECTED_ROUTES, netinfo.route_info())
+
+    def test_no_netlink_socket(self):
+        with mock.patch.object(netlink, 'dump', side_effect=AttributeError(
+                "'module' object has no attribute 'AF_NETLINK'")):
+            self.assertEqual(EXPECTED_NETDEV, netinfo.netdev_info())
+            self.assertEqual(EXPECTED_ROUTES, netinfo.route_info())
+
+# vi: ts=4 expandtab
@@ -0,0 +1,138 @@
+import os
+import pstats
+import shutil
+import tempfile
+
+from . import helpers
+
+from cloudinit import profiling
+from cloudinit.reporting import events
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+def _busy(count):
+    return sum([i * i for i in range(count)])
+
+
+class TestShouldProfile(helpers.TestCase):
+
+    def test_not_configured(self):
+        self.assertFalse(profiling.should_profile({}, 'apt-configure'))
+        self.assertFalse(profiling.should_profile(
+            {'profile_modules': []}, 'apt-configure'))
+
+    def test_all(self):
+        for cfg in ({'profile_modules': 'all'}, {'profile_modules': True},
+                    {'profile_modules': ['ssh', 'all']}):
+            self.assertTrue(profiling.should_profile(cfg, 'apt-configure'))
+
+    def test_named(self):
+        cfg = {'profile_modules': ['apt-configure', 'cc_users_groups']}
+        self.assertTrue(profiling.should_profile(cfg, 'apt-configure'))
+        self.assertTrue(profiling.should_profile(cfg, 'apt_configure'))
+        self.assertTrue(profiling.should_profile(cfg, 'users-groups'))
+        self.assertFalse(profiling.should_profile(cfg, 'ssh'))
+
+
+class TestModuleProfiler(helpers.TestCase):
+
+    def setUp(self):
+        super(TestModuleProfiler, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.profile_dir = os.path.join(self.tmp, 'profiles')
+
+    def test_profile_written(self):
+        profiler = profiling.ModuleProfiler('apt-configure', self.profile_dir)
+        self.assertEqual(_busy(1000), profiler.wrap(_busy)(1000))
+        self.assertEqual(1, len(profiler.files))
+        fn = profiler.files[0]
+        self.assertTrue(os.path.basename(fn).startswith('apt_configure-'))
+        self.assertTrue(fn.endswith(profiling.PSTATS_EXT))
+        stats = pstats.Stats(fn)
+        self.assertIn('_busy', [key[2] for key in stats.stats])
+        self.assertIn('apt-configure took', profiler.summary)
+        self.assertIn('_busy (test_profiling.py:', profiler.summary)
+
+    def test_profile_written_on_failure(self):
+        def fail():
+            raise RuntimeError("broken module")
+
+        profiler = profiling.ModuleProfiler('fail', self.profile_dir)
+        self.assertRaises(RuntimeError, profiler.wrap(fail))
+        self.assertTrue(os.path.isfile(profiler.files[0]))
+        self.assertIsNotNone(profiler.summary)
+
+    def test_profiles_in_same_second_kept_apart(self):
+        files = []
+        with mock.patch.object(profiling.time, 'strftime',
+                               return_value='20160101000000'):
+            for _i in range(2):
+                profiler = profiling.ModuleProfiler(
+                    'ssh', self.profile_dir, stage='cloud_init_modules')
+                profiler.wrap(_busy)(10)
+                files.extend(profiler.files)
+        self.assertEqual(2, len(set(files)))
+        self.assertEqual(
+            'ssh-cloud_init_modules-20160101000000-%s.pstats' % os.getpid(),
+            os.path.basename(files[0]))
+        for fn in files:
+            self.assertTrue(os.path.isfile(fn))
+
+    @helpers.skipIf(profiling.tracemalloc is None, "No tracemalloc")
+    def test_memory(self):
+        profiler = profiling.ModuleProfiler('mem', self.profile_dir,
+                                            memory=True)
+        profiler.wrap(_busy)(10000)
+        self.assertEqual(2, len(profiler.files))
+        self.assertTrue(profiler.files[1].endswith(
+            profiling.TRACEMALLOC_EXT))
+        snapshot = profiling.tracemalloc.Snapshot.load(profiler.files[1])
+        self.assertNotEqual([], snapshot.statistics('lineno'))
+        self.assertIn('peak memory', profiler.summary)
+        self.assertFalse(profiling.tracemalloc.is_tracing())
+
+    def test_report(self):
+        profiler = profiling.ModuleProfiler('apt-configure', self.profile_dir)
+        profiler.wrap(_busy)(10)
+        with mock.patch.object(events, 'report_event') as report_event:
+            profiler.report(None)
+        reported = [call[0][0] for call in report_event.call_args_list]
+        self.assertEqual(['profile-apt-configure'] * 2,
+                         [event.name for event in reported])
+        self.assertEqual(profiler.summary, reported[0].description)
+
+
+class TestAggregateProfiles(helpers.TestCase):
+
+    def setUp(self):
+        super(TestAggregateProfiles, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_aggregate_across_instances(self):
+        for iid in ('i-1', 'i-2'):
+            profile_dir = os.path.join(self.tmp, 'instances', iid, 'profiles')
+            profiling.ModuleProfiler('ssh', profile_dir).wrap(_busy)(10)
+            profiling.ModuleProfiler('apt-configure',
+                                     profile_dir).wrap(_busy)(10)
+        self.assertEqual(4, len(profiling.find_profiles(self.tmp)))
+        files = profiling.find_profiles(self.tmp, 'apt-configure')
+        self.assertEqual(2, len(files))
+
+        report = profiling.aggregate_profiles(files)
+        self.assertIn('_busy', report)
+        merged = pstats.Stats(*files)
+        calls = [info[1] for (key, info) in merged.stats.items()
+                 if key[2] == '_busy']
+        self.assertEqual([2], calls)
+
+    def test_no_profiles(self):
+        self.assertEqual([], profiling.find_profiles(self.tmp))
+        self.assertEqual("", profiling.aggregate_profiles([]))
+
+# vi: ts=4 expandtab
@@ -79,3 +79,38 @@ class TestSimpleRun(helpers.FilesystemMockingTestCase):
         self.assertIn('write-files', which_ran)
         contents = util.load_file('/etc/blah.ini')
         self.assertEquals(contents, 'blah')
+
+    def test_profiled_module(self):
+        new_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, new_root)
+        self.replicateTestRoot('simple_ubuntu', new_root)
+        cfg = {
+            'datasource_list': ['None'],
+            'write_files': [{'path': '/etc/blah.ini', 'content': 'blah'}],
+            'cloud_init_modules': ['write-files', 'set_hostname'],
+            'profile_modules': ['write-files'],
+        }
+        util.write_file(os.path.join(new_root, 'etc', 'cloud', 'cloud.cfg'),
+                        util.yaml_dumps(cfg))
+        self._patchIn(new_root)
+
+        initer = stages.Init()
+        initer.read_cfg()
+        initer.initialize()
+        initer.fetch()
+        initer.instancify()
+        initer.update()
+        initer.cloudify().run('consume_data',
+                              initer.consume_data,
+                              args=[PER_INSTANCE],
+                              freq=PER_INSTANCE)
+
+        mods = stages.Modules(initer)
+        (which_ran, failures) = mods.run_section('cloud_init_modules')
+        self.assertEqual([], failures)
+        self.assertIn('write-files', which_ran)
+        profiles = os.listdir(os.path.join(new_root, 'var', 'lib', 'cloud',
+                                           'instance', 'profiles'))
+        self.assertEqual(1, len(profiles))
+        self.assertTrue(profiles[0].startswith(
+            'write_files-cloud_init_modules-'))
@@ -0,0 +1,51 @@
+import glob
+import os
+
+import yaml
+
+from cloudinit import safeyaml
+from . import helpers
+
+NO_LIBYAML = safeyaml.Loader is safeyaml._CustomSafeLoader
+
+
+def _topd():
+    return os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+
+
+class TestLoaderConformance(helpers.ResourceUsingTestCase):
+    """The libyaml loader has to give exactly what the pure one does."""
+
+    def _check(self, blob):
+        self.assertEqual(safeyaml.load(blob, safeyaml._CustomSafeLoader),
+                         safeyaml.load(blob, safeyaml._CustomCSafeLoader))
+
+    @helpers.skipIf(NO_LIBYAML, "pyyaml built without libyaml")
+    def test_real_configs(self):
+        topd = _topd()
+        fnames = [os.path.join(topd, 'config', 'cloud.cfg')]
+        fnames.extend(glob.glob(os.path.join(topd, 'config', 'cloud.cfg.d',
+                                             '*.cfg')))
+        fnames.extend(glob.glob(os.path.join(topd, 'doc', 'examples',
+                                             'cloud-config*.txt')))
+        fnames.extend(glob.glob(os.path.join(self.resourceLocation(),
+                                             'merge_sources', '*.yaml')))
+        self.assertTrue(len(fnames) > 10)
+        for fname in fnames:
+            with open(fname, 'r') as fh:
+                self._check(fh.read())
+
+    @helpers.skipIf(NO_LIBYAML, "pyyaml built without libyaml")
+    def test_python_unicode(self):
+        blob = "a: !!python/unicode 'b'\nc: [!!python/unicode d]\n"
+        self.assertEqual({'a': 'b', 'c': ['d']},
+                         safeyaml.load(blob, safeyaml._CustomCSafeLoader))
+        self._check(blob)
+
+    @helpers.skipIf(NO_LIBYAML, "pyyaml built without libyaml")
+    def test_unsafe_rejected(self):
+        blob = "!!python/tuple [1, 2]\n"
+        for loader in (safeyaml._CustomSafeLoader,
+                       safeyaml._CustomCSafeLoader):
+            self.assertRaises(yaml.YAMLError, safeyaml.load, blob, loader)
@@ -2,6 +2,13 @@ from mock import patch
 
 from . import helpers as test_helpers
 from cloudinit import ssh_util
+from cloudinit import util
+
+import collections
+import os
+import random
+import shutil
+import tempfile
 
 
 VALID_CONTENT = {
@@ -168,4 +175,143 @@ class TestParseSSHConfig(test_helpers.TestCase):
         self.assertEqual('foo', ret[0].key)
         self.assertEqual('bar', ret[0].value)
 
+
+def _quadratic_update(old_entries, keys):
+    # update_authorized_keys as it was before keys were indexed
+    to_add = list(keys)
+    for i in range(0, len(old_entries)):
+        ent = old_entries[i]
+        if not ent.valid():
+            continue
+        for k in keys:
+            if k.base64 == ent.base64:
+                ent = k
+                if k in to_add:
+                    to_add.remove(k)
+        old_entries[i] = ent
+    for key in to_add:
+        old_entries.append(key)
+    lines = [str(b) for b in old_entries]
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def _key_lines(count, prefix, rng=None):
+    lines = []
+    for i in range(count):
+        base64 = 'AAAA%s%s' % (prefix, i)
+        if rng is not None:
+            base64 = 'AAAAkey%s' % rng.randint(0, 20)
+        options = ''
+        if i % 3 == 0:
+            options = 'no-pty,command="echo %s" ' % i
+        lines.append('%sssh-rsa %s %s-%s' % (options, base64, prefix, i))
+    return lines
+
+
+class TestUpdateAuthorizedKeys(test_helpers.TestCase):
+
+    def _parse(self, lines, options=None):
+        parser = ssh_util.AuthKeyLineParser()
+        return [parser.parse(line, options=options) for line in lines]
+
+    def test_replaces_in_place_and_appends_in_order(self):
+        old = self._parse(['# managed by hand', 'ssh-rsa AAAA1 one',
+                           'garbage line', 'ssh-rsa AAAA2 two',
+                           'ssh-rsa AAAA1 one-again'])
+        new = self._parse(['ssh-rsa AAAA3 three', 'ssh-rsa AAAA1 first',
+                           'ssh-rsa AAAA4 four', 'ssh-rsa AAAA1 last'],
+                          options='no-pty')
+        content = ssh_util.update_authorized_keys(old, new)
+        self.assertEqual(
+            ['# managed by hand', 'no-pty ssh-rsa AAAA1 last',
+             'garbage line', 'ssh-rsa AAAA2 two',
+             'no-pty ssh-rsa AAAA1 last', 'no-pty ssh-rsa AAAA3 three',
+             'no-pty ssh-rsa AAAA4 four', ''], content.split('\n'))
+
+    def test_same_as_quadratic_merge(self):
+        rng = random.Random(42)
+        for _round in range(50):
+            old_lines = _key_lines(rng.randint(0, 15), 'old', rng)
+            old_lines.insert(rng.randint(0, len(old_lines)), '# comment')
+            old_lines.append('not a key')
+            new_lines = _key_lines(rng.randint(0, 15), 'new', rng)
+            options = rng.choice([None, 'no-agent-forwarding'])
+            expected = _quadratic_update(self._parse(old_lines),
+                                         self._parse(new_lines, options))
+            self.assertEqual(expected, ssh_util.update_authorized_keys(
+                self._parse(old_lines), self._parse(new_lines, options)))
+
+    def test_ten_thousand_keys(self):
+        # half of the keys pushed are already authorized
+        old = self._parse(_key_lines(10000, 'key'))
+        new = self._parse(_key_lines(10000, 'key')[5000:] +
+                          _key_lines(5000, 'more'))
+        content = ssh_util.update_authorized_keys(old, new)
+        lines = content.splitlines()
+        self.assertEqual(15000, len(lines))
+        self.assertEqual(15000, len(set(line.split()[-2] for line in lines)))
+
+
+FakePwEnt = collections.namedtuple('FakePwEnt', 'pw_dir pw_uid pw_gid')
+
+
+class TestSetupUsersKeys(test_helpers.TestCase):
+
+    def setUp(self):
+        super(TestSetupUsersKeys, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.sshd_config = os.path.join(self.tmp, 'sshd_config')
+        ssh_util._AUTH_KEYS_FILE_SETTINGS.clear()
+        self.addCleanup(ssh_util._AUTH_KEYS_FILE_SETTINGS.clear)
+
+        def users_ssh_info(username):
+            home = os.path.join(self.tmp, 'home', username)
+            return (os.path.join(home, '.ssh'), FakePwEnt(home, 1000, 1000))
+        for patcher in (
+                patch.object(ssh_util, 'DEF_SSHD_CFG', self.sshd_config),
+                patch.object(ssh_util, 'users_ssh_info', users_ssh_info),
+                patch.object(util, 'chownbyid')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def keys_file(self, username):
+        return os.path.join(self.tmp, 'home', username, '.ssh',
+                            'authorized_keys')
+
+    def test_users_keys_merged(self):
+        util.write_file(self.keys_file('root'), 'ssh-rsa AAAA1 old\n')
+        with patch.object(util, 'write_file',
+                          side_effect=util.write_file) as write_file:
+            ssh_util.setup_users_keys([
+                (['ssh-rsa AAAA1 new', 'ssh-rsa AAAA2 two'], 'root',
+                 'no-pty'),
+                (['ssh-rsa AAAA3 ubuntu'], 'ubuntu', None),
+                (['ssh-rsa AAAA2 two'], 'root', None),
+            ])
+        # every file is written once
+        self.assertEqual(2, write_file.call_count)
+        self.assertEqual('no-pty ssh-rsa AAAA1 new\nssh-rsa AAAA2 two\n',
+                         util.load_file(self.keys_file('root')))
+        self.assertEqual('ssh-rsa AAAA3 ubuntu\n',
+                         util.load_file(self.keys_file('ubuntu')))
+
+    def test_authorized_keys_file_setting_cached(self):
+        util.write_file(self.sshd_config, 'AuthorizedKeysFile .ssh/keys\n')
+        with patch.object(ssh_util, 'parse_ssh_config_map',
+                          side_effect=ssh_util.parse_ssh_config_map) as m:
+            for user in ('one', 'two'):
+                self.assertEqual(
+                    os.path.join(self.tmp, 'home', user, '.ssh/keys'),
+                    ssh_util.authorized_keys_path(user))
+            self.assertEqual(1, m.call_count)
+
+            # a changed sshd_config is read again
+            util.write_file(self.sshd_config,
+                            'AuthorizedKeysFile /etc/ssh/keys/%u\n')
+            self.assertEqual('/etc/ssh/keys/one',
+                             ssh_util.authorized_keys_path('one'))
+            self.assertEqual(2, m.call_count)
+
 # vi: ts=4 expandtab
@@ -19,9 +19,18 @@
 from __future__ import print_function
 
 from . import helpers as test_helpers
+import os
+import shutil
+import tempfile
 import textwrap
 
 from cloudinit import templater
+from cloudinit import util
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
 
 try:
     import Cheetah
@@ -117,3 +126,73 @@ $a,$b'''
                                           {'mirror': mirror,
                                            'codename': codename})
         self.assertEqual(ex_data, out_data)
+
+
+@test_helpers.skipIf(not templater.JINJA_AVAILABLE, "No jinja2")
+class TestTemplateCache(test_helpers.TestCase):
+    blob = "## template:jinja\n{{a}},{{b}}\n"
+
+    def setUp(self):
+        super(TestTemplateCache, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        patcher = mock.patch.object(templater, 'BYTECODE_CACHE_DIR',
+                                    os.path.join(self.tmp, 'cache'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        templater.clear_cache()
+        self.addCleanup(templater.clear_cache)
+
+    def test_compiled_once(self):
+        with mock.patch.object(templater, '_compile_jinja',
+                               wraps=templater._compile_jinja) as compiler:
+            for i in range(3):
+                self.assertEqual("%s,2\n" % i, templater.render_string(
+                    self.blob, {"a": i, "b": 2}))
+        self.assertEqual(1, compiler.call_count)
+
+    def test_cache_bounded(self):
+        with mock.patch.object(templater, 'TEMPLATE_CACHE_MAX_ENTRIES', 2):
+            for i in range(5):
+                blob = self.blob.replace(",", " %s " % i)
+                self.assertEqual("1 %s 2\n" % i, templater.render_string(
+                    blob, {"a": 1, "b": 2}))
+                self.assertTrue(len(templater._TEMPLATES) <= 2)
+                self.assertTrue(
+                    len(templater._get_jinja_env().loader.sources) <= 2)
+
+    def test_undefined_still_strict(self):
+        import jinja2
+        templater.render_string(self.blob, {"a": 1, "b": 2})
+        self.assertRaises(jinja2.UndefinedError, templater.render_string,
+                          self.blob, {"a": 1})
+
+    def test_render_from_file_reads_changes_only(self):
+        fn = os.path.join(self.tmp, 'hosts.tmpl')
+        util.write_file(fn, self.blob)
+        with mock.patch.object(util, 'load_file',
+                               wraps=util.load_file) as load_file:
+            for _i in range(3):
+                self.assertEqual("1,2\n", templater.render_from_file(
+                    fn, {"a": 1, "b": 2}))
+            self.assertEqual(1, load_file.call_count)
+            util.write_file(fn, self.blob.replace(",", " and "))
+            self.assertEqual("1 and 2\n", templater.render_from_file(
+                fn, {"a": 1, "b": 2}))
+            self.assertEqual(2, load_file.call_count)
+
+    def test_bytecode_kept_on_disk(self):
+        import jinja2
+        templater.render_string(self.blob, {"a": 1, "b": 2})
+        self.assertNotEqual([], os.listdir(os.path.join(self.tmp, 'cache')))
+        templater.clear_cache()
+        with mock.patch.object(jinja2.Environment, 'compile') as compile:
+            self.assertEqual("1,2\n", templater.render_string(
+                self.blob, {"a": 1, "b": 2}))
+        self.assertFalse(compile.called)
+
+    def test_no_bytecode_without_parent_dir(self):
+        with mock.patch.object(templater, 'BYTECODE_CACHE_DIR',
+                               os.path.join(self.tmp, 'no', 'cache')):
+            templater.render_string(self.blob, {"a": 1, "b": 2})
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'no')))
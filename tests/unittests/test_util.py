@@ -1,15 +1,19 @@
 from __future__ import print_function
 
+import bz2
+import gzip
 import logging
 import os
 import shutil
 import stat
 import tempfile
+import threading
+import time
 
 import six
 import yaml
 
-from cloudinit import importer, util
+from cloudinit import importer, url_helper, util
 from . import helpers
 
 try:
@@ -17,6 +21,11 @@ try:
 except ImportError:
     import mock
 
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
 
 class FakeSelinux(object):
 
@@ -148,6 +157,45 @@ class TestWriteFile(helpers.TestCase):
         mockobj.assert_called_once_with('selinux')
 
 
+class TestWriteFileIfChanged(helpers.TestCase):
+    def setUp(self):
+        super(TestWriteFileIfChanged, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = os.path.join(self.tmp, "subdir", "NewFile.txt")
+
+    def test_new_file_written(self):
+        self.assertTrue(util.write_file_if_changed(self.path, "Hey there"))
+        self.assertEqual("Hey there", util.load_file(self.path))
+
+    def test_unchanged_file_left_alone(self):
+        util.write_file(self.path, "Hey there")
+        with mock.patch.object(util, 'write_file') as m_write:
+            self.assertFalse(
+                util.write_file_if_changed(self.path, b"Hey there"))
+        self.assertEqual(0, m_write.call_count)
+
+    def test_changed_file_diff_logged(self):
+        util.write_file(self.path, "line1\nline2\n")
+        with mock.patch.object(util.LOG, 'debug') as m_debug:
+            self.assertTrue(
+                util.write_file_if_changed(self.path, "line1\nline3\n"))
+        self.assertEqual("line1\nline3\n", util.load_file(self.path))
+        logged = "\n".join(call[0][0] % call[0][1:]
+                           for call in m_debug.call_args_list)
+        self.assertIn("-line2\n+line3", logged)
+
+    def test_changed_file_diff_not_logged(self):
+        util.write_file(self.path, "password: old\n")
+        with mock.patch.object(util.LOG, 'debug') as m_debug:
+            self.assertTrue(util.write_file_if_changed(
+                self.path, "password: new\n", log_diff=False))
+        self.assertEqual("password: new\n", util.load_file(self.path))
+        logged = "\n".join(call[0][0] % call[0][1:]
+                           for call in m_debug.call_args_list)
+        self.assertNotIn("password", logged)
+
+
 class TestDeleteDirContents(helpers.TestCase):
     def setUp(self):
         super(TestDeleteDirContents, self).setUp()
@@ -263,6 +311,43 @@ class TestLoadYaml(helpers.TestCase):
                                         default=self.mydefault),
                          myobj)
 
+    def test_cached_results_are_copies(self):
+        myyaml = "a: {b: [1, 2]}\n"
+        loaded = util.load_yaml(myyaml)
+        loaded['a']['b'].append(3)
+        self.assertEqual({'a': {'b': [1, 2]}}, util.load_yaml(myyaml))
+
+    def test_cache_bounded(self):
+        with mock.patch.object(util, '_YAML_CACHE', {}):
+            with mock.patch.object(util, 'YAML_CACHE_MAX_ENTRIES', 2):
+                for i in range(5):
+                    self.assertEqual({'a': i}, util.load_yaml("a: %s\n" % i))
+                    self.assertTrue(len(util._YAML_CACHE) <= 2)
+
+    def test_parsed_yaml_shared_through_cache_dir(self):
+        tmpd = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpd)
+        cache_dir = os.path.join(tmpd, 'yaml-cache')
+        myyaml = "shared: [1, {2: three}]\n"
+        with mock.patch.object(util, 'YAML_CACHE_DIR', cache_dir):
+            with mock.patch.object(util, '_YAML_CACHE', {}):
+                loaded = util.load_yaml(myyaml)
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+            # a later stage starts with nothing parsed in memory
+            with mock.patch.object(util, '_YAML_CACHE', {}):
+                with mock.patch.object(util.safeyaml, 'load') as m_load:
+                    self.assertEqual(loaded, util.load_yaml(myyaml))
+        self.assertFalse(m_load.called)
+
+    def test_unmarshallable_not_persisted(self):
+        tmpd = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpd)
+        cache_dir = os.path.join(tmpd, 'yaml-cache')
+        with mock.patch.object(util, 'YAML_CACHE_DIR', cache_dir):
+            loaded = util.load_yaml("when: 2016-01-01\n")
+        self.assertEqual('2016-01-01', str(loaded['when']))
+        self.assertFalse(os.path.exists(cache_dir))
+
 
 class TestMountinfoParsing(helpers.ResourceUsingTestCase):
     def test_invalid_mountinfo(self):
@@ -321,6 +406,42 @@ class TestMountinfoParsing(helpers.ResourceUsingTestCase):
         self.assertEqual(expected, util.parse_mount_info('/run/lock', lines))
 
 
+class TestMountTable(helpers.ResourceUsingTestCase):
+    def setUp(self):
+        super(TestMountTable, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.mountinfo = os.path.join(self.tmp, 'mountinfo')
+        util.write_file(self.mountinfo,
+                        self.readResource('mountinfo_precise_ext4.txt'))
+        self.table = util.MountTable(self.mountinfo)
+        self.addCleanup(self.table.close)
+
+    def test_mounts_from_mountinfo(self):
+        mounted = self.table.mounts()
+        self.assertEqual({'fstype': 'ext4', 'mountpoint': '/boot',
+                          'opts': 'rw,relatime,data=ordered'},
+                         mounted['/dev/md0'])
+        self.assertEqual('/', mounted['/dev/mapper/vg0-root']['mountpoint'])
+
+    def test_parse_skips_bad_lines(self):
+        lines = ["20 1 252:1 / / rw,relatime - ext4",
+                 r"21 20 8:1 / /mnt/a\040b ro - vfat /dev/sdb1 rw,fmask=22"]
+        self.assertEqual(
+            {'/dev/sdb1': {'fstype': 'vfat', 'mountpoint': '/mnt/a b',
+                           'opts': 'ro,fmask=22'}},
+            util.parse_mountinfo_mounts(lines))
+
+    def test_index_is_reused_until_invalidated(self):
+        first = self.table.mounts()
+        util.write_file(self.mountinfo,
+                        self.readResource('mountinfo_raring_btrfs.txt'))
+        # a regular file never signals a change, so this is the cache
+        self.assertIs(first, self.table.mounts())
+        self.table.invalidate()
+        self.assertIn('/dev/vda1', self.table.mounts())
+
+
 class TestReadDMIData(helpers.FilesystemMockingTestCase):
 
     def setUp(self):
@@ -329,6 +450,8 @@ class TestReadDMIData(helpers.FilesystemMockingTestCase):
         self.addCleanup(shutil.rmtree, self.new_root)
         self.patchOS(self.new_root)
         self.patchUtils(self.new_root)
+        self.patched_funcs.enter_context(
+            mock.patch.object(util, '_DMI_SNAPSHOT', None))
 
     def _create_sysfs_parent_directory(self):
         util.ensure_dir(os.path.join('sys', 'class', 'dmi', 'id'))
@@ -395,6 +518,127 @@ class TestReadDMIData(helpers.FilesystemMockingTestCase):
         self._create_sysfs_file(sysfs_key, dmi_value)
         self.assertEqual(expected, util.read_dmi_data(dmi_key))
 
+    def test_sysfs_read_once(self):
+        self._create_sysfs_file('product_name', 'my-product')
+        self._create_sysfs_file('product_uuid', 'my-uuid')
+        self.assertEqual('my-product',
+                         util.read_dmi_data('system-product-name'))
+        with mock.patch.object(util, 'load_file') as m_load_file:
+            self.assertEqual('my-uuid', util.read_dmi_data('system-uuid'))
+            self.assertEqual('my-product',
+                             util.read_dmi_data('system-product-name'))
+        self.assertFalse(m_load_file.called)
+
+    def test_single_dmidecode_dump_used(self):
+        self.patch_mapping({})
+        calls = []
+
+        def _dmidecode_subp(cmd):
+            calls.append(cmd)
+            return (DMIDECODE_DUMP, '')
+
+        self.patched_funcs.enter_context(
+            mock.patch.object(util, 'which', lambda _: '/usr/sbin/dmidecode'))
+        self.patched_funcs.enter_context(
+            mock.patch.object(util, 'subp', _dmidecode_subp))
+        self.assertEqual('QEMU', util.read_dmi_data('system-manufacturer'))
+        self.assertEqual('Standard PC (i440FX + PIIX, 1996)',
+                         util.read_dmi_data('system-product-name'))
+        self.assertEqual('', util.read_dmi_data('chassis-serial-number'))
+        self.assertEqual(1, len(calls))
+
+    def test_parse_dmidecode(self):
+        self.assertEqual({
+            'bios-vendor': 'SeaBIOS',
+            'bios-release-date': '04/01/2014',
+            'system-manufacturer': 'QEMU',
+            'system-product-name': 'Standard PC (i440FX + PIIX, 1996)',
+            'system-uuid': '5E4A3A3B-0B54-4E4A-9BB2-9CEF4AFB3BFA',
+            'chassis-manufacturer': 'QEMU',
+            'chassis-type': 'Other',
+            'chassis-serial-number': '',
+        }, util.parse_dmidecode(DMIDECODE_DUMP))
+
+
+DMIDECODE_DUMP = """\
+# dmidecode 3.0
+Getting SMBIOS data from sysfs.
+SMBIOS 2.8 present.
+
+Handle 0x0000, DMI type 0, 24 bytes
+BIOS Information
+\tVendor: SeaBIOS
+\tRelease Date: 04/01/2014
+\tCharacteristics:
+\t\tBIOS characteristics not supported
+
+Handle 0x0100, DMI type 1, 27 bytes
+System Information
+\tManufacturer: QEMU
+\tProduct Name: Standard PC (i440FX + PIIX, 1996)
+\tUUID: 5E4A3A3B-0B54-4E4A-9BB2-9CEF4AFB3BFA
+
+Handle 0x0300, DMI type 3, 22 bytes
+Chassis Information
+\tManufacturer: QEMU
+\tType: Other
+\tSerial Number: ....
+
+Handle 0x0301, DMI type 3, 22 bytes
+Chassis Information
+\tManufacturer: Another
+"""
+
+
+class TestIsContainer(helpers.FilesystemMockingTestCase):
+
+    def setUp(self):
+        super(TestIsContainer, self).setUp()
+        self.new_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.new_root)
+        self.patchOS(self.new_root)
+        self.patchUtils(self.new_root)
+        self.helper_calls = []
+
+        def _helper_subp(cmd):
+            self.helper_calls.append(cmd)
+            raise util.ProcessExecutionError(exit_code=1)
+
+        for (name, value) in (('_IS_CONTAINER', None),
+                              ('subp', _helper_subp)):
+            self.patched_funcs.enter_context(
+                mock.patch.object(util, name, value))
+
+    def test_detected_from_run_without_helpers(self):
+        util.write_file('/run/systemd/container', 'lxc\n')
+        self.assertTrue(util.is_container())
+        self.assertEqual([], self.helper_calls)
+
+    def test_docker_marker(self):
+        util.write_file('/.dockerenv', '')
+        self.assertTrue(util.is_container())
+
+    def test_helpers_not_run_by_default(self):
+        self.assertFalse(util.is_container())
+        self.assertEqual([], self.helper_calls)
+
+    def test_helpers_are_fallback_when_enabled(self):
+        util.write_file(util.CLOUD_CONFIG + '.d/90-helpers.cfg',
+                        'container_helpers: true\n')
+        self.assertFalse(util.is_container())
+        self.assertEqual(len(util.CONTAINER_TESTS), len(self.helper_calls))
+
+    def test_result_memoized_and_persisted(self):
+        util.ensure_dir('/run/cloud-init')
+        util.write_file('/run/container_type', 'lxc')
+        self.assertTrue(util.is_container())
+        util.del_file('/run/container_type')
+        self.assertTrue(util.is_container())
+        self.assertEqual('True', util.load_file(util.CONTAINER_CACHE_FILE))
+        # a later stage (process) only reads the persisted answer
+        util._IS_CONTAINER = None
+        self.assertTrue(util.is_container())
+
 
 class TestMultiLog(helpers.FilesystemMockingTestCase):
 
@@ -463,6 +707,102 @@ class TestMultiLog(helpers.FilesystemMockingTestCase):
         self.assertEqual((log_level, mock.ANY), log.log.call_args[0])
 
 
+def _gzip(data):
+    buf = six.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as fp:
+        fp.write(data)
+    return buf.getvalue()
+
+
+class TestDecompress(helpers.TestCase):
+    data = b"#cloud-config\npackages: [pastebinit]\n" * 10
+
+    def test_compression_type(self):
+        self.assertEqual('gzip', util.compression_type(_gzip(self.data)))
+        self.assertEqual('bzip2', util.compression_type(bz2.compress(b'')))
+        self.assertIsNone(util.compression_type(self.data))
+        self.assertIsNone(util.compression_type(u'#cloud-config'))
+        self.assertIsNone(util.compression_type(b''))
+
+    def test_gzip(self):
+        self.assertEqual(self.data.decode(),
+                         util.decompress(_gzip(self.data)))
+        self.assertEqual(self.data,
+                         util.decomp_gzip(_gzip(self.data), decode=False))
+
+    def test_bzip2(self):
+        self.assertEqual(self.data, util.decompress(bz2.compress(self.data),
+                                                    decode=False))
+
+    @helpers.skipIf(lzma is None, "No lzma module")
+    def test_xz_and_lzma(self):
+        blob = lzma.compress(self.data, format=lzma.FORMAT_XZ)
+        self.assertEqual(self.data,
+                         util.decompress(blob, quiet=False, decode=False))
+        # lzma (alone) has too weak a magic to be detected, only named
+        blob = lzma.compress(self.data, format=lzma.FORMAT_ALONE)
+        self.assertIsNone(util.compression_type(blob))
+        self.assertEqual(self.data, b''.join(
+            util.decompress_stream(blob, ctype='lzma')))
+
+    def test_concatenated_streams(self):
+        blob = _gzip(b'abc') + _gzip(b'def')
+        self.assertEqual(b'abcdef', util.decompress(blob, decode=False))
+        blob = bz2.compress(b'abc') + bz2.compress(b'def')
+        self.assertEqual(b'abcdef', util.decompress(blob, decode=False))
+
+    def test_uncompressed(self):
+        self.assertEqual(self.data, util.decompress(self.data))
+        self.assertRaises(util.DecompressionError, util.decompress,
+                          self.data, quiet=False)
+
+    def test_types_limit_formats(self):
+        blob = bz2.compress(self.data)
+        self.assertEqual(blob, util.decomp_gzip(blob))
+        self.assertRaises(util.DecompressionError, util.decomp_gzip,
+                          blob, quiet=False)
+
+    def test_corrupt(self):
+        blob = _gzip(self.data)
+        blob = blob[:12] + b'\x00' * 8 + blob[20:]
+        self.assertRaises(util.DecompressionError, util.decompress,
+                          blob, quiet=False)
+
+    def test_truncated(self):
+        for blob in (_gzip(self.data), bz2.compress(self.data)):
+            self.assertRaises(util.DecompressionError, util.decompress,
+                              blob[:-10], quiet=False)
+
+    def test_max_size(self):
+        size = len(self.data)
+        for blob in (_gzip(self.data), bz2.compress(self.data)):
+            self.assertEqual(self.data,
+                             util.decompress(blob, quiet=False, decode=False,
+                                             max_size=size))
+            self.assertRaises(util.DecompressionTooLarge, util.decompress,
+                              blob, quiet=False, max_size=size - 1)
+            self.assertEqual(blob, util.decompress(blob, max_size=size - 1))
+
+    def test_bomb_is_stopped_early(self):
+        # ~100MiB of zeros, compressed to ~100KiB
+        buf = six.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode="wb") as fp:
+            for _i in range(100):
+                fp.write(b'\x00' * 1024 * 1024)
+        chunks = []
+        try:
+            for chunk in util.decompress_stream(buf.getvalue(),
+                                                max_size=1024 * 1024,
+                                                chunk_size=4096):
+                chunks.append(len(chunk))
+        except util.DecompressionError:
+            pass
+        else:
+            self.fail("DecompressionError not raised")
+        self.assertTrue(sum(chunks) <= 1024 * 1024)
+        self.assertTrue(max(chunks) <= 4096)
+
+
 class TestMessageFromString(helpers.TestCase):
 
     def test_unicode_not_messed_up(self):
@@ -470,6 +810,74 @@ class TestMessageFromString(helpers.TestCase):
         self.assertNotIn('\x00', roundtripped)
 
 
+class TestWaitForPaths(helpers.TestCase):
+    def setUp(self):
+        super(TestWaitForPaths, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def _create_later(self, path, delay=0.2):
+        timer = threading.Timer(delay, util.write_file, (path, "here"))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def _no_inotify(self):
+        patcher = mock.patch.object(util, '_INOTIFY_LIBC', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_already_there(self):
+        path = os.path.join(self.tmp, "there")
+        util.write_file(path, "")
+        self.assertEqual(set(), util.wait_for_paths([path], maxwait=0))
+
+    def test_times_out(self):
+        paths = [os.path.join(self.tmp, "a"), os.path.join(self.tmp, "b")]
+        util.write_file(paths[0], "")
+        start = time.time()
+        self.assertEqual(set(paths[1:]),
+                         util.wait_for_paths(paths, maxwait=0.3, naplen=0.1))
+        self.assertTrue(0.3 <= time.time() - start < 2)
+
+    def test_deadline(self):
+        path = os.path.join(self.tmp, "a")
+        start = time.time()
+        self.assertEqual(set([path]), util.wait_for_paths(
+            [path], maxwait=60, deadline=start + 0.2, naplen=10))
+        self.assertTrue(time.time() - start < 2)
+
+    @helpers.skipIf(not util._inotify_libc(), "No inotify")
+    def test_wakes_on_create(self):
+        # created in a directory that doesn't exist yet either
+        path = os.path.join(self.tmp, "sub", "dir", "file")
+        self._create_later(path)
+        start = time.time()
+        self.assertEqual(set(), util.wait_for_paths([path], maxwait=30,
+                                                    naplen=30))
+        self.assertTrue(time.time() - start < 5)
+
+    def test_polls_without_inotify(self):
+        self._no_inotify()
+        path = os.path.join(self.tmp, "sub", "file")
+        self._create_later(path)
+        start = time.time()
+        self.assertEqual(set(), util.wait_for_paths([path], maxwait=30,
+                                                    naplen=0.1))
+        self.assertTrue(time.time() - start < 5)
+
+    def test_wait_for_result(self):
+        self._no_inotify()
+        calls = []
+
+        def check():
+            calls.append(None)
+            return len(calls) >= 3 and "done"
+
+        self.assertEqual("done", util.wait_for(check, lambda: [self.tmp],
+                                               maxwait=30, naplen=0.01))
+        self.assertEqual(3, len(calls))
+
+
 class TestReadSeeded(helpers.TestCase):
     def setUp(self):
         super(TestReadSeeded, self).setUp()
@@ -486,4 +894,95 @@ class TestReadSeeded(helpers.TestCase):
         self.assertEqual(found_md, {'key1': 'val1'})
         self.assertEqual(found_ud, ud)
 
+    def _reader(self, sessions, wait_for=0):
+        # Reads don't answer before wait_for of them have started (or the
+        # test is over), so they only succeed if they run concurrently.
+        all_started = threading.Event()
+        self.addCleanup(all_started.set)
+        started = []
+        self.timed_out = False
+
+        def read(url, *args, **kwargs):
+            started.append(url)
+            if len(started) >= wait_for:
+                all_started.set()
+            all_started.wait(5)
+            if not all_started.is_set():
+                self.timed_out = True
+            sessions.append(kwargs.get('session'))
+            if url.endswith('meta-data'):
+                return url_helper.StringResponse(b"key1: val1")
+            elif url.endswith('user-data'):
+                return url_helper.StringResponse(b"userdatablob")
+            raise url_helper.UrlError("not found", code=404, url=url)
+        return read
+
+    def test_network_concurrent(self):
+        sessions = []
+        read = self._reader(sessions, wait_for=2)
+        with mock.patch.object(util, 'read_file_or_url', side_effect=read):
+            (found_md, found_ud) = util.read_seeded("http://seed/")
+        self.assertFalse(self.timed_out)
+        self.assertEqual({'key1': 'val1'}, found_md)
+        self.assertEqual(b"userdatablob", found_ud)
+        self.assertEqual(2, len(sessions))
+        self.assertIs(sessions[0], sessions[1])
+
+    def test_network_deadline(self):
+        # the reads never get to answer before the deadline
+        read = self._reader([], wait_for=3)
+        with mock.patch.object(util, 'read_file_or_url', side_effect=read):
+            self.assertRaises(util.DeadlineExceededError, util.read_seeded,
+                              "http://seed/", deadline=0.2)
+
+    def test_network_error(self):
+        read = self._reader([])
+        with mock.patch.object(util, 'read_file_or_url', side_effect=read):
+            with self.assertRaises(url_helper.UrlError) as cm:
+                util.read_seeded("http://seed/", ext=".missing")
+        self.assertEqual(404, cm.exception.code)
+
+
+class TestSubp(helpers.TestCase):
+
+    def test_timeout_terminates_command(self):
+        start = time.time()
+        with self.assertRaises(util.ProcessExecutionError) as cm:
+            util.subp(['sleep', '30'], timeout=0.2)
+        self.assertLess(time.time() - start, 10)
+        self.assertIn('Timed out', cm.exception.reason)
+
+    def test_finished_command_not_timed_out(self):
+        # the timer firing just after the command finished
+        proc = mock.Mock()
+        proc.poll.return_value = 0
+        killer = util._ProcessKiller(proc, 10)
+        killer._expire()
+        self.assertFalse(killer.fired)
+        self.assertFalse(proc.terminate.called)
+
+    def test_output_cb_streams_lines(self):
+        lines = []
+        (out, err) = util.subp(['sh', '-c', 'echo one; echo two >&2'],
+                               output_cb=lambda *args: lines.append(args))
+        self.assertEqual(('', ''), (out, err))
+        self.assertEqual(sorted([('stdout', 'one\n'), ('stderr', 'two\n')]),
+                         sorted(lines))
+
+    def test_batch_keeps_order_and_errors(self):
+        results = util.subp_batch([['echo', 'a'], ['false'], ['echo', 'b']],
+                                  max_workers=2)
+        self.assertEqual(('a\n', ''), results[0])
+        self.assertIsInstance(results[1], util.ProcessExecutionError)
+        self.assertEqual(('b\n', ''), results[2])
+
+    def test_ledger_records_commands(self):
+        util.subp_ledger(clear=True)
+        util.subp(['true'])
+        util.subp(['sh', '-c', 'exit 3'], rcs=[3], logstring='secret')
+        entries = util.subp_ledger()
+        self.assertEqual([['true'], 'secret'],
+                         [entry['cmd'] for entry in entries])
+        self.assertEqual([0, 3], [entry['exit_code'] for entry in entries])
+
 # vi: ts=4 expandtab